@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+#
+# This file is a part of Definator (https://github.com/aparaatti/definator)
+# and it is licensed under the GPLv3 (http://www.gnu.org/licenses/gpl-3.0.txt).
+#
+__author__ = 'aparaatti'
+
+import os
+import logging
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+from .blob_store import BlobStore
+from .description import Description
+from .storage import TERM_DOCUMENTS
+
+
+class ScanReport(object):
+    """
+    Result of AttachmentScanner.scan.
+
+    orphans are the files in the term folders, that are not referenced by
+    links.json or the image tags of the description of the term. missing
+    has the names of the referenced files, that are not in the term folder,
+    by term. duplicates has the paths of the attached files with the same
+    content, that are not tracked by the blob store, by blob key. They are
+    looked for only, if the blob store is enabled, since otherwise storing
+    them once would not free space. The byte totals are the space the
+    orphans and the extra copies of the duplicates take.
+    """
+    def __init__(self):
+        self.terms = 0
+        self.orphans = list()
+        self.orphan_bytes = 0
+        self.missing = dict()
+        self.duplicates = dict()
+        self.duplicate_bytes = 0
+
+    @property
+    def reclaimable_bytes(self):
+        return self.orphan_bytes + self.duplicate_bytes
+
+    def __str__(self):
+        return str(self.terms) + " terms, " \
+            + str(len(self.orphans)) + " unreferenced files ("  \
+            + str(self.orphan_bytes) + " bytes), " \
+            + str(sum(len(paths) for paths in self.duplicates.values())) \
+            + " duplicate files (" + str(self.duplicate_bytes) + " bytes), " \
+            + str(sum(len(names) for names in self.missing.values())) \
+            + " missing files"
+
+
+class AttachmentScanner(object):
+    """
+    Finds the attached files, that take space in a project for nothing: the
+    files left in the term folders, eg. by an interrupted save, and the
+    copies of the same file, that are not tracked by the blob store.
+
+    The term folders are read in max_workers threads, since the scan is
+    mostly waiting for the file system. Only the documents saved to the
+    storage are read, so the terms with unsaved changes should not be
+    scanned.
+
+    reclaim moves the unreferenced files to the trash of the project and
+    replaces the duplicates with reflinks to the stored file, see
+    BlobStore.enabled.
+
+    :param project_path: the project path
+    :param storage: storage of the project
+    :param max_workers: number of threads reading the term folders
+    """
+    def __init__(self, project_path: Path, storage, max_workers: int=4):
+        self._project_path = project_path
+        self._storage = storage
+        self._max_workers = max_workers
+
+    def scan(self, term_strs: list):
+        """
+        Scans the folders of the given terms.
+
+        :return: ScanReport
+        """
+        report = ScanReport()
+        blobs = self._storage.blobs
+        if blobs is not None and not blobs.enabled:
+            blobs = None
+        with ThreadPoolExecutor(self._max_workers) as pool:
+            scanned = list(pool.map(self._scan_term, term_strs))
+
+            # Only the files with the size of another file or a stored file
+            # are hashed:
+            sizes = dict()
+            if blobs is not None:
+                for key in blobs.keys():
+                    size = os.stat(str(blobs.path_of(key))).st_size
+                    sizes[size] = sizes.get(size, 0) + 1
+            candidates = list()
+            for term_str, files, missing in scanned:
+                report.terms += 1
+                if missing:
+                    report.missing[term_str] = missing
+                for path, stat, referenced, key in files:
+                    if not referenced:
+                        report.orphans.append(path)
+                        report.orphan_bytes += stat.st_size
+                    elif key is None and blobs is not None:
+                        sizes[stat.st_size] = sizes.get(stat.st_size, 0) + 1
+                        candidates.append((path, stat))
+            candidates = [(path, stat) for path, stat in candidates
+                          if sizes[stat.st_size] > 1]
+            keys = pool.map(self._file_key, candidates)
+
+            groups = dict()
+            for (path, stat), key in zip(candidates, keys):
+                if key is not None:
+                    groups.setdefault(key, list()).append((path, stat))
+            for key, files in groups.items():
+                copies = len(files)
+                if not blobs.has(key):
+                    copies -= 1
+                if copies > 0:
+                    report.duplicates[key] = sorted(
+                        path for path, stat in files)
+                    report.duplicate_bytes += copies * files[0][1].st_size
+        report.orphans.sort()
+        return report
+
+    @staticmethod
+    def _file_key(candidate: tuple):
+        path, stat = candidate
+        try:
+            return BlobStore.file_key(path)
+        except OSError as e:
+            logging.warning("Could not read " + str(path) + ": " + str(e))
+            return None
+
+    def _scan_term(self, term_str: str):
+        """
+        Reads the folder and the documents of a term.
+
+        :return: the term, a list of (path, stat, referenced, blob key)
+            tuples of the files in the term folder and a list of the names
+            of the missing files
+        """
+        folder = self._project_path / term_str
+        if not folder.is_dir():
+            return term_str, [], []
+        try:
+            links = self._storage.load_json(folder / "links.json")
+        except (FileNotFoundError, ValueError) as e:
+            # Without the links nothing can be told about the files:
+            logging.warning("Not scanning " + term_str + ": " + str(e))
+            return term_str, [], []
+        names = set(links.get("files", [])) | set(links.get("images", []))
+        blob_keys = links.get("blobs", {})
+        try:
+            description = Description()
+            description.load(folder, self._storage)
+            names.update(path.name for path in description.added_image_paths)
+        except (FileNotFoundError, ValueError) as e:
+            logging.debug("No description for " + term_str + ": " + str(e))
+
+        files = list()
+        found = set()
+        with os.scandir(str(folder)) as entries:
+            for entry in entries:
+                if not entry.is_file() or entry.name.startswith('.') \
+                        or entry.name in TERM_DOCUMENTS:
+                    continue
+                found.add(entry.name)
+                files.append((Path(entry.path), entry.stat(),
+                              entry.name in names, blob_keys.get(entry.name)))
+        return term_str, files, sorted(names - found)
+
+    def reclaim(self, report: ScanReport):
+        """
+        Moves the unreferenced files of the report to the trash and replaces
+        the duplicates with reflinks to the stored file, see BlobStore.link.
+        The blob keys of the linked files are saved in links.json of the
+        terms.
+
+        :return: the number of bytes freed
+        """
+        freed = 0
+        blobs = self._storage.blobs
+        ref_keys = dict()
+        if blobs is not None:
+            for key, refs in blobs.refs.items():
+                for ref in refs:
+                    ref_keys[ref] = key
+        self._storage.begin()
+        try:
+            for path in report.orphans:
+                if path.is_file():
+                    freed += path.stat().st_size
+                    ref = path.relative_to(self._project_path).as_posix()
+                    self._storage.remove_attachment(path, ref_keys.get(ref))
+            if blobs is not None and report.duplicates:
+                blob_keys = dict()
+                for key, paths in report.duplicates.items():
+                    freed += self._link_duplicates(key, paths, blob_keys)
+                for folder, keys in blob_keys.items():
+                    links = self._storage.load_json(folder / "links.json")
+                    links.setdefault("blobs", dict()).update(keys)
+                    self._storage.save_json(folder / "links.json", links)
+            self._storage.save_attachments()
+        except:
+            self._storage.rollback()
+            raise
+        self._storage.commit()
+        return freed
+
+    def _link_duplicates(self, key: str, paths: list, blob_keys: dict):
+        """
+        Replaces the files with the same content with reflinks to the stored
+        file of the key.
+
+        :param blob_keys: the keys of the linked files are added here by
+            file name by term folder
+
+        :return: the number of bytes freed, the space of a file copied
+            instead of linked is not freed
+        """
+        blobs = self._storage.blobs
+        paths = [path for path in paths if path.is_file()]
+        if not paths:
+            return 0
+        freed = 0
+        size = paths[0].stat().st_size
+        if not blobs.has(key):
+            # The stored file takes the space of one of the copies:
+            blobs.add(paths[0], key)
+            freed -= size
+        for path in paths:
+            if blobs.link(key, path) == 0:
+                freed += size
+            self._storage.reference_file(path, key)
+            blob_keys.setdefault(path.parent, dict())[path.name] = key
+        return max(freed, 0)
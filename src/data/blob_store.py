@@ -0,0 +1,255 @@
+# -*- coding: utf-8 -*-
+#
+# This file is a part of Definator (https://github.com/aparaatti/definator)
+# and it is licensed under the GPLv3 (http://www.gnu.org/licenses/gpl-3.0.txt).
+#
+__author__ = 'aparaatti'
+
+import os
+import hashlib
+import logging
+from pathlib import Path
+
+from .json_helpers import temporary_path
+from .fs_helpers import make_dir, remove_file, clone_file, supports_reflinks
+
+BLOB_REFS = "refs.json"
+
+
+class BlobStore(object):
+    """
+    Attached files of a project stored once by their content.
+
+    A file is stored in the store folder named by the SHA-256 digest of its
+    content and its suffix (the key of the file). The attached files in the
+    term folders are reflinks to the stored files, so a file attached to
+    many terms takes the space of one file, and a file edited in place in a
+    term folder doesn't change the stored file or the other terms.
+
+    Files are stored only, if the file system of the project supports
+    reflinks (see enabled), since otherwise every copy in a term folder
+    would take space besides the stored file.
+
+    For each key the store keeps the paths of the attached files referring
+    to it. Files without references are removed, when the store is saved
+    and collected.
+
+    :param path: the store folder
+    :param storage: storage the references are saved with
+    """
+    # True or False to use instead of trying the file system, eg. in tests:
+    reflinks = None
+
+    def __init__(self, path: Path, storage):
+        self._path = path
+        self._storage = storage
+        self._refs = None
+        self._garbage = list()
+        self._dirty = False
+        self._enabled = None
+
+    @staticmethod
+    def file_key(path: Path):
+        """
+        Returns the key of the file: its SHA-256 digest and suffix.
+        """
+        digest = hashlib.sha256()
+        with path.open("rb") as file:
+            for block in iter(lambda: file.read(1024 * 1024), b""):
+                digest.update(block)
+        return digest.hexdigest() + path.suffix.lower()
+
+    @property
+    def enabled(self):
+        """
+        True if files are stored: the file system of the store folder
+        supports reflinks. Found out on first use.
+        """
+        if self._enabled is None:
+            self._enabled = BlobStore.reflinks
+        if self._enabled is None:
+            folder = self._path
+            while not folder.exists():
+                folder = folder.parent
+            self._enabled = supports_reflinks(folder)
+        return self._enabled
+
+    @property
+    def is_dirty(self):
+        return self._dirty
+
+    @property
+    def refs(self):
+        """
+        The referring paths by key, loaded on first use.
+        """
+        if self._refs is None:
+            self._refs = dict()
+            try:
+                data = self._storage.load_json(self._path / BLOB_REFS)
+                for key, paths in data.get("refs", {}).items():
+                    self._refs[key] = set(paths)
+            except (FileNotFoundError, ValueError) as e:
+                logging.debug("No blob references: " + str(e))
+        return self._refs
+
+    def path_of(self, key: str):
+        return self._path / key
+
+    def has(self, key: str):
+        return self.path_of(key).is_file()
+
+    def is_copy(self, key: str, path: Path):
+        """
+        True if the file is an unchanged copy of the stored file of the key:
+        the copies have the size and the modification time of the stored
+        file, so the file is not read.
+        """
+        try:
+            stat = os.stat(str(path))
+            blob_stat = os.stat(str(self.path_of(key)))
+        except OSError:
+            return False
+        return stat.st_size == blob_stat.st_size \
+            and stat.st_mtime_ns == blob_stat.st_mtime_ns
+
+    def add(self, src: Path, key: str=None):
+        """
+        Stores the file, unless a file with the same content is already
+        stored.
+
+        :param key: the key of the file, if it is known
+        :return: the key of the file and the number of bytes written
+        """
+        if key is None:
+            key = BlobStore.file_key(src)
+        blob = self.path_of(key)
+        if blob.exists():
+            return key, 0
+        if not self._path.exists():
+            os.makedirs(str(self._path))
+        tmp_path = temporary_path(blob)
+        written = clone_file(src, tmp_path)
+        os.replace(str(tmp_path), str(blob))
+        return key, written
+
+    def link(self, key: str, target: Path):
+        """
+        Makes the target path a reflink to the stored file, which shares the
+        data of the stored file until either one is changed, or a copy, if
+        the file system doesn't support reflinks after all.
+
+        :return: the number of bytes copied
+        """
+        blob = self.path_of(key)
+        tmp_path = temporary_path(target)
+        copied = clone_file(blob, tmp_path)
+        os.replace(str(tmp_path), str(target))
+        return copied
+
+    def keys(self):
+        """
+        Returns the keys of the stored files.
+        """
+        keys = list()
+        if self._path.is_dir():
+            with os.scandir(str(self._path)) as entries:
+                for entry in entries:
+                    if entry.is_file() and not entry.name.startswith('.') \
+                            and entry.name != BLOB_REFS:
+                        keys.append(entry.name)
+        return keys
+
+    def clone_from(self, other):
+        """
+        Copies the stored files and the references of another store into
+        this one, see clone_file.
+
+        :return: number of bytes copied
+        """
+        copied = 0
+        keys = other.keys()
+        if keys and not self._path.exists():
+            os.makedirs(str(self._path))
+        for key in keys:
+            if not self.has(key):
+                copied += clone_file(other.path_of(key), self.path_of(key))
+        self._refs = {key: set(paths) for key, paths in other.refs.items()}
+        self._dirty = True
+        return copied
+
+    def retain(self, term_strs: set):
+        """
+        Drops the references of the files in the term folders of other terms
+        than the given ones.
+        """
+        for key, paths in self.refs.items():
+            for ref in list(paths):
+                if ref.split('/')[0] not in term_strs:
+                    paths.discard(ref)
+                    self._dirty = True
+
+    def reference(self, key: str, ref: str):
+        paths = self.refs.setdefault(key, set())
+        if ref not in paths:
+            paths.add(ref)
+            self._dirty = True
+
+    def move(self, folder: str, new_folder: str):
+        """
+        Changes the references of the files in the folder to the new folder,
+        eg. when the folder of a term has been moved.
+        """
+        prefix = folder + '/'
+        for paths in self.refs.values():
+            moved = [ref for ref in paths if ref.startswith(prefix)]
+            for ref in moved:
+                paths.discard(ref)
+                paths.add(new_folder + '/' + ref[len(prefix):])
+            if moved:
+                self._dirty = True
+
+    def release_folder(self, folder: str):
+        """
+        Drops the references of the files in the folder, eg. when the folder
+        of a term has been removed.
+        """
+        prefix = folder + '/'
+        for paths in self.refs.values():
+            released = [ref for ref in paths if ref.startswith(prefix)]
+            if released:
+                paths.difference_update(released)
+                self._dirty = True
+
+    def release(self, key: str, ref: str):
+        paths = self.refs.get(key)
+        if paths is not None and ref in paths:
+            paths.discard(ref)
+            self._dirty = True
+
+    def save(self):
+        """
+        Saves the references. Keys without references are dropped and their
+        files are removed by collect.
+        """
+        for key, paths in list(self.refs.items()):
+            if not paths:
+                del self._refs[key]
+                self._garbage.append(key)
+        if not self._path.exists() and self._storage.uses_term_folders:
+            make_dir(self._path)
+        self._storage.save_json(self._path / BLOB_REFS, {
+            "version": 1,
+            "refs": {key: sorted(paths) for key, paths in self._refs.items()}})
+        self._dirty = False
+
+    def collect(self):
+        """
+        Removes the stored files dropped by the latest save, unless they have
+        been referenced again.
+        """
+        for key in self._garbage:
+            if key not in self.refs and self.has(key):
+                logging.debug("Removing unreferenced blob " + key)
+                remove_file(self.path_of(key))
+        self._garbage = list()
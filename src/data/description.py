@@ -1,5 +1,7 @@
+import itertools
 from .json_helpers import *
 from .fs_helpers import *
+from .storage import FOLDER_STORAGE
 
 from .items import Title, AttachedImage, Paragraph, ASCII, BulletList
 
@@ -10,31 +12,111 @@ class Description(object):
     content in chronological order.
 
     Description can have Titles, Paragraphs and ImagePaths.
+
+    Setting the content gives the description a new version number, which is
+    used to tell whether HTML rendered from it is still current.
     """
+    _versions = itertools.count(1)
+
     # TODO use markup tags, and maby markup library!
     def __init__(self):
         self._path = Path()
         self._content = list()
         self._attached_images = dict()
         self._old_content = tuple()
+        # Changed since load or save:
+        self._dirty = True
+        self._version = next(Description._versions)
 
     def __str__(self):
         return str(self._content)
 
-    def load(self, path: Path):
-        content = load_json(path / "description.json", DescriptionDecoder())
+    def copy(self):
+        """
+        Returns a copy of this Description. The content list is copied, the
+        content items are shared, since they are not changed after parsing.
+        """
+        description = Description()
+        description._path = self._path
+        description._content = list(self._content)
+        description._attached_images = dict(self._attached_images)
+        description._dirty = self._dirty
+        description._version = self._version
+        return description
+
+    def load(self, path: Path, storage=FOLDER_STORAGE):
+        """
+        Loads the description from the term folder in the given path. Both
+        the structured format and the older list of prefixed strings are
+        read.
+        """
+        decoder = DescriptionDecoder(path)
+        content = storage.load_json(path / "description.json", decoder)
         self._path = path
         self._content = content
-        # Generate ImagePath objects from tags in text:
-        self.content_text = self.content_text
-
-    def save(self, path: Path):
+        self._version = next(Description._versions)
+        if decoder.attached_images is None:
+            # The older format has the images only as tags in the paragraphs,
+            # generate ImagePath objects from tags in text:
+            self.content_text = self.content_text
+        else:
+            self._attached_images = decoder.attached_images
+        self._dirty = False
+
+    def save(self, path: Path, storage=FOLDER_STORAGE):
         self._path = path
-        save_json(path / "description.json", self, DescriptionEncoder())
+        storage.save_json(path / "description.json", self,
+                          DescriptionEncoder())
+        self._dirty = False
+
+    @property
+    def is_dirty(self):
+        """
+        True if the description has changed after it was loaded or saved.
+        """
+        return self._dirty
+
+    @property
+    def version(self):
+        return self._version
 
-    def delete(self):
+    @property
+    def estimated_size(self):
+        """
+        Rough estimate of the memory used by the content in bytes.
+        """
+        size = 0
+        for item in self._content:
+            size += 200
+            if type(item) is BulletList:
+                size += 2 * sum(len(text) for text in item.items)
+            elif type(item) is not AttachedImage:
+                size += 2 * len(item.text)
+        return size
+
+    @property
+    def has_external_images(self):
+        """
+        True if an image in the description is outside of the term folder and
+        needs to be copied there on save.
+        """
+        for ip in self._attached_images.values():
+            if len(ip.path.parts) > 1 and ip.path.parent != self._path:
+                return True
+        return False
+
+    @property
+    def missing_images(self):
+        """
+        Paths of the images in the description, that don't exist. Checked
+        when asked, with one listing of each folder the images are in.
+        """
+        return [ip.path for ip in self._attached_images.values()
+                if not FOLDER_LISTING.exists(ip.path)]
+
+    def delete(self, storage=FOLDER_STORAGE):
         # Linker handles removing of linked files.
-        remove_file(self._path / "description.json")
+        storage.remove(self._path / "description.json")
 
     @property
     def path(self):
@@ -87,12 +169,30 @@ class Description(object):
 
         return "".join(content_text_list).strip(os.linesep)
 
+    @property
+    def plain_text(self):
+        """
+        The text of the description without tags, eg. the text of the
+        paragraphs, titles, bullet lists and ASCII fields. Used for searching.
+        """
+        text_list = list()
+        for item in self._content:
+            if type(item) is Paragraph:
+                text_list.append(AttachedImage.remove_tags(str(item)))
+            elif type(item) is Title:
+                text_list.append(item.title)
+            elif type(item) is BulletList:
+                text_list.extend(item.text_items)
+            elif type(item) is ASCII:
+                text_list.append(item.lines)
+        return os.linesep.join(text_list)
+
     @content_text.setter
     def content_text(self, text: str):
         """
         This resets the content.
 
-        Text is plit in chunks divided by two or more lineseparators.
+        Text is split in chunks divided by two or more line separators.
 
         Text chunk that isn't surrounded with a known tag is a Paragraph.
 
@@ -113,39 +213,41 @@ class Description(object):
         Text chunk that dosen't start and end with a known tags is a Paragraph.
 
         :param text: Str containing text annotated with tags.
-
-        TODO: Using streams?
         """
         logging.debug("  --------------SETTING DESCRIPTION TEXT--------------")
+        self._dirty = True
+        self._version = next(Description._versions)
         self._content.clear()
         self._attached_images.clear()
-        split_text = list()
-        for s in text.split(os.linesep + os.linesep):
-            split_text.append(s.strip(os.linesep))
-
-        for part in split_text:
-            index_before_tags = len(self._content)
-            self._parse_tags_from_text(part)
-
-            if BulletList.parse_bullet_list_from_text(part):
-                self._content.insert(index_before_tags, BulletList.instance)
-            elif ASCII.parse_ascii_from_text(part):
-                self._content.insert(index_before_tags, ASCII.instance)
-            elif part.startswith("##") and part.endswith("##"):
-                self._content.insert(index_before_tags, Title(part[2:-2]))
-            else:
-                self._content.insert(index_before_tags, Paragraph(part))
+        self._content.extend(self._parse_chunks(text))
+
+    def _parse_chunks(self, text: str):
+        """
+        Parses content items from the chunks of the text in one pass. The
+        items are yielded in the order of the text, each new AttachedImage
+        before the item of the chunk it is in.
+        """
+        for chunk in text.split(os.linesep + os.linesep):
+            yield from self._parse_chunk(chunk.strip(os.linesep))
 
-    def _parse_tags_from_text(self, text: str):
+    def _parse_chunk(self, text: str):
         """
-        This parses tags that are inside the text ie
-        AttachedImages. Only the first occurrence is appended before
-        in to the content list.
+        Yields the new AttachedImages in the chunk and the item of the chunk.
         """
-        for ip in AttachedImage.parse_imgs_from_str(text, self._path):
-            if not self._attached_images.get(str(ip.path.name)):
-                self._attached_images[str(ip.path.name)] = ip
-                self._content.append(ip)
+        if "#img(" in text:
+            for ip in AttachedImage.parse_imgs_from_str(text, self._path):
+                if not self._attached_images.get(str(ip.path.name)):
+                    self._attached_images[str(ip.path.name)] = ip
+                    yield ip
+
+        if text.startswith("##LIST##") and text.endswith("##END##"):
+            yield BulletList(text.split(os.linesep)[1:-1])
+        elif text.startswith("##ASCII##") and text.endswith("##END##"):
+            yield ASCII(os.linesep.join(text.split(os.linesep)[1:-1]))
+        elif text.startswith("##") and text.endswith("##"):
+            yield Title(text[2:-2])
+        else:
+            yield Paragraph(text)
 
     @property
     def added_image_paths(self):
@@ -161,39 +263,71 @@ class Description(object):
 
 
 class DescriptionEncoder(json.JSONEncoder):
-    """ Encodes a Description object to JSON eg. saves Description self.content
-    str attributes as JSON array
-
-    Only Paragraphs and Titles are saved, since in text objects can be parsed
-    from Paragraphs.
+    """ Encodes a Description object to JSON as an object with the content
+    items in order and a table of the attached images by file name:
+
+        {"version": 2,
+         "items": [{"type": "image", "name": "cat.png"},
+                   {"type": "paragraph", "text": "A #img(\"cat.png\",\"Cat\")."},
+                   {"type": "title", "text": "Title"},
+                   {"type": "list", "items": ["run", "sit"]},
+                   {"type": "ascii", "lines": "^--^"}],
+         "images": {"cat.png": {"title": "Cat"}}}
+
+    The image tags in the paragraphs are written with the file name only,
+    since the images are copied to the term folder on save.
     """
-    # TODO It may make sense to parse all the objects already, tough the tags
-    # still need to be parsed from paragraph to make use of the content.
+    version = 2
+
     def default(self, obj):
         if isinstance(obj, Description):
-            str_list = list()
+            items = list()
             for item in obj._content:
                 if type(item) is Paragraph:
                     paragraph = str(item)
                     for ai in obj._attached_images.values():
                         paragraph = paragraph.replace(
                             ai.image_tag, ai.image_tag_name_only)
-                    str_list.append("Paragraph:" + paragraph)
+                    items.append({"type": "paragraph", "text": paragraph})
+                elif type(item) is AttachedImage:
+                    items.append({"type": "image", "name": item.path.name})
                 elif type(item) is Title:
-                    str_list.append("Title:" + item.title)
+                    items.append({"type": "title", "text": item.title})
                 elif type(item) is ASCII:
-                    str_list.append("ASCII:" + item.lines)
+                    items.append({"type": "ascii", "lines": item.lines})
                 elif type(item) is BulletList:
-                    str_list.append("BulletList:" + "<>".join(item._items))
-            return str_list
+                    items.append({"type": "list", "items": item.text_items})
+            images = dict()
+            for name, ai in obj._attached_images.items():
+                images[name] = {"title": ai.title}
+            return {"version": DescriptionEncoder.version, "items": items,
+                    "images": images}
         # Let the base class default method raise the TypeError
         return json.JSONEncoder.default(self, obj)
 
 
 class DescriptionDecoder(json.JSONDecoder):
-    """ Decodes an Terms object from JSON. """
+    """ Decodes the content items of a Description from JSON.
+
+    The attached images of the structured format are set to
+    self.attached_images by file name, without checking that the files
+    exist. For the older format, which is a list of strings prefixed with
+    the item type, self.attached_images is None and the images have to be
+    parsed from the paragraphs.
+
+    :param path: path of the term folder, where the images are
+    """
+    def __init__(self, path: Path=Path()):
+        super().__init__()
+        self._path = path
+        self.attached_images = None
+
     def decode(self, s):
-        data = list(json.JSONDecoder.decode(self, s))
+        data = json.JSONDecoder.decode(self, s)
+        if isinstance(data, dict):
+            return self._decode_items(data)
+
+        self.attached_images = None
         content = list()
         for s in data:
             if s.startswith("Paragraph:"):
@@ -205,3 +339,27 @@ class DescriptionDecoder(json.JSONDecoder):
             elif s.startswith("BulletList:"):
                 content.append(BulletList(s[11:].split("<>"), True))
         return content
+
+    def _decode_items(self, data: dict):
+        self.attached_images = dict()
+        images = data.get("images", {})
+        content = list()
+        for item in data.get("items", []):
+            item_type = item.get("type")
+            if item_type == "paragraph":
+                content.append(Paragraph(item["text"]))
+            elif item_type == "image":
+                name = item["name"]
+                title = images.get(name, {}).get("title", Path(name).stem)
+                ai = AttachedImage.from_name(name, title, self._path)
+                self.attached_images[name] = ai
+                content.append(ai)
+            elif item_type == "title":
+                content.append(Title(item["text"]))
+            elif item_type == "ascii":
+                content.append(ASCII(item["lines"]))
+            elif item_type == "list":
+                content.append(BulletList(item["items"]))
+            else:
+                logging.warning("Unknown description item: " + str(item))
+        return content
@@ -7,9 +7,21 @@ __author__ = 'aparaatti'
 
 import os
 import logging
+import time
 import shutil
+import tempfile
 from pathlib import Path
 
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# ioctl request to make a file share the data of another file (Linux):
+FICLONE = 0x40049409
+# Whether the file system supports reflinks by device, see supports_reflinks:
+_reflinks = dict()
+
 def remove_file(file_path: Path):
     logging.debug('-------------------------( Removing file: ' + str(
         file_path) + '! )')
@@ -19,9 +31,161 @@ def remove_file(file_path: Path):
 def copy_file_to(src: Path, target: Path):
     logging.debug('-------------------------( Copying file "' + str(src) +
                   '" to "' + str(target / src.name))
-    shutil.copy2(str(src), str(target / src.name))
+    clone_file(src, target / src.name)
+
+
+def clone_file(src: Path, dst: Path):
+    """
+    Copies the file and its metadata with the fastest way the file system
+    supports: as a reflink, which shares the data of the file until either
+    copy is changed, or with copy_file_range, which copies the data in the
+    kernel, or by reading and writing it.
+
+    :return: number of bytes copied, 0 for a reflink
+    """
+    with open(str(src), 'rb') as src_file, open(str(dst), 'wb') as dst_file:
+        size = os.fstat(src_file.fileno()).st_size
+        copied = _reflink(src_file, dst_file, size)
+        if copied is None:
+            copied = _copy_file_range(src_file, dst_file, size)
+        if copied is None:
+            src_file.seek(0)
+            dst_file.seek(0)
+            dst_file.truncate()
+            shutil.copyfileobj(src_file, dst_file, 1024 * 1024)
+            copied = size
+    shutil.copystat(str(src), str(dst))
+    return copied
+
+
+def supports_reflinks(folder: Path):
+    """
+    True if the files in the folder can be copied as reflinks. Tried once
+    for each file system by copying a temporary file in the folder.
+    """
+    device = os.stat(str(folder)).st_dev
+    if device not in _reflinks:
+        try:
+            fd, path = tempfile.mkstemp(prefix=".reflink", dir=str(folder))
+        except OSError as e:
+            logging.debug("Could not try reflinks in " + str(folder) + ": "
+                          + str(e))
+            return False
+        clone = path + ".clone"
+        try:
+            with os.fdopen(fd, "wb") as file:
+                file.write(b"reflink")
+            _reflinks[device] = clone_file(Path(path), Path(clone)) == 0
+        finally:
+            for tmp_path in [path, clone]:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+    return _reflinks[device]
+
+
+def _reflink(src_file, dst_file, size: int):
+    if fcntl is None or size == 0:
+        return None
+    try:
+        fcntl.ioctl(dst_file.fileno(), FICLONE, src_file.fileno())
+        return 0
+    except OSError:
+        return None
+
+
+def _copy_file_range(src_file, dst_file, size: int):
+    if not hasattr(os, "copy_file_range"):
+        return None
+    copied = 0
+    try:
+        while copied < size:
+            count = os.copy_file_range(src_file.fileno(), dst_file.fileno(),
+                                       size - copied)
+            if count == 0:
+                break
+            copied += count
+    except OSError:
+        return None
+    return copied if copied == size else None
 
 def make_dir(dir: Path):
     logging.debug('-------------------------( Creating dir: "' + str(dir) +
                   "'.")
-    os.mkdir(str(dir))
\ No newline at end of file
+    os.mkdir(str(dir))
+
+def sync_to_disk(paths: list):
+    """
+    Flushes the given files and directories to disk with one fsync each,
+    eg. the temporary files of a transaction or the folders, in which they
+    have been renamed. Missing paths and directories, that can't be
+    opened, eg. on Windows, are skipped.
+    """
+    for path in paths:
+        try:
+            fd = os.open(str(path), os.O_RDONLY)
+        except OSError:
+            if path.is_file():
+                raise
+            continue
+        try:
+            os.fsync(fd)
+        except OSError:
+            if not path.is_dir():
+                raise
+        finally:
+            os.close(fd)
+
+
+class FolderListing(object):
+    """
+    Names of the entries in folders. A folder is read with one scandir and
+    read again only when its modification time changes, eg. when entries
+    are added, removed or renamed.
+
+    A listing taken within a second after the folder was modified is not
+    reused, since a change in the same second might not change the
+    modification time on every file system.
+    """
+    racy_ns = 1000000000
+
+    def __init__(self):
+        # folder -> (modification time, time listed, names):
+        self._listings = dict()
+
+    def names(self, folder: Path):
+        """
+        Returns the names in the folder as a frozenset, empty if the folder
+        doesn't exist.
+        """
+        try:
+            mtime = os.stat(str(folder)).st_mtime_ns
+        except OSError:
+            self._listings.pop(folder, None)
+            return frozenset()
+
+        listing = self._listings.get(folder)
+        if listing is not None and listing[0] == mtime \
+                and listing[1] - mtime > FolderListing.racy_ns:
+            return listing[2]
+
+        listed = time.time_ns()
+        try:
+            with os.scandir(str(folder)) as entries:
+                names = frozenset(entry.name for entry in entries)
+        except OSError:
+            return frozenset()
+        self._listings[folder] = (mtime, listed, names)
+        return names
+
+    def exists(self, path: Path):
+        """
+        True if there is an entry with the name of the path in its folder.
+        """
+        return path.name in self.names(path.parent)
+
+    def clear(self):
+        self._listings.clear()
+
+
+# Listings shared by the whole application:
+FOLDER_LISTING = FolderListing()
@@ -9,6 +9,9 @@ class AttachedImage(object):
     """
     This class represents an image tag. It provides method
     parse_imgs_from_str to parse image tags from text.
+
+    The image file is not checked to exist when the tag is parsed, see
+    Description.missing_images.
     """
 
     _img_tag_pattern = re.compile('#img\([^)]*\)')
@@ -16,20 +19,27 @@ class AttachedImage(object):
 
     @staticmethod
     def parse_imgs_from_str(text: str, parent_path: Path):
-        attached_images = list()
+        """
+        Returns the AttachedImages of the tags in the text. Only the first
+        tag of an image with the same file name is returned.
+        """
+        attached_images = dict()
 
         match_iterator = AttachedImage._img_tag_pattern.finditer(text)
         for match in match_iterator:
             try:
                 ip = AttachedImage(match.group(), parent_path)
-                if ip and ip not in attached_images:
-                    attached_images.append(ip)
+                attached_images.setdefault(ip.path.name, ip)
             except ValueError as e:
                 logging.warning(e.args[0] + str(match))
-            except IsADirectoryError:
-                logging.warnign("Could not parse tag: " + str(match) +
-                                " no file specified.")
-        return attached_images
+        return list(attached_images.values())
+
+    @staticmethod
+    def remove_tags(text: str):
+        """
+        Returns the text with the image tags removed.
+        """
+        return AttachedImage._img_tag_pattern.sub("", text)
 
     def _parse(self, string):
         """
@@ -57,14 +67,25 @@ class AttachedImage(object):
             self._title = str(self._path.stem)
 
         self._tag = string
-        if not self.path.exists():
-            raise ValueError("File does not exist: " + str(self.path))
 
         logging.debug(
             "Img self._path set to: " + str(self._path) + os.linesep +
             "        self.path set to: " + str(self.path))
         return self
 
+    @staticmethod
+    def from_name(name: str, title: str, parent_path: Path):
+        """
+        Returns an AttachedImage for an image in the parent path, as saved
+        with its file name only. The file is not checked to exist.
+        """
+        ip = AttachedImage.__new__(AttachedImage)
+        ip._path = Path(name)
+        ip._parent_path = parent_path
+        ip._title = title
+        ip._tag = ip.image_tag_name_only
+        return ip
+
     def __init__(self, title_tag: str, parent_path: Path):
         self._path = Path()
         self._parent_path = parent_path
@@ -174,16 +195,6 @@ class Title(object):
 
 
 class ASCII(object):
-    instance = None
-
-    @staticmethod
-    def parse_ascii_from_text(text):
-        lines = text.split(os.linesep)
-        if lines[0].startswith("##ASCII##") and\
-           lines[-1].endswith("##END##"):
-                ASCII.instance = ASCII(os.linesep.join(lines[1:-1]))
-                return True
-        return False
 
     def __init__(self, lines: str):
         self._lines = lines
@@ -203,15 +214,6 @@ class ASCII(object):
 
 
 class BulletList(object):
-    instance = None
-
-    @staticmethod
-    def parse_bullet_list_from_text(text: str):
-        if text.startswith("##LIST##") and\
-           text.endswith("##END##"):
-            BulletList.instance = BulletList(text.split(os.linesep)[1:-1])
-            return True
-        return False
 
     def __init__(self, str_list: list, escaped: bool=False):
         escaped = list()
@@ -231,6 +233,13 @@ class BulletList(object):
     def items(self):
         return self._items
 
+    @property
+    def text_items(self):
+        """
+        The items of the list as they were written, eg. not html escaped.
+        """
+        return self._un_escaped_items
+
     @property
     def text(self):
         return "##LIST##" + os.linesep \
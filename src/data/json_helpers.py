@@ -1,3 +1,4 @@
+import os
 import json
 from pathlib import Path
 
@@ -22,13 +23,44 @@ def load_json(path: Path, decoder=json.JSONDecoder()):
         raise e
 
 
-def save_json(path: Path, obj, encoder=json.JSONEncoder()):
+def temporary_path(path: Path):
+    """
+    Returns the path of the temporary file used, when the given path is
+    written. The name starts with a dot, so it is not taken for an attached
+    file.
     """
+    return path.with_name("." + path.name + ".tmp")
+
+
+def write_json(path: Path, obj, encoder=json.JSONEncoder(), sync: bool=True):
+    """
+    Writes the object as JSON directly to the path.
+
+    :param sync: if False, the data is not flushed to disk before returning.
+    :return: number of bytes written
     """
-    if not path.exists():
-        path.touch()
-    file = open(str(path), "w")
-    file.truncate()
     encoder.indent = 2
-    file.write(encoder.encode(obj))
-    file.close()
+    data = encoder.encode(obj).encode()
+    file = open(str(path), "wb")
+    try:
+        file.write(data)
+        if sync:
+            file.flush()
+            os.fsync(file.fileno())
+    finally:
+        file.close()
+    return len(data)
+
+
+def save_json(path: Path, obj, encoder=json.JSONEncoder()):
+    """
+    Writes the object as JSON into a temporary file next to the path, flushes
+    it to disk and renames it over the path. A crash leaves either the old
+    or the new file in place, never a partially written one.
+
+    :return: number of bytes written
+    """
+    tmp_path = temporary_path(path)
+    byte_count = write_json(tmp_path, obj, encoder)
+    os.replace(str(tmp_path), str(path))
+    return byte_count
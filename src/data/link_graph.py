@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+#
+# This file is a part of Definator (https://github.com/aparaatti/definator)
+# and it is licensed under the GPLv3 (http://www.gnu.org/licenses/gpl-3.0.txt).
+#
+__author__ = 'aparaatti'
+
+from pathlib import Path
+
+from .storage import FOLDER_STORAGE, PROJECT_META
+
+GRAPH = "graph.json"
+
+
+class LinkGraph(object):
+    """
+    Links between the terms of a project as adjacency sets.
+
+    For each term the graph keeps the terms it links to, in the order they
+    were linked, and the terms linking to it (backlinks), so the related
+    terms, the backlinks and whether two terms are linked are answered
+    without going through the other terms. The links of the whole project
+    are persisted in one file in the project meta folder.
+
+    >>> graph = LinkGraph()
+    >>> graph.link("cat", "animal")
+    >>> graph.link("cow", "animal")
+    >>> graph.is_linked("cat", "animal")
+    True
+    >>> sorted(graph.backlinks("animal"))
+    ['cat', 'cow']
+    >>> graph.remove_term("cat")
+    >>> sorted(graph.backlinks("animal"))
+    ['cow']
+    >>> graph.rename_term("animal", "mammal")
+    >>> graph.related("cow")
+    ['mammal']
+    """
+    def __init__(self):
+        # term -> terms it links to as an ordered set (dict keys):
+        self._links = dict()
+        # term -> terms linking to it:
+        self._backlinks = dict()
+        self._dirty = False
+
+    def __contains__(self, term_str):
+        return term_str in self._links
+
+    def __len__(self):
+        return len(self._links)
+
+    @property
+    def terms(self):
+        return set(self._links.keys())
+
+    @property
+    def is_dirty(self):
+        return self._dirty
+
+    @is_dirty.setter
+    def is_dirty(self, dirty: bool):
+        self._dirty = dirty
+
+    def copy(self):
+        """
+        Returns a copy of the graph, eg. to save it in another thread.
+        """
+        graph = LinkGraph()
+        graph._links = {term_str: dict(related)
+                        for term_str, related in self._links.items()}
+        graph._backlinks = {term_str: set(linking)
+                            for term_str, linking in self._backlinks.items()}
+        graph._dirty = self._dirty
+        return graph
+
+    def add_term(self, term_str: str):
+        if term_str not in self._links:
+            self._links[term_str] = dict()
+            self._backlinks[term_str] = set()
+            self._dirty = True
+
+    def remove_term(self, term_str: str):
+        """
+        Removes the term and all the links from and to it.
+        """
+        if term_str not in self._links:
+            return
+        for related in self._links.pop(term_str):
+            self._backlinks[related].discard(term_str)
+        for linking in self._backlinks.pop(term_str):
+            self._links[linking].pop(term_str, None)
+        self._dirty = True
+
+    def rename_term(self, term_str: str, new_term_str: str):
+        """
+        Renames the term keeping the links from and to it. Only the links of
+        the neighbours of the term are changed. The order of the related
+        terms of the terms linking to it is kept.
+        """
+        if term_str not in self._links or new_term_str in self._links:
+            return
+        related = self._links.pop(term_str)
+        linking = self._backlinks.pop(term_str)
+        if term_str in related:
+            # The term links to itself:
+            related = {new_term_str if other == term_str else other: None
+                       for other in related}
+            linking = {new_term_str if other == term_str else other
+                       for other in linking}
+        self._links[new_term_str] = related
+        self._backlinks[new_term_str] = linking
+        for other in related:
+            if other != new_term_str:
+                self._backlinks[other].discard(term_str)
+                self._backlinks[other].add(new_term_str)
+        for other in linking:
+            if other != new_term_str:
+                self._links[other] = {
+                    new_term_str if linked == term_str else linked: None
+                    for linked in self._links[other]}
+        self._dirty = True
+
+    def link(self, term_str: str, related: str):
+        """
+        Adds a link from the term to the related term. Terms, that are not
+        in the graph, are added.
+        """
+        self.add_term(term_str)
+        self.add_term(related)
+        if related not in self._links[term_str]:
+            self._links[term_str][related] = None
+            self._backlinks[related].add(term_str)
+            self._dirty = True
+
+    def unlink(self, term_str: str, related: str):
+        if related in self._links.get(term_str, ()):
+            del self._links[term_str][related]
+            self._backlinks[related].discard(term_str)
+            self._dirty = True
+
+    def set_related(self, term_str: str, related_terms: list):
+        """
+        Replaces the links from the term with links to the given terms.
+        """
+        for related in list(self._links.get(term_str, ())):
+            self.unlink(term_str, related)
+        self.add_term(term_str)
+        for related in related_terms:
+            self.link(term_str, related)
+
+    def related(self, term_str: str):
+        """
+        Returns the terms the term links to as a list in the order they were
+        linked.
+        """
+        return list(self._links.get(term_str, ()))
+
+    def backlinks(self, term_str: str):
+        """
+        Returns the terms linking to the term as a set.
+        """
+        return set(self._backlinks.get(term_str, ()))
+
+    def is_linked(self, term_str: str, related: str):
+        return related in self._links.get(term_str, ())
+
+    def load(self, project_path: Path, storage=FOLDER_STORAGE):
+        """
+        Loads the links of the project.
+
+        :raise FileNotFoundError: if the project doesn't have a link graph.
+        """
+        data = storage.load_json(project_path / PROJECT_META / GRAPH)
+        self._links = dict()
+        self._backlinks = dict()
+        for term_str, related_terms in data.get("links", {}).items():
+            self.add_term(term_str)
+            for related in related_terms:
+                self.link(term_str, related)
+        self._dirty = False
+
+    def save(self, project_path: Path, storage=FOLDER_STORAGE):
+        meta = project_path / PROJECT_META
+        if storage.uses_term_folders and not meta.exists():
+            meta.mkdir()
+        storage.save_json(meta / GRAPH, {
+            "version": 1,
+            "links": {term_str: list(related)
+                      for term_str, related in self._links.items()}})
+        self._dirty = False
@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+#
+# This file is a part of Definator (https://github.com/aparaatti/definator)
+# and it is licensed under the GPLv3 (http://www.gnu.org/licenses/gpl-3.0.txt).
+#
+__author__ = 'aparaatti'
+
+import os
+import json
+import logging
+import threading
+from pathlib import Path
+
+from .json_helpers import temporary_path
+from .fs_helpers import remove_file, make_dir
+from .storage import PROJECT_META
+
+OPERATIONS = "operations.jsonl"
+
+
+class OperationJournal(object):
+    """
+    Append-only journal of the changes made to a project, kept in the project
+    meta folder. An operation is a dictionary, that is written as one line
+    of JSON, when it is appended. The journal file is made on the first
+    append and flushed to the operating system after each operation, so the
+    changes survive the application dying before the project is saved. They
+    are flushed to disk, eg. to survive a power failure, only by flush.
+
+    The operations written to the project documents are dropped from the
+    beginning of the journal with compact, which may be called from another
+    thread than append.
+
+    >>> import tempfile
+    >>> journal = OperationJournal(Path(tempfile.mkdtemp()))
+    >>> journal.append({"op": "remove", "term": "cat"})
+    >>> journal.append({"op": "remove", "term": "dog"})
+    >>> journal.compact(1)
+    >>> OperationJournal(journal.path.parent.parent).read()
+    [{'op': 'remove', 'term': 'dog'}]
+
+    :param project_path: path of the project
+    """
+    def __init__(self, project_path: Path):
+        self.path = project_path / PROJECT_META / OPERATIONS
+        self._file = None
+        self._count = 0
+        self._lock = threading.Lock()
+
+    @property
+    def count(self):
+        """
+        Number of operations in the journal.
+        """
+        return self._count
+
+    def read(self):
+        """
+        Returns the operations in the journal as a list. An operation, that
+        was not completely written, and the ones after it are dropped from
+        the journal.
+        """
+        with self._lock:
+            operations = list()
+            if not self.path.exists():
+                self._count = 0
+                return operations
+            with self.path.open("r", encoding="utf-8") as file:
+                lines = file.read().split("\n")
+            for line in lines:
+                if not line:
+                    continue
+                try:
+                    operations.append(json.loads(line))
+                except ValueError:
+                    logging.warning("Dropping a partially written operation "
+                                    "from: " + str(self.path))
+                    self._rewrite(operations)
+                    break
+            self._count = len(operations)
+            return operations
+
+    def append(self, operation: dict):
+        """
+        Writes the operation to the end of the journal. The file is flushed
+        to the operating system, see flush for flushing it to disk.
+        """
+        line = json.dumps(operation) + "\n"
+        with self._lock:
+            if self._file is None:
+                if not self.path.parent.exists():
+                    make_dir(self.path.parent)
+                self._file = self.path.open("a", encoding="utf-8")
+            self._file.write(line)
+            self._file.flush()
+            self._count += 1
+
+    def flush(self):
+        """
+        Flushes the journal to disk.
+        """
+        with self._lock:
+            if self._file is not None:
+                os.fsync(self._file.fileno())
+
+    def compact(self, count: int):
+        """
+        Drops the first count operations, eg. the ones that have been
+        written to the project documents.
+        """
+        with self._lock:
+            if count <= 0 or not self.path.exists():
+                return
+            with self.path.open("r", encoding="utf-8") as file:
+                lines = [line for line in file.read().split("\n") if line]
+            self._rewrite([json.loads(line) for line in lines[count:]])
+            self._count = max(self._count - count, 0)
+
+    def clear(self):
+        """
+        Drops all the operations, eg. when the changes are discarded.
+        """
+        with self._lock:
+            self._close()
+            if self.path.exists():
+                remove_file(self.path)
+            self._count = 0
+
+    def _rewrite(self, operations: list):
+        """
+        Replaces the journal with the operations. The journal file is
+        replaced atomically, so a crash leaves either the old or the new
+        journal in place.
+        """
+        self._close()
+        if not operations:
+            remove_file(self.path)
+            return
+        tmp_path = temporary_path(self.path)
+        with tmp_path.open("w", encoding="utf-8") as file:
+            for operation in operations:
+                file.write(json.dumps(operation) + "\n")
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(str(tmp_path), str(self.path))
+
+    def _close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def close(self):
+        with self._lock:
+            self._close()
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+#
+# This file is a part of Definator (https://github.com/aparaatti/definator)
+# and it is licensed under the GPLv3 (http://www.gnu.org/licenses/gpl-3.0.txt).
+#
+__author__ = 'aparaatti'
+
+import logging
+from collections import OrderedDict
+from pathlib import Path
+
+from .storage import FOLDER_STORAGE, PROJECT_META
+
+RENDER_CACHE = "render.json"
+
+
+class RenderCache(object):
+    """
+    HTML rendered from terms, persisted in the project meta folder, so that
+    terms shown in an earlier session are shown without rendering them again.
+
+    An entry is used only if the content digest of the term is the same as
+    when the HTML was stored. The most recently stored max_terms entries are
+    kept.
+
+    >>> from data.term import Term
+    >>> cache = RenderCache()
+    >>> term = Term("cat")
+    >>> term.description = "A cat."
+    >>> html = term.term_as_html
+    >>> cache.store(term)
+    >>> other = Term("cat")
+    >>> other.description = "A cat."
+    >>> cache.restore(other)
+    True
+    >>> other.rendered_html["term"] == html
+    True
+    >>> other.description = "A dog."
+    >>> cache.restore(other)
+    False
+    """
+    def __init__(self, max_terms: int=200):
+        self.max_terms = max_terms
+        self._entries = OrderedDict()
+        self._dirty = False
+
+    def __contains__(self, term_str):
+        return term_str in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def is_dirty(self):
+        return self._dirty
+
+    @is_dirty.setter
+    def is_dirty(self, dirty: bool):
+        self._dirty = dirty
+
+    def copy(self):
+        """
+        Returns a copy of the cache, eg. to save it in another thread.
+        """
+        cache = RenderCache(self.max_terms)
+        cache._entries = OrderedDict(self._entries)
+        cache._dirty = self._dirty
+        return cache
+
+    def restore(self, term):
+        """
+        Sets the stored HTML to the term, if it was rendered from the same
+        content.
+
+        :param term: Term object
+        :return: True if the HTML was set.
+        """
+        entry = self._entries.get(term.term)
+        if entry is None:
+            return False
+        if entry["digest"] != term.content_digest:
+            return False
+        for kind, html in entry["html"].items():
+            term.set_rendered_html(kind, html)
+        return True
+
+    def store(self, term):
+        """
+        Stores the HTML rendered from the current content of the term, if any.
+
+        :param term: Term object
+        """
+        rendered = term.rendered_html
+        if not rendered:
+            return
+        entry = self._entries.get(term.term)
+        if entry is not None and entry["html"] == rendered:
+            return
+        self._entries.pop(term.term, None)
+        self._entries[term.term] = {"digest": term.content_digest,
+                                    "html": rendered}
+        while len(self._entries) > self.max_terms:
+            self._entries.popitem(last=False)
+        self._dirty = True
+
+    def remove(self, term_str):
+        if self._entries.pop(term_str, None) is not None:
+            self._dirty = True
+
+    def load(self, project_path: Path, storage=FOLDER_STORAGE):
+        """
+        Loads the cache of the project. A missing or unreadable cache is
+        treated as empty.
+        """
+        self._entries = OrderedDict()
+        try:
+            data = storage.load_json(project_path / PROJECT_META / RENDER_CACHE)
+            self._entries.update(data.get("terms", []))
+        except (FileNotFoundError, ValueError) as e:
+            logging.info("No render cache for the project: " + str(e))
+        self._dirty = False
+
+    def save(self, project_path: Path, storage=FOLDER_STORAGE):
+        meta = project_path / PROJECT_META
+        if storage.uses_term_folders and not meta.exists():
+            meta.mkdir()
+        storage.save_json(meta / RENDER_CACHE, {
+            "version": 1, "terms": list(self._entries.items())})
+        self._dirty = False
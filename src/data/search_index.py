@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+#
+# This file is a part of Definator (https://github.com/aparaatti/definator)
+# and it is licensed under the GPLv3 (http://www.gnu.org/licenses/gpl-3.0.txt).
+#
+__author__ = 'aparaatti'
+
+import re
+import math
+from pathlib import Path
+
+from .storage import FOLDER_STORAGE, PROJECT_META
+
+INDEX = "index.json"
+
+
+class SearchIndex(object):
+    """
+    Inverted index from the words of term descriptions to the terms.
+
+    For each term the index keeps the count of each word in its description,
+    which is what is persisted, and for each word the terms it appears in,
+    which is built when the index is loaded or first searched. A term is
+    re-indexed by removing its old words and adding the new ones, so
+    updating a term doesn't touch the other terms.
+
+    >>> index = SearchIndex()
+    >>> index.index_term("cat", "A cat is an animal. Cats purr.")
+    >>> index.index_term("cow", "A cow is an animal, not a cat.")
+    >>> index.search("animal cat")
+    ['cat', 'cow']
+    >>> index.search("purr")
+    ['cat']
+    >>> index.copy().search("animal cat")
+    ['cat', 'cow']
+    """
+    _word_pattern = re.compile(r"\w+")
+
+    def __init__(self):
+        self._term_words = {}
+        self._postings = {}
+        self._dirty = False
+
+    @staticmethod
+    def words(text: str):
+        """
+        Returns the words of the text in case folded form.
+        """
+        return [word.casefold()
+                for word in SearchIndex._word_pattern.findall(text)]
+
+    def __contains__(self, term_str):
+        return term_str in self._term_words
+
+    def __len__(self):
+        return len(self._term_words)
+
+    @property
+    def terms(self):
+        return set(self._term_words.keys())
+
+    @property
+    def is_dirty(self):
+        return self._dirty
+
+    @is_dirty.setter
+    def is_dirty(self, dirty: bool):
+        self._dirty = dirty
+
+    def copy(self):
+        """
+        Returns a copy of the index, eg. to save it in another thread. The
+        word counts of a term are replaced, not changed, when it is indexed
+        again, so they are shared with the copy. The terms of the words are
+        built for the copy, if it is searched.
+        """
+        index = SearchIndex()
+        index._term_words = dict(self._term_words)
+        index._postings = None
+        index._dirty = self._dirty
+        return index
+
+    def _word_postings(self):
+        """
+        Returns the terms of each word as {word: {term: count}}, built from
+        the word counts of the terms, if needed.
+        """
+        if self._postings is None:
+            self._postings = {}
+            for term_str, counts in self._term_words.items():
+                for word, count in counts.items():
+                    self._postings.setdefault(word, dict())[term_str] = count
+        return self._postings
+
+    def index_term(self, term_str: str, text: str):
+        """
+        Indexes the words of the text for the term. Previous words of the
+        term are removed from the index.
+        """
+        self.remove_term(term_str)
+        counts = dict()
+        for word in SearchIndex.words(text):
+            counts[word] = counts.get(word, 0) + 1
+        self._add(term_str, counts)
+        self._dirty = True
+
+    def _add(self, term_str: str, counts: dict):
+        self._term_words[term_str] = counts
+        if self._postings is None:
+            return
+        for word, count in counts.items():
+            self._postings.setdefault(word, dict())[term_str] = count
+
+    def remove_term(self, term_str: str):
+        counts = self._term_words.pop(term_str, None)
+        if counts is None:
+            return
+        self._dirty = True
+        if self._postings is None:
+            return
+        for word in counts.keys():
+            postings = self._postings[word]
+            del postings[term_str]
+            if not postings:
+                del self._postings[word]
+
+    def search(self, query: str, limit: int=None):
+        """
+        Returns the names of the terms, which have all the words of the query
+        in their description. The terms are ranked by the frequency of the
+        query words in the description weighted by how rare the words are in
+        the project (tf-idf).
+
+        :param query: words to search for
+        :param limit: maximum number of terms to return
+        :return: list of term strings, best match first
+        """
+        query_words = set(SearchIndex.words(query))
+        if not query_words:
+            return []
+
+        all_postings = self._word_postings()
+        postings = list()
+        for word in query_words:
+            word_postings = all_postings.get(word)
+            if not word_postings:
+                return []
+            postings.append(word_postings)
+        # Start from the rarest word to keep the candidate set small:
+        postings.sort(key=len)
+
+        candidates = set(postings[0].keys())
+        for word_postings in postings[1:]:
+            candidates.intersection_update(word_postings.keys())
+
+        term_count = len(self._term_words)
+        scores = dict()
+        for term_str in candidates:
+            length = sum(self._term_words[term_str].values())
+            score = 0.0
+            for word_postings in postings:
+                idf = math.log(1 + term_count / len(word_postings))
+                score += word_postings[term_str] / length * idf
+            scores[term_str] = score
+
+        ranked = sorted(scores.keys(), key=lambda t: (-scores[t], t))
+        if limit is not None:
+            return ranked[:limit]
+        return ranked
+
+    def load(self, project_path: Path, storage=FOLDER_STORAGE):
+        """
+        Loads the index of the project.
+
+        :raise FileNotFoundError: if the project doesn't have an index.
+        """
+        data = storage.load_json(project_path / PROJECT_META / INDEX)
+        self._term_words = {}
+        self._postings = {}
+        for term_str, counts in data.get("terms", {}).items():
+            self._add(term_str, counts)
+        self._dirty = False
+
+    def save(self, project_path: Path, storage=FOLDER_STORAGE):
+        meta = project_path / PROJECT_META
+        if storage.uses_term_folders and not meta.exists():
+            meta.mkdir()
+        storage.save_json(meta / INDEX, {"version": 1,
+                                         "terms": self._term_words})
+        self._dirty = False
@@ -0,0 +1,710 @@
+# -*- coding: utf-8 -*-
+#
+# This file is a part of Definator (https://github.com/aparaatti/definator)
+# and it is licensed under the GPLv3 (http://www.gnu.org/licenses/gpl-3.0.txt).
+#
+__author__ = 'aparaatti'
+
+import os
+import json
+import logging
+import uuid
+import sqlite3
+import threading
+from pathlib import Path
+
+from .json_helpers import load_json, save_json, write_json, temporary_path
+from .fs_helpers import remove_file, make_dir, copy_file_to, sync_to_disk, \
+    clone_file
+from .blob_store import BlobStore, BLOB_REFS
+from .trash import Trash
+
+# Folder under the project root for the files Definator keeps about a project.
+# Term names can't start with a dot, so it never collides with a term folder.
+PROJECT_META = ".definator"
+PACKED_STORE = "store.sqlite"
+JOURNAL = "journal.json"
+MOVES = "moves.json"
+MOVED = "moved.json"
+TRASH = "trash"
+BLOBS = "blobs"
+
+# Documents of a term, which are not attachments:
+TERM_DOCUMENTS = ["links.json", "description.json"]
+
+
+class WriteStatistics(object):
+    """
+    Counts the files and bytes a storage has written.
+    """
+    def __init__(self):
+        self.files = 0
+        self.bytes = 0
+
+    def add(self, byte_count: int):
+        self.files += 1
+        self.bytes += byte_count
+
+    def __str__(self):
+        return str(self.files) + " files, " + str(self.bytes) + " bytes"
+
+
+class Storage(object):
+    """
+    Base class of the storages, handles the attached files of the terms.
+
+    The attached files are kept in the term folders. In a project, they are
+    stored once by their content in a BlobStore in the project meta folder
+    and copied from there to the term folders as reflinks, if the file
+    system supports them.
+    """
+    uses_term_folders = True
+
+    def __init__(self, project_path: Path):
+        self._project_path = project_path
+        self.statistics = WriteStatistics()
+        self.blobs = None
+        self.trash = None
+        # Folders moved in the current transaction as [path, new path] lists
+        # relative to the project path:
+        self._moves = []
+        self._moves_id = None
+        # Trash slot of the current transaction:
+        self._slot = None
+        # Blob keys of the attached files moved to the trash by path:
+        self._released = dict()
+        if project_path != Path(''):
+            self.blobs = BlobStore(project_path / PROJECT_META / BLOBS, self)
+            self.trash = Trash(project_path / PROJECT_META / TRASH)
+
+    def _key(self, path: Path):
+        return path.relative_to(self._project_path).as_posix()
+
+    def copy_file_to(self, src: Path, target: Path, key: str=None):
+        """
+        Copies an attached file into a term folder.
+
+        :param key: the blob key of the file, if it is known. It is not used,
+            if the file is not a copy of the stored file, eg. it has been
+            changed after it was stored.
+        :return: the blob key of the file or None, if the file is not stored
+            in a blob store
+        """
+        if self.blobs is None or not self.blobs.enabled:
+            copy_file_to(src, target)
+            self.statistics.add((target / src.name).stat().st_size)
+            return None
+
+        if key is not None and not self.blobs.is_copy(key, src):
+            key = None
+        key, written = self.blobs.add(src, key)
+        if written:
+            self.statistics.add(written)
+        copied = self.blobs.link(key, target / src.name)
+        if copied:
+            self.statistics.add(copied)
+        self.blobs.reference(key, self._key(target / src.name))
+        return key
+
+    def reference_file(self, path: Path, key: str):
+        """
+        Records, that the attached file in the path is the blob of the key.
+        A file, that is not a copy of the stored file anymore, eg. it has
+        been edited in the term folder or its stored file has been removed,
+        is stored again, if the blob store is enabled.
+
+        :return: the blob key of the file or None, if it is not stored
+        """
+        if self.blobs is None or key is None:
+            return key
+        if path.is_file() and not self.blobs.is_copy(key, path):
+            self.blobs.release(key, self._key(path))
+            if not self.blobs.enabled:
+                return None
+            key = self.blobs.add(path)[0]
+        self.blobs.reference(key, self._key(path))
+        return key
+
+    def move_term_folder(self, term_str: str, new_term_str: str):
+        """
+        Moves the folder of a renamed term with a single rename, so the
+        attached files are not copied. The references of the attached files
+        are moved in the blob store.
+
+        :return: False if the folder can't be moved, eg. there is no folder
+            for the term or the new folder exists.
+        """
+        src = self._project_path / term_str
+        dst = self._project_path / new_term_str
+        if not src.is_dir() or dst.exists():
+            return False
+        self._move(term_str, new_term_str)
+        if self.blobs is not None:
+            self.blobs.move(term_str, new_term_str)
+        return True
+
+    def trash_term(self, term_str: str):
+        """
+        Moves the folder of a removed term to the trash of the project with
+        a single rename and removes the documents of the term. See
+        restore_term and Trash for restoring and purging the removed terms.
+        """
+        if (self._project_path / term_str).is_dir():
+            self._move(term_str, self._key(self._trash_slot() / term_str))
+            if self.blobs is not None:
+                self.blobs.release_folder(term_str)
+        self.remove_term_documents(term_str)
+
+    def restore_term(self, folder: Path, term_str: str):
+        """
+        Moves the folder of a removed term back from the trash with a single
+        rename, see trash_term.
+
+        :return: False if the folder can't be moved, eg. there is a folder
+            for the term in the project.
+        """
+        if not folder.is_dir() or (self._project_path / term_str).exists():
+            return False
+        self._move(self._key(folder), term_str)
+        return True
+
+    def remove_term_documents(self, term_str: str):
+        for document in TERM_DOCUMENTS:
+            self.remove(self._project_path / term_str / document)
+
+    def _trash_slot(self):
+        """
+        Returns the trash slot of the current transaction.
+        """
+        if self._slot is None:
+            self._slot = self.trash.new_slot()
+        return self._slot
+
+    def _move(self, src: str, dst: str):
+        """
+        Moves a folder or a file in the project with a single rename. The
+        paths are relative to the project path.
+
+        The move is written to a journal in the project meta folder first,
+        and the id of the journal is saved in the transaction. If the
+        transaction is rolled back, or it is not committed before a crash,
+        the folder or file is moved back (see recover).
+        """
+        journal = self._project_path / PROJECT_META / MOVES
+        if not journal.parent.exists():
+            make_dir(journal.parent)
+        if not self._moves:
+            self._moves_id = uuid.uuid4().hex
+            self.save_json(journal.with_name(MOVED), {"id": self._moves_id})
+        self._moves.append([src, dst])
+        save_json(journal, {"id": self._moves_id, "moves": self._moves})
+        os.replace(str(self._project_path / src),
+                   str(self._project_path / dst))
+        logging.debug("Moved " + src + " to " + dst)
+
+    def _end_moves(self):
+        """
+        Forgets the moves of a committed transaction.
+        """
+        self._slot = None
+        self._released = dict()
+        if self._moves:
+            self._moves = []
+            remove_file(self._project_path / PROJECT_META / MOVES)
+
+    def _undo_moves(self):
+        """
+        Moves the folders and files moved in a rolled back transaction back.
+        """
+        for src, dst in reversed(self._moves):
+            self._move_back(src, dst)
+            if self.blobs is not None and '/' not in dst:
+                self.blobs.move(dst, src)
+        for path, key in self._released.items():
+            self.blobs.reference(key, self._key(path))
+        self._end_moves()
+
+    def _move_back(self, src: str, dst: str):
+        moved = self._project_path / dst
+        original = self._project_path / src
+        if original.is_dir():
+            # A folder made for a term with the same name, eg. its temporary
+            # files:
+            for file in original.iterdir():
+                if file.name.startswith('.') and file.is_file():
+                    remove_file(file)
+            try:
+                original.rmdir()
+            except OSError:
+                pass
+        if moved.exists() and not original.exists():
+            os.replace(str(moved), str(original))
+        else:
+            logging.warning("Could not move " + dst + " back to " + src)
+
+    def _recover_moves(self):
+        """
+        Moves the folders of an interrupted save back, unless the save was
+        committed, eg. the id of the moves was saved.
+
+        :return: True if the journal of the moves was found.
+        """
+        journal = self._project_path / PROJECT_META / MOVES
+        if not journal.exists():
+            return False
+        data = load_json(journal)
+        try:
+            committed = self.load_json(
+                self._project_path / PROJECT_META / MOVED).get("id")
+        except (FileNotFoundError, ValueError):
+            committed = None
+        if committed != data["id"]:
+            for src, dst in reversed(data["moves"]):
+                logging.warning("Moving " + dst + " back to " + src)
+                self._move_back(src, dst)
+        remove_file(journal)
+        return True
+
+    def remove_attachment(self, path: Path, key: str=None):
+        """
+        Moves an attached file from a term folder to the trash of the
+        project, or removes it, if the storage has no project. The file is
+        moved back, if the transaction is rolled back.
+        """
+        if self.trash is None:
+            remove_file(path)
+        else:
+            target = self._trash_slot() / self._key(path)
+            if not target.parent.exists():
+                os.makedirs(str(target.parent), exist_ok=True)
+            self._move(self._key(path), self._key(target))
+        if self.blobs is not None and key is not None:
+            self.blobs.release(key, self._key(path))
+            self._released[path] = key
+
+    def save_attachments(self):
+        """
+        Saves the blob references, if they have changed.
+        """
+        if self.blobs is not None and self.blobs.is_dirty:
+            self.blobs.save()
+
+    def _collect_attachments(self):
+        if self.blobs is not None:
+            self.blobs.collect()
+
+    def can_clone_from(self, source):
+        """
+        True if the project of the source storage can be copied into this
+        storage without loading the terms, see clone_term_from.
+        """
+        return type(source) is type(self) and source.blobs is not None \
+            and self.blobs is not None
+
+    def clone_documents_from(self, source, term_strs: list):
+        """
+        Copies the documents of the given terms in bulk from the source
+        project. Called before anything is saved to this storage.
+        """
+        pass
+
+    def clone_blobs_from(self, source):
+        if self.blobs.enabled:
+            self.statistics.bytes += self.blobs.clone_from(source.blobs)
+
+    def clone_term_from(self, source, term_str: str):
+        """
+        Copies a term from the source project without loading it.
+
+        :return: False if the term could not be copied.
+        """
+        return self._clone_folder(source, term_str)
+
+    def _clone_folder(self, source, term_str: str, skip: list=()):
+        """
+        Copies the folder of a term from the source project with clone_file.
+        The references of the attached files are copied with the blob store
+        by clone_blobs_from.
+
+        :param skip: names of the files not to copy
+        :return: False if the source has no folder for the term.
+        """
+        src = source._project_path / term_str
+        dst = self._project_path / term_str
+        if not src.is_dir():
+            return False
+        with os.scandir(str(src)) as entries:
+            for entry in entries:
+                if not entry.is_file() or entry.name.startswith('.') \
+                        or entry.name in skip:
+                    continue
+                if not dst.exists():
+                    make_dir(dst)
+                self.statistics.add(
+                    clone_file(Path(entry.path), dst / entry.name))
+        return True
+
+
+class FolderStorage(Storage):
+    """
+    Stores every document as a JSON file in its own path. This is the original
+    project layout: "terms.json" at the project root and "description.json"
+    and "links.json" in a folder named after the term.
+
+    The documents are addressed with absolute paths, so the same storage object
+    can be used for any project.
+
+    A single document is replaced atomically. Documents written between begin
+    and commit form a transaction: they are written to temporary files, which
+    are flushed to disk together and then renamed over the documents following
+    a journal in the project meta folder. If the renaming is interrupted,
+    recover completes it from the journal.
+    """
+    uses_term_folders = True
+
+    def __init__(self, project_path: Path=Path('')):
+        super().__init__(project_path)
+        # Pending (temporary path, path) pairs and removed paths, when in a
+        # transaction:
+        self._renames = None
+        self._removals = []
+
+    def for_project(self, project_path: Path):
+        """
+        Returns a storage of the same kind for another project.
+        """
+        return FolderStorage(project_path)
+
+    def load_json(self, path: Path, decoder=json.JSONDecoder()):
+        return load_json(path, decoder)
+
+    def save_json(self, path: Path, obj, encoder=json.JSONEncoder()):
+        if self._renames is None:
+            self.statistics.add(save_json(path, obj, encoder))
+        else:
+            tmp_path = temporary_path(path)
+            self.statistics.add(write_json(tmp_path, obj, encoder, False))
+            self._renames.append((tmp_path, path))
+
+    def remove(self, path: Path):
+        if self._renames is None:
+            remove_file(path)
+        else:
+            self._removals.append(path)
+
+    def list_files(self, path: Path):
+        """
+        Returns the names of the files attached to a term, eg. the files in
+        the term folder, which are not term documents.
+
+        :param path: path to the term folder
+        """
+        if not path.is_dir():
+            return []
+        return [file.name for file in path.iterdir()
+                if file.is_file() and file.name not in TERM_DOCUMENTS
+                and not file.name.startswith('.')]
+
+    def begin(self):
+        """
+        Starts a transaction. Documents saved or removed before commit are
+        changed on disk only when commit is called.
+        """
+        self._renames = []
+        self._removals = []
+
+    def commit(self):
+        """
+        Ends a transaction. The temporary files are flushed to disk, the journal
+        is written, the files are renamed over the documents, the removed
+        documents are deleted and the changes of the directories are flushed
+        to disk. Finally the journal is removed.
+        """
+        if self._renames is None:
+            return
+        renames, removals = self._renames, self._removals
+        self._renames = None
+        self._removals = []
+        if not renames and not removals:
+            self._end_moves()
+            self._collect_attachments()
+            return
+
+        sync_to_disk([tmp_path for tmp_path, path in renames])
+        journal = self._project_path / PROJECT_META / JOURNAL
+        if not journal.parent.exists():
+            make_dir(journal.parent)
+        save_json(journal, {
+            "renames": [[self._key(tmp_path), self._key(path)]
+                        for tmp_path, path in renames],
+            "removals": [self._key(path) for path in removals]})
+        self._apply(renames, removals)
+        self._end_moves()
+        remove_file(journal)
+        self._collect_attachments()
+
+    def rollback(self):
+        """
+        Ends a transaction without changing the documents. The temporary
+        files are removed.
+        """
+        if self._renames is None:
+            return
+        for tmp_path, path in self._renames:
+            if tmp_path.exists():
+                remove_file(tmp_path)
+        self._renames = None
+        self._removals = []
+        self._undo_moves()
+
+    def recover(self):
+        """
+        Completes a transaction, that was interrupted after its journal was
+        written. Temporary files of a transaction, that didn't get as far, are
+        left unused and the term folders it moved are moved back.
+
+        :return: True if a transaction was completed.
+        """
+        journal = self._project_path / PROJECT_META / JOURNAL
+        if not journal.exists():
+            self._recover_moves()
+            return False
+        logging.warning("Completing an interrupted save from: "
+                        + str(journal))
+        data = load_json(journal)
+        self._apply(
+            [(self._project_path / tmp_path, self._project_path / path)
+             for tmp_path, path in data["renames"]],
+            [self._project_path / path for path in data["removals"]])
+        self._recover_moves()
+        remove_file(journal)
+        return True
+
+    def _apply(self, renames: list, removals: list):
+        """
+        Renames the temporary files over the documents and deletes the removed
+        documents. Can be applied again, if it was interrupted.
+        """
+        replaced = set()
+        for tmp_path, path in renames:
+            if tmp_path.exists():
+                os.replace(str(tmp_path), str(path))
+            replaced.add(path)
+
+        for path in removals:
+            if path not in replaced and path.exists():
+                remove_file(path)
+                try:
+                    os.rmdir(str(path.parent))
+                except OSError:
+                    pass
+
+        sync_to_disk(list(set(path.parent for tmp_path, path in renames)))
+
+    def close(self):
+        pass
+
+
+class PackedStorage(Storage):
+    """
+    Stores all the documents of a project in a single SQLite file in the
+    project meta folder. A document is stored as JSON text with its path
+    relative to the project root as a key, so loading a project of any size
+    uses one file handle.
+
+    The attached files are still kept in the term folders, since they are
+    opened from there with the desktop applications. The names of the attached
+    files are read from the links document, so the term folders are not
+    scanned on load.
+
+    Changes are written in a transaction, that ends when commit is called.
+    """
+    uses_term_folders = False
+
+    def __init__(self, project_path: Path):
+        super().__init__(project_path)
+        meta = project_path / PROJECT_META
+        if not meta.exists():
+            make_dir(meta)
+        self._lock = threading.RLock()
+        self._connection = sqlite3.connect(
+            str(meta / PACKED_STORE), check_same_thread=False)
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS documents"
+            " (key TEXT PRIMARY KEY, data TEXT NOT NULL)")
+        self._connection.commit()
+
+    @staticmethod
+    def exists(project_path: Path):
+        return (project_path / PROJECT_META / PACKED_STORE).is_file()
+
+    def for_project(self, project_path: Path):
+        return PackedStorage(project_path)
+
+    def load_json(self, path: Path, decoder=json.JSONDecoder()):
+        """
+        :raise FileNotFoundError: if there is no document for the path, as
+            when loading a missing file.
+        """
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT data FROM documents WHERE key = ?",
+                (self._key(path),)).fetchone()
+        if row is None:
+            raise FileNotFoundError("No document: " + str(path))
+        return decoder.decode(row[0])
+
+    def save_json(self, path: Path, obj, encoder=json.JSONEncoder()):
+        text = encoder.encode(obj)
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO documents (key, data) VALUES (?, ?)",
+                (self._key(path), text))
+        self.statistics.add(len(text.encode()))
+
+    def remove(self, path: Path):
+        logging.debug("Removing document: " + str(path))
+        with self._lock:
+            self._connection.execute(
+                "DELETE FROM documents WHERE key = ?", (self._key(path),))
+
+    def clone_documents_from(self, source, term_strs: list):
+        """
+        Copies the whole store of the source with the SQLite backup API and
+        removes the documents of the terms, that are not in term_strs.
+        """
+        with source._lock, self._lock:
+            source._connection.backup(self._connection)
+            keep = set(term_strs)
+            removed = [(key,) for (key,) in self._connection.execute(
+                "SELECT key FROM documents")
+                if '/' in key and key.split('/')[0] not in keep
+                and not key.startswith(PROJECT_META + '/')]
+            self._connection.executemany(
+                "DELETE FROM documents WHERE key = ?", removed)
+        self.statistics.add(
+            (self._project_path / PROJECT_META / PACKED_STORE).stat().st_size)
+
+    def clone_term_from(self, source, term_str: str):
+        """
+        The documents of the term are copied by clone_documents_from, the
+        attached files are copied from the term folder.
+        """
+        self._clone_folder(source, term_str, TERM_DOCUMENTS)
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT 1 FROM documents WHERE key = ?",
+                (self._key(self._project_path / term_str / "links.json"),)
+            ).fetchone()
+        return row is not None
+
+    def trash_term(self, term_str: str):
+        """
+        The documents of the term are written to its folder as files, before
+        the folder is moved to the trash, so the term can be restored from
+        the trash.
+        """
+        folder = self._project_path / term_str
+        for document in TERM_DOCUMENTS:
+            try:
+                data = self.load_json(folder / document)
+            except FileNotFoundError:
+                continue
+            if not folder.exists():
+                make_dir(folder)
+            write_json(folder / document, data, sync=False)
+        super().trash_term(term_str)
+
+    def list_files(self, path: Path):
+        try:
+            links = self.load_json(path / "links.json")
+        except FileNotFoundError:
+            return []
+        return list(links.get("files", [])) + list(links.get("images", []))
+
+    def begin(self):
+        """
+        SQLite starts a transaction on the first change.
+        """
+        pass
+
+    def commit(self):
+        with self._lock:
+            self._connection.commit()
+        self._end_moves()
+        self._collect_attachments()
+
+    def rollback(self):
+        with self._lock:
+            self._connection.rollback()
+        self._undo_moves()
+
+    def recover(self):
+        """
+        SQLite rolls back an interrupted transaction by itself, the term
+        folders moved in it are moved back.
+        """
+        self._recover_moves()
+        return False
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+def open_storage(project_path: Path):
+    """
+    Returns the storage used by the project in the given path.
+    """
+    if PackedStorage.exists(project_path):
+        logging.debug("Using packed storage for: " + str(project_path))
+        return PackedStorage(project_path)
+    return FolderStorage(project_path)
+
+
+def convert_to_packed(project_path: Path):
+    """
+    Copies the documents of a project in the folder layout into a packed
+    store in the project meta folder. The contents of "terms.json" and
+    "description.json" files are stored as they are. The links documents get
+    the names of all the files found in the term folder, since the folder is
+    not scanned for files, when a packed project is loaded.
+
+    The folder documents are left in place, but are not used after the
+    conversion.
+
+    :param project_path: path to a project in the folder layout
+    :return: the new PackedStorage
+    """
+    folders = FolderStorage(project_path)
+    packed = PackedStorage(project_path)
+    terms = folders.load_json(project_path / "terms.json")
+    packed.save_json(project_path / "terms.json", terms)
+
+    for term in terms:
+        term_path = project_path / term
+        for document in TERM_DOCUMENTS:
+            try:
+                data = folders.load_json(term_path / document)
+            except FileNotFoundError:
+                logging.warning("Missing " + document + " for: " + term)
+                continue
+            if document == "links.json":
+                names = folders.list_files(term_path)
+                images = set(data.get("images", []))
+                data["images"] = [name for name in names if name in images]
+                data["files"] = [name for name in names if name not in images]
+            packed.save_json(term_path / document, data)
+
+    # The project wide documents, like the search index and the link graph:
+    meta = project_path / PROJECT_META
+    for path in list(meta.glob("*.json")) + [meta / BLOBS / BLOB_REFS]:
+        if path.name != JOURNAL and path.exists():
+            packed.save_json(path, folders.load_json(path))
+
+    packed.commit()
+    return packed
+
+
+# Used, when no storage is given:
+FOLDER_STORAGE = FolderStorage()
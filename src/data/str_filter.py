@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+#
+# This file is a part of Definator (https://github.com/aparaatti/definator)
+# and it is licensed under the GPLv3 (http://www.gnu.org/licenses/gpl-3.0.txt).
+#
+__author__ = 'aparaatti'
+
+import re
+from collections import OrderedDict
+
+
+class StrFilter(object):
+    """
+    Finds the strings of a list matching a query, ignoring the case.
+
+    A string matches, if the query is a substring of it, or with fuzzy
+    matching, if the characters of the query are found in it in the same
+    order. The strings are case folded once, when they are set.
+
+    Since a string matching a query matches also the queries it starts
+    with, the result of a query is searched from the result of its longest
+    cached prefix, eg. typing one more character searches only the strings
+    matching before it. The results of the latest queries are cached, so
+    removing characters from the query doesn't search again.
+
+    >>> str_filter = StrFilter(["Cat", "Catalog", "Dog", "Hot dog"])
+    >>> str_filter.filter("dog")
+    [2, 3]
+    >>> str_filter.filter("cg")
+    []
+    >>> str_filter.fuzzy = True
+    >>> str_filter.filter("cg")
+    [1]
+
+    :param strs: the strings
+    :param fuzzy: True for fuzzy matching
+    :param cache_size: number of results cached
+    """
+    def __init__(self, strs: list=(), fuzzy: bool=False, cache_size: int=64):
+        self._fuzzy = fuzzy
+        self.cache_size = cache_size
+        self._folded = list()
+        self._results = OrderedDict()
+        self.set_strs(strs)
+
+    @property
+    def fuzzy(self):
+        return self._fuzzy
+
+    @fuzzy.setter
+    def fuzzy(self, fuzzy: bool):
+        if fuzzy != self._fuzzy:
+            self._fuzzy = fuzzy
+            self._results.clear()
+
+    def __len__(self):
+        return len(self._folded)
+
+    def set_strs(self, strs: list):
+        self._folded = [string.casefold() for string in strs]
+        self._results.clear()
+
+    def extend(self, strs: list):
+        self._folded.extend(string.casefold() for string in strs)
+        self._results.clear()
+
+    def insert(self, index: int, string: str):
+        self._folded.insert(index, string.casefold())
+        self._results.clear()
+
+    def remove(self, index: int):
+        del self._folded[index]
+        self._results.clear()
+
+    def filter(self, query: str):
+        """
+        Returns the indexes of the strings matching the query in increasing
+        order, or None if the query is empty, eg. all the strings match.
+        """
+        query = query.casefold()
+        if not query:
+            return None
+        result = self._results.get(query)
+        if result is not None:
+            self._results.move_to_end(query)
+            return result
+
+        candidates = None
+        for length in range(len(query) - 1, 0, -1):
+            candidates = self._results.get(query[:length])
+            if candidates is not None:
+                break
+        folded = self._folded
+        if self._fuzzy:
+            # The characters of the query in the same order:
+            search = re.compile(".*?".join(re.escape(char) for char in query),
+                                re.DOTALL).search
+            if candidates is None:
+                result = [index for index, string in enumerate(folded)
+                          if search(string)]
+            else:
+                result = [index for index in candidates
+                          if search(folded[index])]
+        elif candidates is None:
+            result = [index for index, string in enumerate(folded)
+                      if query in string]
+        else:
+            result = [index for index in candidates
+                      if query in folded[index]]
+
+        self._results[query] = result
+        while len(self._results) > self.cache_size:
+            self._results.popitem(last=False)
+        return result
+
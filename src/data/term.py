@@ -6,8 +6,10 @@ __author__ = 'Niko Humalamäki'
 
 
 import string
+import hashlib
 from .description import *
 from .term_links import *
+from .text_delta import text_changes, apply_text_changes
 from .term_exceptions import IllegalCharacterInTermNameException, \
     IllegalCharacterInTheBeginningOfTermNameException
 
@@ -16,6 +18,9 @@ class Term(object):
     allowed_characters = string.ascii_letters + string.digits + 'äöåÄÖÅ-_. ' \
                          + os.linesep
 
+    # Number of earlier versions kept for undo:
+    undo_depth = 100
+
     file = open(os.path.join(os.path.dirname(__file__),
                              'representation/default/term.xhtml'), 'r')
     html_template_term = string.Template(file.read())
@@ -49,13 +54,53 @@ class Term(object):
         self._previous_term = None
         self._next_term = None
         self._path = Path()
+        # Components shared with another Term handle (see __copy__):
+        self._shared = set()
+        # Project path and term string the term was last loaded or saved as:
+        self._saved_as = None
+        # Rendered HTML by kind, as (render key, html) tuples. Shared with the
+        # copy-on-write handles, since the key tells which content it is for:
+        self._html_cache = dict()
+
+    def __copy__(self):
+        """
+        Returns a copy-on-write handle of this term. The handle and this term
+        share the Description and Links objects and the undo/redo chain until
+        either of them is changed, at which point the changing one makes a
+        private copy of the component.
+        """
+        handle = Term.__new__(Term)
+        handle.__dict__.update(self.__dict__)
+        handle._shared = {"description", "links"}
+        self._shared = {"description", "links"}
+        return handle
+
+    def _own_description(self):
+        """
+        Makes a private copy of the description if it is shared with another
+        handle and returns it.
+        """
+        if "description" in self._shared:
+            self._description = self._description.copy()
+            self._shared.discard("description")
+        return self._description
+
+    def _own_links(self):
+        """
+        Makes a private copy of the links if they are shared with another
+        handle and returns them.
+        """
+        if "links" in self._shared:
+            self._links = self._links.copy()
+            self._shared.discard("links")
+        return self._links
 
     def __contains__(self, related_term):
-        return related_term in self._links.linked_terms()
+        return related_term in self._links
 
     @property
     def can_undo(self):
-        return self.previous_term is not None
+        return self._previous_term is not None
 
     @property
     def can_redo(self):
@@ -73,6 +118,12 @@ class Term(object):
 
     @property
     def previous_term(self):
+        """
+        The previous version of the term. A version kept as a TermDelta is
+        rebuilt, when it is asked for.
+        """
+        if isinstance(self._previous_term, TermDelta):
+            self._previous_term = self._previous_term.apply(self)
         return self._previous_term
 
     @previous_term.setter
@@ -88,16 +139,67 @@ class Term(object):
     @path.setter
     def path(self, path: Path):
         self._path = path
-        self._description.path = self._path / self.term
-        self._links.path = self._path / self.term
+        self._own_description().path = self._path / self.term
+        self._own_links().path = self._path / self.term
 
     @property
     def term_as_html(self):
+        return self._cached_html("term", self._render_term_html)
+
+    def _render_term_html(self):
         return Term.html_template_term\
             .substitute(term=self.term,
                         content_html=self._description.content_html,
                         links=self._make_html_list_of_files())
 
+    def _render_key(self):
+        return (self.term, self._path, self._description.version,
+                self._links.version)
+
+    def _cached_html(self, kind: str, render):
+        """
+        Returns the HTML of the given kind rendered from the current content
+        of the term. The HTML is rendered again only if the term string, the
+        path, the description or the links have changed since the last time.
+        """
+        key = self._render_key()
+        cached = self._html_cache.get(kind)
+        if cached is None or cached[0] != key:
+            logging.debug("rendering " + kind + " html for " + self.term)
+            cached = (key, render())
+            self._html_cache[kind] = cached
+        return cached[1]
+
+    @property
+    def rendered_html(self):
+        """
+        The HTML rendered from the current content of the term as a
+        dictionary by kind ("term" and "links"). Kinds that have not been
+        rendered are missing.
+        """
+        key = self._render_key()
+        return {kind: html for kind, (html_key, html)
+                in self._html_cache.items() if html_key == key}
+
+    def set_rendered_html(self, kind: str, html: str):
+        """
+        Sets HTML rendered earlier from the current content of the term (see
+        content_digest), eg. from a cache on disk.
+        """
+        self._html_cache[kind] = (self._render_key(), html)
+
+    @property
+    def content_digest(self):
+        """
+        Digest of everything the rendered HTML of the term depends on.
+        """
+        parts = [self.term, str(self._path), self._description.content_text]
+        parts.extend(str(path) for path in self._description.added_image_paths)
+        parts.extend(path.name for path in self._links.linked_images)
+        parts.extend(path.name for path in self._links.linked_files)
+        parts.extend(self._links.linked_terms)
+        return hashlib.sha1("\0".join(parts).encode()).hexdigest()
+
     @property
     def term(self):
         return self._term
@@ -139,6 +241,28 @@ class Term(object):
         self._description = Description()
         self._description.path = self._path / self.term
         self._description.content_text = description_text
+        self._shared.discard("description")
+
+    @property
+    def plain_text(self):
+        return self._description.plain_text
+
+    @property
+    def estimated_size(self):
+        """
+        Rough estimate of the memory used by the term in bytes, used to bound
+        the number of loaded terms.
+        """
+        return 1024 + self._description.estimated_size \
+            + self._links.estimated_size
+
+    @property
+    def description_is_dirty(self):
+        return self._description.is_dirty
+
+    @property
+    def missing_images(self):
+        return self._description.missing_images
 
     @property
     def linked_images(self):
@@ -154,6 +278,9 @@ class Term(object):
 
     @property
     def related_terms_as_html(self):
+        return self._cached_html("links", self._render_related_terms_html)
+
+    def _render_related_terms_html(self):
         html = list()
 
         for term in self._links.linked_terms:
@@ -162,17 +289,37 @@ class Term(object):
 
         return Term.html_template_links.substitute(links_html=''.join(html))
 
+    @property
+    def related_terms_in_graph(self):
+        return self._links.terms_in_graph
+
+    def set_related_terms(self, term_strs: list):
+        """
+        Sets the related terms from the link graph of the project. The links
+        of the term don't become dirty.
+        """
+        self._own_links().set_linked_terms(term_strs)
+
     @property
     def links(self):
-        return self._links
+        return self._own_links()
 
     def initialize_next_term(self):
         """
         This creates the next term object and initializes it with the previous
         term content.
+
+        The next term is a copy-on-write handle of this term, so creating it
+        doesn't copy the content. The version before this one is replaced
+        with a TermDelta, that has only the changes from this version to it,
+        and the versions beyond undo_depth are dropped.
         """
-        self._next_term = copy.deepcopy(self)
+        self._next_term = copy.copy(self)
+        self._next_term._next_term = None
         self._next_term._previous_term = self
+        if isinstance(self._previous_term, Term):
+            self._previous_term = TermDelta(self._previous_term, self)
+        TermDelta.limit(self._next_term, Term.undo_depth)
         logging.debug(
             "-----Initialized next term:" + os.linesep
             + "  term: " + self._next_term.term + os.linesep
@@ -186,6 +333,9 @@ class Term(object):
         """
         return self._links.get_file_path(file_name)
 
+    def blob_key(self, file_name: str):
+        return self._links.blob_key(file_name)
+
     def get_non_project_file_path(self, file_name: str):
         """
         This returns the filepath for given file_name if it's different
@@ -225,47 +375,87 @@ class Term(object):
 
         :param term: Term object
         """
-        self._links.link_term(term.term)
+        self._own_links().link_term(term.term)
 
     def unlink_term(self, term):
-        self._links.unlink_term(term.term)
+        self._own_links().unlink_term(term.term)
 
     def link_file(self, path: Path):
-        return self._links.link_file_on_mime(path)
+        return self._own_links().link_file_on_mime(path)
 
     def unlink_file(self, path: Path):
-        return self._links.unlink_file(path)
+        return self._own_links().unlink_file(path)
 
-    def load(self, path):
+    def load(self, path, storage=FOLDER_STORAGE):
+        """
+        Loads the term from the given project path.
+
+        :param path: path to project folder
+        :param storage: storage the term documents are read from
+        :return: self
+        """
         self._path = path
         self._links = Links()
-        self._links.load(path / self.term)
+        self._links.load(path / self.term, storage)
         self._description = Description()
-        self._description.load(path / self.term)
+        self._description.load(path / self.term, storage)
+        self._shared.clear()
+        self._saved_as = (path, self.term)
         return self
 
-    def save(self, path: Path):
+    @property
+    def is_dirty(self):
+        """
+        True if the term has changes, that are not saved in its current
+        location.
+        """
+        return (self._saved_as != (self._path, self.term)
+                or self._description.is_dirty or self._links.is_dirty)
+
+    def is_saved_in(self, path: Path):
+        """
+        True if the term has been loaded from or saved to the given project
+        path with its current term string.
+        """
+        return self._saved_as == (path, self.term)
+
+    def save(self, path: Path, storage=FOLDER_STORAGE):
         """
         Saves the current term into given path.
         Set _previous_term and _next_term to None, eg. forgets undo/redo
         history.
 
+        Only the changed parts of the term are written, unless the term is
+        saved to a new location (a new project path or a new term string).
+        The term folder is synchronized with the linked files only if files
+        have been linked or unlinked or the description has images from
+        outside of the term folder. The related terms from the link graph
+        are written to links.json, if they have changed since it was written.
+
         :param path: path to project folder
+        :param storage: storage the term documents are written to
         :return: None
         """
+        moved = self._saved_as != (path, self.term)
         self._path = path
         path /= self.term
-        if not path.exists():
+        if storage.uses_term_folders and not path.exists():
             path.mkdir()
 
-        self._links.save(path, self._description.added_image_paths)
-        self._description.save(path)
+        files = (moved or self._links.files_dirty
+                 or self._description.has_external_images)
+        if files or self._links.is_dirty or self._links.terms_stale:
+            self._own_links().save(
+                path, self._description.added_image_paths, storage, files)
+        if moved or self._description.is_dirty:
+            self._own_description().save(path, storage)
+        self._saved_as = (self._path, self.term)
         self._previous_term = None
         self._next_term = None
 
-    def delete(self):
-        self._links.delete()
-        self._description.delete()
+    def delete(self, storage=FOLDER_STORAGE):
+        self._links.delete(storage)
+        self._description.delete(storage)
         try:
             os.removedirs(str(self._path / self.term))
         except OSError as e:
@@ -302,3 +492,63 @@ class Term(object):
 
     def __hash__(self):
         return self.term.__hash__()
+
+
+class TermDelta(object):
+    """
+    An earlier version of a term kept for undo as the changes from the next
+    version to it: the term string, the changed lines of the description and
+    the links, if they are not the same object as in the next version. The
+    links are small and shared between the versions, until they are changed.
+
+    :param older: the earlier version
+    :param newer: the next version of older
+    """
+    def __init__(self, older: Term, newer: Term):
+        self.term = older.term
+        self.links = None
+        if older._links is not newer._links:
+            self.links = older._links
+        self.description_changes = None
+        if older._description is not newer._description:
+            older_text = older.description
+            newer_text = newer.description
+            if older_text != newer_text:
+                self.description_changes = text_changes(newer_text,
+                                                        older_text)
+        # Term, TermDelta or None:
+        self.previous = older._previous_term
+
+    def apply(self, newer: Term):
+        """
+        Returns the earlier version rebuilt from the next version.
+        """
+        term = copy.copy(newer)
+        term._term = self.term
+        if self.links is not None:
+            term._links = self.links
+        if self.description_changes is not None:
+            term.description = apply_text_changes(newer.description,
+                                                  self.description_changes)
+        term._previous_term = self.previous
+        term._next_term = newer
+        return term
+
+    @staticmethod
+    def limit(term: Term, depth: int):
+        """
+        Drops the versions of the term older than depth versions.
+        """
+        version = term
+        for i in range(depth):
+            if isinstance(version, Term):
+                previous = version._previous_term
+            else:
+                previous = version.previous
+            if previous is None:
+                return
+            version = previous
+        if isinstance(version, Term):
+            version._previous_term = None
+        else:
+            version.previous = None
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+#
+# This file is a part of Definator (https://github.com/aparaatti/definator)
+# and it is licensed under the GPLv3 (http://www.gnu.org/licenses/gpl-3.0.txt).
+#
+__author__ = 'aparaatti'
+
+import logging
+from collections import OrderedDict
+
+
+class TermCache(object):
+    """
+    Loaded Term objects by term string in least recently used order.
+
+    The cache can be bounded by the number of terms, by the estimated size of
+    the terms in bytes or both. Terms over the bounds are evicted by calling
+    evict, which skips the pinned terms (eg. terms with unsaved changes), so
+    the cache can be over its bounds while there are many of them.
+
+    >>> from data.term import Term
+    >>> cache = TermCache(max_terms=2)
+    >>> for term_str in ["a", "b", "c", "d"]:
+    ...     cache[term_str] = Term(term_str)
+    >>> cache.evict(pinned={"a"})
+    >>> list(cache.keys())
+    ['a', 'd']
+    """
+    def __init__(self, max_terms: int=None, max_bytes: int=None):
+        self.max_terms = max_terms
+        self.max_bytes = max_bytes
+        self._terms = OrderedDict()
+        self._sizes = dict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __contains__(self, term_str):
+        return term_str in self._terms
+
+    def __len__(self):
+        return len(self._terms)
+
+    def __getitem__(self, term_str):
+        return self._terms[term_str]
+
+    def __setitem__(self, term_str, term):
+        self.pop(term_str, None)
+        self._terms[term_str] = term
+        self._sizes[term_str] = term.estimated_size
+        self._bytes += self._sizes[term_str]
+
+    def pop(self, term_str, *default):
+        if term_str not in self._terms:
+            if default:
+                return default[0]
+            raise KeyError(term_str)
+        self._bytes -= self._sizes.pop(term_str)
+        return self._terms.pop(term_str)
+
+    def get(self, term_str, default=None):
+        return self._terms.get(term_str, default)
+
+    def keys(self):
+        return self._terms.keys()
+
+    def values(self):
+        return self._terms.values()
+
+    def clear(self):
+        self._terms.clear()
+        self._sizes.clear()
+        self._bytes = 0
+
+    def lookup(self, term_str):
+        """
+        Returns the term and marks it as the most recently used, or returns
+        None if the term is not in the cache. Counts the hits and misses.
+        """
+        term = self._terms.get(term_str)
+        if term is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self._terms.move_to_end(term_str)
+        return term
+
+    @property
+    def estimated_bytes(self):
+        return self._bytes
+
+    def _over_bounds(self):
+        return ((self.max_terms is not None
+                 and len(self._terms) > self.max_terms)
+                or (self.max_bytes is not None
+                    and self._bytes > self.max_bytes))
+
+    def evict(self, pinned=()):
+        """
+        Drops the least recently used terms, which are not pinned, until the
+        cache is within its bounds. The most recently used term is never
+        dropped.
+
+        :param pinned: term strings, that must not be dropped
+        """
+        if not self._over_bounds():
+            return
+        for term_str in list(self._terms.keys())[:-1]:
+            if not self._over_bounds():
+                break
+            if term_str not in pinned:
+                self.pop(term_str)
+                self.evictions += 1
+                logging.debug("evicted term " + term_str)
+
+    @property
+    def statistics(self):
+        """
+        Cache statistics as a dictionary.
+        """
+        return {"terms": len(self._terms), "bytes": self._bytes,
+                "hits": self.hits, "misses": self.misses,
+                "evictions": self.evictions}
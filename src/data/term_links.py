@@ -1,36 +1,138 @@
 import copy
+import itertools
 import mimetypes
 from .fs_helpers import *
 from .json_helpers import *
+from .storage import FOLDER_STORAGE
 from pathlib import Path
 
 
 class Links(object):
     """
     Handles linked terms and files.
+
+    Every change gives the links a new version number, which is used to tell
+    whether HTML rendered from the links is still current.
+
+    The linked terms are kept as an ordered set (dict keys). In a project
+    with a link graph, the linked terms are set from the graph with
+    set_linked_terms and linking terms doesn't make the links dirty. The
+    linked terms are still written to links.json, when the term is saved
+    and they differ from the ones written before (see terms_stale), so the
+    graph can be rebuilt from the terms, if it is lost.
+
+    The blob keys of the attached files (see BlobStore) are kept by file
+    name and saved in links.json.
     """
+    _versions = itertools.count(1)
+
     # TODO: Re factor all path changes through path property, now
     #       path gets set on load and save
     def __init__(self):
-        self._linked_terms = []
+        self._linked_terms = dict()
+        self._terms_in_graph = False
         self._linked_files = dict()
         self._linked_images = dict()
         self._to_delete = list()
+        self._blobs = dict()
         self._path = None
+        # The linked terms in links.json, when it was loaded or saved:
+        self._saved_terms = None
+        # Changes since load or save:
+        self._dirty = True
+        self._files_dirty = True
+        self._version = next(Links._versions)
 
     def __str__(self):
         return "linked terms: " + str(self._linked_terms) + os.linesep \
             + "linked files: " + str(self._linked_files) + os.linesep \
             + "linked images: " + str(self._linked_images) + os.linesep
 
+    def copy(self):
+        """
+        Returns a copy of this Links object. The containers are copied, the
+        contained strings and paths are shared.
+        """
+        links = Links()
+        links._linked_terms = dict(self._linked_terms)
+        links._terms_in_graph = self._terms_in_graph
+        links._linked_files = dict(self._linked_files)
+        links._linked_images = dict(self._linked_images)
+        links._to_delete = list(self._to_delete)
+        links._blobs = dict(self._blobs)
+        links._path = self._path
+        links._saved_terms = self._saved_terms
+        links._dirty = self._dirty
+        links._files_dirty = self._files_dirty
+        links._version = self._version
+        return links
+
+    @property
+    def is_dirty(self):
+        """
+        True if the links have changed after they were loaded or saved.
+        """
+        return self._dirty
+
+    @property
+    def version(self):
+        return self._version
+
+    @property
+    def estimated_size(self):
+        """
+        Rough estimate of the memory used by the links in bytes.
+        """
+        return 100 * (len(self._linked_terms) + len(self._linked_files)
+                      + len(self._linked_images))
+
+    @property
+    def files_dirty(self):
+        """
+        True if files have been linked or unlinked after load or save.
+        """
+        return self._files_dirty
+
+    def __contains__(self, term_str):
+        return term_str in self._linked_terms
+
+    @property
+    def terms_in_graph(self):
+        """
+        True if the linked terms are kept in a project link graph instead of
+        links.json.
+        """
+        return self._terms_in_graph
+
+    @property
+    def terms_stale(self):
+        """
+        True if the linked terms set from the link graph differ from the ones
+        in links.json.
+        """
+        return self._terms_in_graph and \
+            set(self._linked_terms) != set(self._saved_terms or ())
+
+    def set_linked_terms(self, term_strs: list):
+        """
+        Sets the linked terms from a project link graph.
+        """
+        self._linked_terms = dict.fromkeys(term_strs)
+        self._terms_in_graph = True
+        self._version = next(Links._versions)
+
     def link_term(self, term_str):
         if term_str not in self._linked_terms:
-            self._linked_terms.append(term_str)
+            self._linked_terms[term_str] = None
+            self._dirty = self._dirty or not self._terms_in_graph
+            self._version = next(Links._versions)
 
     def _link_image(self, path):
         if issubclass(type(path), Path) and\
            path not in self._linked_images.values():
                 self._linked_images[path.name] = path
+                self._dirty = self._files_dirty = True
+                self._version = next(Links._versions)
                 return True
         else:
             return False
@@ -39,39 +141,62 @@ class Links(object):
         if issubclass(type(path), Path) and\
            path not in self._linked_files.values():
                 self._linked_files[path.name] = path
+                self._dirty = self._files_dirty = True
+                self._version = next(Links._versions)
                 return True
         else:
             return False
 
     def unlink_term(self, term_str):
-        self._linked_terms.remove(term_str)
+        del self._linked_terms[term_str]
+        self._dirty = self._dirty or not self._terms_in_graph
+        self._version = next(Links._versions)
 
     def unlink_file(self, path: Path):
         if self._linked_files.get(path.name):
             self._to_delete.append(self._linked_files.pop(path.name))
+            self._dirty = self._files_dirty = True
+            self._version = next(Links._versions)
             return True
         elif self._linked_images.get(path.name):
             self._to_delete.append(self._linked_images.pop(path.name))
+            self._dirty = self._files_dirty = True
+            self._version = next(Links._versions)
             return True
         raise FileNotFoundError("Coudn't remove file from term: " + path.name)
 
-    def save(self, path: Path, description_images: list()):
+    def save(self, path: Path, description_images: list(),
+             storage=FOLDER_STORAGE, files: bool=True):
         """
         This saves linked files and deletes unlinked files from the parent
         term. Term object passes description_images list from the description
         object, because links handler doesn't nesesscarily have information of
         all shown images.
+
+        :param files: False if the term folder doesn't need to be synchronized
+            with the linked files, eg. no files have been linked, unlinked or
+            added to the description.
         """
+        source_path = self._path
         self._path = path
-        self._delete_removed_files(description_images)
-        self._save_files_to_term_path(description_images)
-        save_json(path / "links.json", self, LinksEncoder())
-
-    def _delete_removed_files(self, description_images: list()):
+        if files:
+            self._delete_removed_files(description_images, storage)
+            self._save_files_to_term_path(
+                description_images, storage, source_path)
+        storage.save_json(path / "links.json", self, LinksEncoder())
+        self._saved_terms = list(self._linked_terms)
+        self._to_delete.clear()
+        self._dirty = self._files_dirty = False
+
+    def _delete_removed_files(self, description_images: list(),
+                              storage=FOLDER_STORAGE):
         """
         We delete the files, that are marked for deletion, are not in
         term_files anymore and are in **term folder**.
         """
+        if not self._path.is_dir():
+            return
+
         term_folder_files = set()
         [term_folder_files.add(path.name) for path in self._path.iterdir()]
 
@@ -85,9 +210,12 @@ class Links(object):
         for path in self._to_delete:
             if path.name not in term_files and\
                path.name in term_folder_files:
-                    remove_file(self._path / path.name)
+                    storage.remove_attachment(self._path / path.name,
+                                              self._blobs.pop(path.name, None))
 
-    def _save_files_to_term_path(self, description_images: list):
+    def _save_files_to_term_path(self, description_images: list,
+                                 storage=FOLDER_STORAGE,
+                                 source_path: Path=None):
         """
         Saving of external files happens because their path is different than
         "". It also means that, one  can't add stuff from root folder (maybe).
@@ -95,34 +223,52 @@ class Links(object):
         The files that are in external paths are copied to term folder, from
         which they are read on load.
 
-        :param path:
-        :param added_images:
-        :return:
+        Files given with a name only are copied from the source path, eg.
+        the previous folder of the term.
+
+        :param source_path: folder the links were loaded or saved in before
         """
         term_folder_files = set()
-        [term_folder_files.add(path.name) for path in self._path.iterdir()]
+        if self._path.is_dir():
+            [term_folder_files.add(path.name) for path in self._path.iterdir()]
+        elif self._linked_files or description_images:
+            make_dir(self._path)
 
-        for file_path in self._linked_files.values():
+        for file_path in list(self._linked_files.values()):
             if file_path.name not in term_folder_files:
-                copy_file_to(file_path, self._path)
+                self._copy_file(file_path, storage, source_path)
                 self._linked_files[file_path.name] = Path(file_path.name)
 
         for img_path in description_images:
             if img_path.name not in term_folder_files:
-                copy_file_to(img_path, Path(self._path))
+                if not FOLDER_LISTING.exists(img_path):
+                    logging.warning("Image is missing: " + str(img_path))
+                    continue
+                self._copy_file(img_path, storage, source_path)
                 self._linked_images[img_path.name] = Path(img_path.name)
 
-    def load(self, path: Path):
+        for name, key in list(self._blobs.items()):
+            self._blobs[name] = storage.reference_file(self._path / name, key)
+
+    def _copy_file(self, path: Path, storage, source_path: Path=None):
+        if len(path.parts) == 1 and source_path is not None:
+            path = source_path / path
+        key = storage.copy_file_to(path, self._path, self._blobs.get(path.name))
+        if key is not None:
+            self._blobs[path.name] = key
+
+    def load(self, path: Path, storage=FOLDER_STORAGE):
         self._path = path
-        dictionary = load_json(self._path / "links.json", LinksDecoder())
+        dictionary = storage.load_json(self._path / "links.json",
+                                       LinksDecoder())
         if type(dictionary) is dict:
-            self._linked_terms = dictionary.get("terms")
+            self._linked_terms = dict.fromkeys(dictionary.get("terms", []))
+            self._saved_terms = list(self._linked_terms)
+            self._blobs = dict(dictionary.get("blobs", {}))
 
-        if self._path.is_dir():
-            for file in self._path.iterdir():
-                if file.is_file and file.name not in ["links.json",
-                                                      "description.json"]:
-                    self.link_file_on_mime(Path(file.name))
+        for file_name in storage.list_files(self._path):
+            self.link_file_on_mime(Path(file_name))
+        self._dirty = self._files_dirty = False
 
         logging.debug("links after load: " + str(self.linked_images) + " "
                       + str(self.linked_files) + " " + str(self.linked_terms))
@@ -138,17 +284,26 @@ class Links(object):
         else:
             return self._link_file(path)
 
-    def delete(self):
-        remove_file(self._path / "links.json")
+    def delete(self, storage=FOLDER_STORAGE):
+        storage.remove(self._path / "links.json")
         for file in self._linked_files.values():
-            remove_file(self._path / file)
+            storage.remove_attachment(self._path / file,
+                                      self._blobs.get(file.name))
 
         for file in self._linked_images.values():
-            remove_file(self._path / file)
+            storage.remove_attachment(self._path / file,
+                                      self._blobs.get(file.name))
+
+    def blob_key(self, file_name: str):
+        """
+        Returns the blob key of the attached file or None, if it is not
+        known.
+        """
+        return self._blobs.get(file_name)
 
     @property
     def linked_terms(self):
-        return copy.copy(self._linked_terms)
+        return list(self._linked_terms)
 
     @property
     def linked_images(self):
@@ -220,6 +375,8 @@ class LinksEncoder(json.JSONEncoder):
             links["terms"] = obj.linked_terms
             links["files"] = files
             links["images"] = images
+            if obj._blobs:
+                links["blobs"] = obj._blobs
 
             return links
         # Let the base class default method raise the TypeError
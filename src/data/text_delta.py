@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+#
+# This file is a part of Definator (https://github.com/aparaatti/definator)
+# and it is licensed under the GPLv3 (http://www.gnu.org/licenses/gpl-3.0.txt).
+#
+__author__ = 'aparaatti'
+
+from difflib import SequenceMatcher
+
+
+def text_changes(source: str, target: str):
+    """
+    Returns the changes, that turn the source text into the target text, as
+    a list of (first line, end line, text) tuples: the lines from first line
+    up to end line of the source are replaced with the text. Only the lines
+    between the common beginning and end of the texts are compared, so the
+    changes are found in time proportional to the length of the texts and
+    the size of the change.
+
+    >>> changes = text_changes("a\\nb\\nc\\n", "a\\nB\\nc\\nd\\n")
+    >>> changes
+    [(1, 2, 'B\\n'), (3, 3, 'd\\n')]
+    >>> apply_text_changes("a\\nb\\nc\\n", changes)
+    'a\\nB\\nc\\nd\\n'
+    """
+    source_lines = source.splitlines(True)
+    target_lines = target.splitlines(True)
+    common = min(len(source_lines), len(target_lines))
+    start = 0
+    while start < common and source_lines[start] == target_lines[start]:
+        start += 1
+    end = 0
+    while end < common - start and \
+            source_lines[-1 - end] == target_lines[-1 - end]:
+        end += 1
+
+    source_middle = source_lines[start:len(source_lines) - end]
+    target_middle = target_lines[start:len(target_lines) - end]
+    matcher = SequenceMatcher(None, source_middle, target_middle,
+                              autojunk=False)
+    return [(start + i1, start + i2, ''.join(target_middle[j1:j2]))
+            for tag, i1, i2, j1, j2 in matcher.get_opcodes()
+            if tag != 'equal']
+
+
+def apply_text_changes(source: str, changes: list):
+    """
+    Returns the text made by applying the changes from text_changes to the
+    source text.
+    """
+    lines = source.splitlines(True)
+    for first, end, text in reversed(changes):
+        lines[first:end] = text.splitlines(True)
+    return ''.join(lines)
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+#
+# This file is a part of Definator (https://github.com/aparaatti/definator)
+# and it is licensed under the GPLv3 (http://www.gnu.org/licenses/gpl-3.0.txt).
+#
+__author__ = 'aparaatti'
+
+import os
+import time
+import shutil
+import logging
+import threading
+from pathlib import Path
+
+from .fs_helpers import make_dir
+
+
+class Trash(object):
+    """
+    Removed terms and attached files of a project. They are moved here with a
+    single rename each, instead of being deleted while the project is saved.
+
+    The things removed by a save are kept in a slot folder of their own, in
+    the same relative paths they had in the project, eg. the folder of a
+    removed term "cat" is "<slot>/cat". The slots are removed by purge,
+    when they are old enough, which can be done in the background.
+
+    :param path: the trash folder
+    """
+    def __init__(self, path: Path):
+        self._path = path
+
+    @property
+    def path(self):
+        return self._path
+
+    def new_slot(self):
+        """
+        Creates a new slot folder and returns its path.
+        """
+        if not self._path.exists():
+            os.makedirs(str(self._path), exist_ok=True)
+        name = time.strftime("%Y%m%d-%H%M%S")
+        slot = self._path / name
+        count = 1
+        while slot.exists():
+            slot = self._path / (name + "-" + str(count))
+            count += 1
+        make_dir(slot)
+        return slot
+
+    def slots(self):
+        """
+        Returns the paths of the slots, oldest first.
+        """
+        if not self._path.is_dir():
+            return []
+        return sorted(path for path in self._path.iterdir() if path.is_dir())
+
+    def find(self, term_str: str):
+        """
+        Returns the folder of the most recently removed term with the given
+        name or None, if the term is not in the trash.
+        """
+        for slot in reversed(self.slots()):
+            folder = slot / term_str
+            if (folder / "description.json").is_file():
+                return folder
+        return None
+
+    def terms(self):
+        """
+        Returns the names of the removed terms in the trash as a sorted list.
+        """
+        terms = set()
+        for slot in self.slots():
+            terms.update(folder.name for folder in slot.iterdir()
+                         if (folder / "description.json").is_file())
+        return sorted(terms)
+
+    def purge(self, max_age: float=0):
+        """
+        Removes the slots older than max_age seconds.
+
+        :return: number of slots removed
+        """
+        removed = 0
+        now = time.time()
+        for slot in self.slots():
+            try:
+                if now - slot.stat().st_mtime < max_age:
+                    continue
+                shutil.rmtree(str(slot))
+                removed += 1
+            except OSError as e:
+                logging.warning("Could not purge " + str(slot) + ": "
+                                + str(e))
+        return removed
+
+    def purge_in_background(self, max_age: float=0):
+        """
+        Runs purge in a daemon thread and returns the thread.
+        """
+        thread = threading.Thread(target=self.purge, args=(max_age,),
+                                  name="trash-purge", daemon=True)
+        thread.start()
+        return thread
@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+#
+# This file is a part of Definator (https://github.com/aparaatti/definator)
+# and it is licensed under the GPLv3 (http://www.gnu.org/licenses/gpl-3.0.txt).
+#
+__author__ = 'aparaatti'
+
+import logging
+
+from PyQt5.QtCore import QThread, pyqtSignal
+
+from .data.term import Term
+
+
+class OpenWorker(QThread):
+    """
+    Runs a ProjectLoad (see TermsController.begin_load) in a thread, so the
+    GUI stays usable while a project is opened.
+
+    The sorted term list is given out in chunks with signal_terms(list) and
+    the first term with signal_first_term(Term) as soon as it is loaded. An
+    error is reported with signal_failed(message). QThread.finished is
+    emitted after the load in either case, after which
+    TermsController.finish_load has to be called in the GUI thread, if the
+    load didn't fail.
+    """
+    signal_terms = pyqtSignal(list)
+    signal_first_term = pyqtSignal(Term)
+    signal_failed = pyqtSignal(str)
+
+    def __init__(self, project_load, parent=None):
+        super(OpenWorker, self).__init__(parent)
+        self.project_load = project_load
+        self.failed = False
+
+    def run(self):
+        try:
+            self.project_load.run(self.signal_terms.emit,
+                                  self.signal_first_term.emit)
+        except Exception as e:
+            logging.exception("Opening the project failed")
+            self.failed = True
+            self.signal_failed.emit(str(e))
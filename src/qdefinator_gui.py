@@ -11,13 +11,15 @@ from pathlib import Path
 from PyQt5.QtCore import pyqtSignal, pyqtSlot, Qt
 from PyQt5.QtGui import QKeySequence, QIcon, QCursor
 from PyQt5.QtWidgets import QMainWindow, QLabel, QApplication, QFileDialog, \
-    QMessageBox, QStatusBar
+    QMessageBox, QStatusBar, QProgressBar, QPushButton, QInputDialog
 
 from .widgets.qt_helper_functions import make_action_helper, warning_dialog, \
     info_dialog
 from .data.term import Term
 from .widgets.main_widget import MainWidget
-from .terms_controller import TermsController
+from .terms_controller import TermsController, ProjectSaveAs
+from .save_worker import SaveWorker
+from .open_worker import OpenWorker
 
 
 __author__ = "Niko Humalamäki"
@@ -37,16 +39,22 @@ class MainWindow(QMainWindow):
     signal_updated_a_term = pyqtSignal(Term)
     signal_removed_a_term = pyqtSignal(Term)
 
-    signal_opened_a_project = pyqtSignal(list, Term)
+    signal_loading_a_project = pyqtSignal()
+    signal_loaded_terms = pyqtSignal(list)
+    signal_opened_a_project = pyqtSignal(Term)
+    signal_recovered_changes = pyqtSignal(list, list)
     signal_started_a_new_project = pyqtSignal()
-    signal_project_saved = pyqtSignal()
+    signal_project_saved = pyqtSignal(list)
     signal_edit_term = pyqtSignal(Term)
 
     def __init__(self, parent=None):
         super(MainWindow, self).__init__(parent)
 
         self._current_term = None
-        self.terms_controller = TermsController()
+        self._save_worker = None
+        self._open_worker = None
+        self.terms_controller = TermsController(render_cache=True,
+                                                journal=True)
         self.main_widget = MainWidget()
         self._init_settings()
         self.menu = self._init_menu()
@@ -58,31 +66,99 @@ class MainWindow(QMainWindow):
 
         self.term_count_label = QLabel()
         self.term_count_label.setMargin(5)
+        self.save_progress_bar = QProgressBar()
+        self.save_progress_bar.setMaximumWidth(200)
+        self.save_progress_bar.hide()
+        self.cancel_save_button = QPushButton("Cancel")
+        self.cancel_save_button.clicked.connect(self._cancel_save)
+        self.cancel_save_button.hide()
 
         self._create_a_new_project()
         QStatusBar()
         status = self.statusBar()
         status.setSizeGripEnabled(False)
+        status.addPermanentWidget(self.save_progress_bar)
+        status.addPermanentWidget(self.cancel_save_button)
         status.addPermanentWidget(self.term_count_label)
         status.showMessage("Ready", 5000)
 
-    def _initialize_project(self, project_path):
+    def _initialize_project(self, project_path, journal: bool=True):
         """
         This method initializes a project based on given project_path e.g.
         loads a project.
+
+        The project is read in an OpenWorker thread. The term browser is
+        filled in chunks and the first term is shown as soon as they are
+        read, while the rest of the project is still being read.
+
+        :param journal: False if the changes are not journaled, eg. for the
+            help project
         """
+        if self._open_worker is not None:
+            return
         logging.debug("Initializing project from: " + str(project_path))
-        try:
-            list_of_terms = self.terms_controller.load_project(project_path)
-        except FileNotFoundError:
-            warning_dialog(
-                self, "Could not open.",
-                "Could not open project from " + str(project_path) + ".")
+        self._first_loaded_chunk = True
+        self._opening_path = project_path
+        self._open_worker = OpenWorker(
+            self.terms_controller.begin_load(project_path, journal), self)
+        self._open_worker.signal_terms.connect(self._add_loaded_terms)
+        self._open_worker.signal_first_term.connect(
+            self.main_widget.show_loaded_term)
+        self._open_worker.signal_failed.connect(self._open_failed)
+        self._open_worker.finished.connect(self._open_finished)
+        self._set_project_actions_enabled(False)
+        self.statusBar().showMessage("Opening " + str(project_path) + "...")
+        self._open_worker.start()
+
+    @pyqtSlot(list)
+    def _add_loaded_terms(self, terms: list):
+        if self._first_loaded_chunk:
+            # The term list of the project has been read:
+            self._first_loaded_chunk = False
+            self.signal_loading_a_project.emit()
+        self.signal_loaded_terms.emit(terms)
+
+    @pyqtSlot(str)
+    def _open_failed(self, message: str):
+        warning_dialog(
+            self, "Could not open.",
+            "Could not open project from " + str(self._opening_path) + ".")
+
+    @pyqtSlot()
+    def _open_finished(self):
+        """
+        Takes the project read by the OpenWorker into use.
+        """
+        if self._open_worker is None:
             return
+        worker = self._open_worker
+        self._open_worker = None
+        self._set_project_actions_enabled(True)
+        if worker.failed:
+            self.statusBar().clearMessage()
+            if not self._first_loaded_chunk:
+                # The term browser has been emptied for the failed project:
+                self.main_widget.setEnabled(True)
+                self._start_a_new_project()
+            return
+        list_of_terms = self.terms_controller.finish_load(
+            worker.project_load)
         self._set_window_title()
         self._term_counter()
-        self.signal_opened_a_project.emit(
-            list_of_terms, self.terms_controller.get_term(list_of_terms[0]))
+        self.statusBar().showMessage("Ready", 5000)
+        if self.terms_controller.unsaved_changes:
+            # Changes replayed from the journal of the project:
+            self.signal_recovered_changes.emit(
+                list_of_terms, self.terms_controller.unsaved_terms)
+            self.statusBar().showMessage(
+                "Recovered " + str(self.terms_controller.unsaved_changes)
+                + " unsaved terms.", 5000)
+        if not list_of_terms:
+            self.signal_started_a_new_project.emit()
+            return
+        first_term = self.terms_controller.get_term(list_of_terms[0])
+        self.signal_opened_a_project.emit(first_term)
+        self._prefetch_neighbours(first_term)
 
     def _set_window_title(self):
         """
@@ -100,9 +176,13 @@ class MainWindow(QMainWindow):
         """
         if not self._check_for_unsaved_changes():
             return
+        self._start_a_new_project()
+
+    def _start_a_new_project(self):
         logging.info("Initializing a new project...")
         self.signal_started_a_new_project.emit()
-        self.terms_controller = TermsController()
+        self.terms_controller = TermsController(render_cache=True,
+                                                journal=True)
         self._current_term = None
         self._set_window_title()
         self._term_counter()
@@ -115,6 +195,7 @@ class MainWindow(QMainWindow):
         :return: False if Cancel is given, True if No or Yes is given in the
             dialog.
         """
+        self._wait_for_save()
         if self.terms_controller.unsaved_changes:
             save = QMessageBox.question(
                 self, "Unsaved changes",
@@ -123,8 +204,11 @@ class MainWindow(QMainWindow):
                 QMessageBox.Yes | QMessageBox.No | QMessageBox.Cancel)
             if save == QMessageBox.Yes:
                 self._save_project()
+                self._wait_for_save()
             elif save == QMessageBox.Cancel:
                 return False
+            else:
+                self.terms_controller.discard_changes()
         return True
 
     def _open_project(self):
@@ -144,33 +228,132 @@ class MainWindow(QMainWindow):
         have a project_path saving is delegated to _save_project_as
         method.
 
-        After saving an info dialog is shown, that tells that the project was
-        saved.
+        The changes are written in a SaveWorker thread, while the progress is
+        shown in the status bar. The terms can be viewed and edited during
+        the save; the changes made meanwhile are saved by the next save.
         """
+        if self._save_worker is not None:
+            return
         if self.terms_controller.project_path == Path(""):
             self._save_project_as()
-        else:
-            self.terms_controller.save_project()
-            self.signal_project_saved.emit()
-            info_dialog(
-                self, "Project saved", "Project saved at "
-                + str(self.terms_controller.project_path) + ".")
+            return
+        project_save = self.terms_controller.begin_save()
+        if project_save is None:
+            return
+        self._save_worker = SaveWorker(project_save, self)
+        self._save_worker.signal_progress.connect(self._show_save_progress)
+        self._save_worker.signal_failed.connect(self._save_failed)
+        self._save_worker.finished.connect(self._save_finished)
+        self._set_saving(True)
+        self._show_save_progress(0, project_save.total)
+        self._save_worker.start()
+
+    def _set_saving(self, saving: bool):
+        """
+        Shows the save progress in the status bar and disables the actions,
+        that can't be done during a save.
+        """
+        self.save_progress_bar.setVisible(saving)
+        self.cancel_save_button.setVisible(saving)
+        self.cancel_save_button.setEnabled(saving)
+        self._set_project_actions_enabled(not saving)
+
+    def _set_project_actions_enabled(self, enabled: bool):
+        for action in [self.act_new_project, self.act_open_project,
+                       self.act_save_project, self.act_save_project_as,
+                       self.act_restore_term, self.act_reclaim_space,
+                       self.act_help]:
+            action.setEnabled(enabled)
+
+    def _cancel_save(self):
+        if self._save_worker is not None:
+            self._save_worker.cancel()
+            self.cancel_save_button.setEnabled(False)
+            self.statusBar().showMessage("Cancelling the save...")
+
+    def _wait_for_save(self):
+        """
+        Waits for a running save or open to finish, eg. before the project is
+        closed.
+        """
+        if self._open_worker is not None:
+            self._open_worker.wait()
+            self._open_finished()
+        if self._save_worker is not None:
+            self._save_worker.wait()
+            self._save_finished()
+
+    @pyqtSlot(str)
+    def _save_failed(self, message: str):
+        warning_dialog(self, "Could not save.",
+                       "Could not save the project: " + message)
+
+    @pyqtSlot()
+    def _save_finished(self):
+        """
+        Marks the written changes as saved after the SaveWorker is done.
+        """
+        if self._save_worker is None:
+            return
+        project_save = self._save_worker.project_save
+        self._save_worker = None
+        if isinstance(project_save, ProjectSaveAs):
+            self._save_as_finished(project_save)
+            return
+        self.terms_controller.finish_save(project_save)
+        self._set_saving(False)
+        self.signal_project_saved.emit(self.terms_controller.unsaved_terms)
+        if project_save.is_complete:
+            self.statusBar().showMessage(
+                "Project saved at "
+                + str(self.terms_controller.project_path) + ".", 5000)
+        elif project_save.is_cancelled:
+            self.statusBar().showMessage(
+                "Save cancelled, " + str(len(project_save.saved_terms))
+                + " terms were saved.", 5000)
 
     def _save_project_as(self):
         """
         This method saves the project to a new location. User chooses a folder
         with raised dialog. If the path from dialog is sane the project is
         saved and an information dialog is shown.
+
+        The project is written in a SaveWorker thread. The window is disabled
+        until the save is done, since the controller is switched to the new
+        location during the save.
         """
+        if self._save_worker is not None:
+            return
         project_path = self._choose_a_folder()
         logging.debug("Project path on save: " + str(project_path))
         if project_path is not Path("."):
-            self.terms_controller.save_project_as(project_path)
-            self._set_window_title()
+            project_save = self.terms_controller.begin_save_as(project_path)
+            self._save_worker = SaveWorker(project_save, self)
+            self._save_worker.signal_progress.connect(self._show_save_progress)
+            self._save_worker.signal_failed.connect(self._save_failed)
+            self._save_worker.finished.connect(self._save_finished)
+            self._set_saving(True)
+            self.cancel_save_button.setEnabled(False)
+            self.setEnabled(False)
+            self._show_save_progress(0, self.terms_controller.count)
+            self._save_worker.start()
+
+    def _save_as_finished(self, project_save: ProjectSaveAs):
+        self.setEnabled(True)
+        self._set_saving(False)
+        self._set_window_title()
+        if project_save.is_complete:
             info_dialog(
                 self, "Project saved", "Project saved at " +
                 str(self.terms_controller.project_path) + ".")
-            self.signal_project_saved.emit()
+        self.signal_project_saved.emit(self.terms_controller.unsaved_terms)
+
+    @pyqtSlot(int, int)
+    def _show_save_progress(self, done: int, total: int):
+        self.save_progress_bar.setMaximum(max(total, 1))
+        self.save_progress_bar.setValue(done)
+        self.statusBar().showMessage(
+            "Saving term " + str(done) + "/" + str(total) + "...")
 
     def _open_help(self):
         """
@@ -179,7 +362,8 @@ class MainWindow(QMainWindow):
         # TODO disable saving edits for help project.
         logging.debug("Help fetch path: " + os.getcwd() + "/help-project")
         if self._check_for_unsaved_changes():
-            self._initialize_project(Path(Path(os.getcwd() + "/help-project")))
+            self._initialize_project(
+                Path(Path(os.getcwd() + "/help-project")), journal=False)
 
     def _quit(self):
         """
@@ -258,6 +442,7 @@ class MainWindow(QMainWindow):
                 self.signal_updated_a_term.emit(term)
         except RuntimeError as re:
             warning_dialog(self, "Runtime error", re.message)
+        self._warn_missing_images(term)
 
     @pyqtSlot(Term)
     def add_term(self, term: Term):
@@ -271,12 +456,24 @@ class MainWindow(QMainWindow):
             self._current_term = term
             self.signal_added_a_term.emit(term)
             self._term_counter()
+            self._warn_missing_images(term)
         else:
             warning_dialog(
                 self, "Term already exists.", 'The term "' +
                 term.term + '" already exists in the project.')
             self.signal_edit_term.emit(term)
 
+    def _warn_missing_images(self, term: Term):
+        """
+        Tells in the status bar, if images of the description of the term
+        are missing.
+        """
+        missing = term.missing_images
+        if missing:
+            self.statusBar().showMessage(
+                "Missing images: " + ", ".join(path.name for path in missing),
+                10000)
+
     @pyqtSlot(Term)
     def remove_term(self, term_str: str):
         """
@@ -289,8 +486,70 @@ class MainWindow(QMainWindow):
         """
         if self.terms_controller.remove_term(term_str):
             self.signal_removed_a_term.emit(Term(term_str))
+
+    def _restore_term(self):
+        """
+        This asks for a removed term in the trash of the project and restores
+        it. If the term is restored signal_added_a_term(Term) is emitted.
+        """
+        terms = self.terms_controller.trashed_terms
+        if not terms:
+            info_dialog(self, "Nothing to restore",
+                        "There are no removed terms in the trash of the "
+                        "project.")
+            return
+        term_str, ok = QInputDialog.getItem(
+            self, "Restore a removed term", "Term:", terms, 0, False)
+        if not ok:
+            return
+        term = self.terms_controller.restore_term(term_str)
+        if term is None:
+            warning_dialog(self, "Could not restore.",
+                           'The term "' + term_str + '" could not be '
+                           'restored.')
+        else:
+            self.signal_added_a_term.emit(term)
             self._term_counter()
 
+    def _reclaim_space(self):
+        """
+        This scans the term folders of the project for unreferenced and
+        duplicate attached files and asks whether the space they take is
+        reclaimed. The unreferenced files are moved to the trash of the
+        project.
+        """
+        report = self.terms_controller.scan_attachments()
+        if report is None:
+            info_dialog(self, "Project not saved",
+                        "Save the project before reclaiming space.")
+            return
+        if not report.reclaimable_bytes:
+            info_dialog(self, "Nothing to reclaim",
+                        "Scanned " + str(report) + ".")
+            return
+        actions = list()
+        if report.orphans:
+            actions.append("move the unreferenced files to the trash")
+        if report.duplicates:
+            actions.append("store the duplicate files once")
+        reclaim = QMessageBox.question(
+            self, "Reclaim space",
+            "Scanned " + str(report) + "." + os.linesep + os.linesep
+            + "Do you want to " + " and ".join(actions) + "?",
+            QMessageBox.Yes | QMessageBox.No)
+        if reclaim != QMessageBox.Yes:
+            return
+        freed = self.terms_controller.reclaim_attachments(report)
+        if freed > 0:
+            self.statusBar().showMessage(
+                "Reclaimed " + str(freed) + " bytes.", 5000)
+        else:
+            self.statusBar().showMessage(
+                "The files had changed, no space was reclaimed.", 5000)
+        if self._current_term is not None:
+            # The attached files of the term may have changed:
+            self.get_term(self._current_term.term)
+
     @pyqtSlot(str)
     def get_term(self, term_str: str):
         """
@@ -305,22 +564,34 @@ class MainWindow(QMainWindow):
             term = self.terms_controller.get_term(term_str)
             self._current_term = term
             self.signal_current_term.emit(self._current_term)
+            self._prefetch_neighbours(term)
         except KeyError:
             logging.warning("KeyError, No key: " + term_str)
             warning_dialog(
                 self, "No such term", 'Current project does not have term "'
                 + term_str + '".')
 
+    def _prefetch_neighbours(self, term: Term):
+        """
+        This starts loading the terms, that are likely to be opened next, in
+        the background: the related terms of the given term and the terms next
+        to it in the term browser.
+        """
+        self.terms_controller.prefetch(
+            term.related_terms +
+            self.main_widget.term_str_browser.neighbours(term.term))
+
     @pyqtSlot(str, list)
     def link_terms(self, term: Term, str_terms: list):
         """
         This slot delegates linking of terms (received as string list) to
-        a received Term object to TermsController. When linking is done
-        signal_updated_a_term(Term) is emitted.
+        a received Term object to TermsController. All the terms are linked
+        at once and when linking is done signal_updated_a_term(Term) is
+        emitted once.
 
         """
         # TODO Maybe needs error handling?
-        self.terms_controller.link_terms(term, str_terms)
+        self.terms_controller.link_many(term, str_terms)
         self.signal_updated_a_term.emit(term)
 
     @pyqtSlot(str, list)
@@ -331,7 +602,7 @@ class MainWindow(QMainWindow):
         is done signal_updated_a_term(Term) is raised.
         """
         # TODO Maybe needs error handling?
-        self.terms_controller.unlink_terms(term, str_terms)
+        self.terms_controller.unlink_many(term, str_terms)
         self.signal_updated_a_term.emit(term)
 
     @pyqtSlot()
@@ -390,6 +661,11 @@ class MainWindow(QMainWindow):
 
         # MainWidget handles changing and updating the term to it's components:
         self.signal_current_term.connect(self.main_widget.change_term)
+        self.signal_loading_a_project.connect(
+            self.main_widget.start_loading_a_project)
+        self.signal_loaded_terms.connect(self.main_widget.add_loaded_terms)
+        self.signal_recovered_changes.connect(
+            self.main_widget.show_recovered_changes)
         self.signal_opened_a_project.connect(
             self.main_widget.initialize_a_project)
         self.signal_added_a_term.connect(self.main_widget.added_a_term)
@@ -424,6 +700,15 @@ class MainWindow(QMainWindow):
             self, "Quit", "Exit application", QKeySequence.Quit,
             QIcon.fromTheme('application-exit'))
         self.act_quit.triggered.connect(self._quit)
+        self.act_restore_term = make_action_helper(
+            self, "&Restore a removed term...", "Restore a removed term",
+            None, QIcon.fromTheme('edit-undo'))
+        self.act_restore_term.triggered.connect(self._restore_term)
+        self.act_reclaim_space = make_action_helper(
+            self, "&Reclaim space...",
+            "Remove unreferenced and duplicate attached files", None,
+            QIcon.fromTheme('edit-clear'))
+        self.act_reclaim_space.triggered.connect(self._reclaim_space)
 
         self.act_new_project.triggered.connect(self._create_a_new_project)
         self.act_open_project.triggered.connect(self._open_project)
@@ -435,6 +720,7 @@ class MainWindow(QMainWindow):
         self.menu["file"].addSeparator()
         self.menu["file"].addAction(self.act_save_project)
         self.menu["file"].addAction(self.act_save_project_as)
+        self.menu["file"].addAction(self.act_reclaim_space)
         self.menu["file"].addSeparator()
         self.menu["file"].addAction(self.act_quit)
 
@@ -459,6 +745,7 @@ class MainWindow(QMainWindow):
         self.menu["term"].addSeparator()
         self.menu["term"].addAction(self.main_widget.act_save_term)
         self.menu["term"].addAction(self.main_widget.act_rem_term)
+        self.menu["term"].addAction(self.act_restore_term)
 
         self.act_help = make_action_helper(
             self, "Open help...", "Open help",
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+#
+# This file is a part of Definator (https://github.com/aparaatti/definator)
+# and it is licensed under the GPLv3 (http://www.gnu.org/licenses/gpl-3.0.txt).
+#
+__author__ = 'aparaatti'
+
+import logging
+
+from PyQt5.QtCore import QThread, pyqtSignal
+
+
+class SaveWorker(QThread):
+    """
+    Runs a ProjectSave (see TermsController.begin_save) in a thread, so the
+    GUI stays usable while the project is written. A ProjectSaveAs (see
+    TermsController.begin_save_as) is run the same way, but the GUI must not
+    use the controller until it is done.
+
+    Progress is reported with signal_progress(done, total) and an error of
+    the save with signal_failed(message). QThread.finished is emitted after
+    the save in either case, after which TermsController.finish_save has to
+    be called in the GUI thread.
+    """
+    signal_progress = pyqtSignal(int, int)
+    signal_failed = pyqtSignal(str)
+
+    def __init__(self, project_save, parent=None):
+        super(SaveWorker, self).__init__(parent)
+        self.project_save = project_save
+
+    def run(self):
+        try:
+            self.project_save.run(self.signal_progress.emit)
+        except Exception as e:
+            logging.exception("Saving the project failed")
+            self.signal_failed.emit(str(e))
+
+    def cancel(self):
+        self.project_save.cancel()
@@ -5,8 +5,16 @@
 #
 __author__ = 'Niko Humalamäki'
 
-from copy import deepcopy
+import threading
+from concurrent.futures import ThreadPoolExecutor, Future
 from .data.term import *
+from .data.storage import FolderStorage, WriteStatistics, open_storage
+from .data.search_index import SearchIndex
+from .data.term_cache import TermCache
+from .data.render_cache import RenderCache
+from .data.link_graph import LinkGraph
+from .data.operation_journal import OperationJournal
+from .data.attachment_scanner import AttachmentScanner
 
 
 class TermsController(object):
@@ -33,21 +41,96 @@ class TermsController(object):
     >>> termJSON = tc.get_term("JSON")
     >>> termJSON.term
     'JSON'
+
+    The loaded terms are kept in a cache bounded by max_cached_terms and
+    max_cached_bytes (None for no bound). Terms with unsaved changes are
+    never dropped from the cache.
+
+    The links between the terms are kept in a project link graph, which is
+    what the related terms of a term are read from.
+
+    If render_cache is True, the HTML rendered from the terms is saved, when
+    the project is saved, so the terms shown in an earlier session are not
+    rendered again when the project is opened.
+
+    If journal is True, the changes are appended to an operation journal in
+    the project meta folder as they are made, except for the projects, that
+    are opened without a journal (see begin_load) or can't be written to.
+    The journal file is made on the first change and flushed to disk, when
+    the project is saved, and the operations are dropped from it, when
+    they have been written to the term documents. The operations left in the
+    journal, eg. by a crash, are replayed as unsaved changes, when the
+    project is loaded.
+
+    The removed terms and attached files are moved to the trash of the
+    project, when the project is saved. The removed terms can be restored
+    from the trash, until the things older than trash_max_age seconds are
+    purged in the background, when the project is loaded.
     """
-    def __init__(self):
+    trash_max_age = 30 * 24 * 60 * 60
+
+    def __init__(self, max_cached_terms: int=2000,
+                 max_cached_bytes: int=None, render_cache: bool=False,
+                 journal: bool=False):
         self._project_path = Path('')
+        self._storage = FolderStorage()
         self._terms_list = []
-        self._terms = {}
+        self._terms_list_changed = False
+        self._terms = TermCache(max_cached_terms, max_cached_bytes)
         self._changed_terms = {}
         self._deleted_terms = {}
+        self._index = SearchIndex()
+        self._graph = LinkGraph()
+        # Restored terms, whose folders are still in the trash, term_str ->
+        # folder:
+        self._restored = {}
+        # Terms of the project, that are missing from the search index:
+        self._unindexed = set()
+        # Terms being loaded in the background, term_str -> Future:
+        self._prefetching = {}
+        self._prefetch_pool = None
+        self._render_cache = RenderCache() if render_cache else None
+        self._use_journal = journal
+        self._journal = None
+        self._replaying = False
 
     def get_term(self, term_str) -> Term:
+        """
+        Returns a copy-on-write handle of the term. The handle shares the
+        description and links of the stored term until it is changed, so
+        fetching a term doesn't copy it.
+        """
         if term_str in self._terms_list:
-            self._lazy_load_term(term_str)
-            return deepcopy(self._terms[term_str])
+            term = self._lazy_load_term(term_str)
+            self._sync_links(term)
+            return copy.copy(term)
         else:
             raise NoSuchTermException
 
+    def _sync_links(self, term: Term):
+        """
+        Sets the related terms of the term from the link graph, if they
+        differ.
+        """
+        related = self._graph.related(term.term)
+        if not term.related_terms_in_graph or term.related_terms != related:
+            term.set_related_terms(related)
+
+    def related_terms(self, term_str: str):
+        """
+        Returns the terms the term is linked to, without loading the term.
+        """
+        return self._graph.related(term_str)
+
+    def backlinks(self, term_str: str):
+        """
+        Returns the set of terms, that link to the term.
+        """
+        return self._graph.backlinks(term_str)
+
+    def is_linked(self, term_str: str, related: str):
+        return self._graph.is_linked(term_str, related)
+
     @property
     def count(self):
         return len(self._terms_list)
@@ -59,17 +142,22 @@ class TermsController(object):
 
         :param term_str: term to remove as a str
         """
-        if term_str not in self._terms.keys():
+        if term_str not in self._terms_list:
             return False
 
-        if self._deleted_terms.get(term_str) is None:
-            self._deleted_terms[term_str] = list()
-
-        term_to_be_deleted = self._terms.pop(term_str)
-        self._deleted_terms[term_str].append(term_to_be_deleted)
-        self._unlink_terms(
-            term_to_be_deleted, term_to_be_deleted.related_terms)
+        term_to_be_deleted = self._lazy_load_term(term_str)
+        self._terms.pop(term_str)
+        self._changed_terms.pop(term_str, None)
+        # A term, that was removed before under the same name, is the one
+        # saved in the project:
+        self._deleted_terms.setdefault(term_str, term_to_be_deleted)
         self._terms_list.remove(term_str)
+        self._terms_list_changed = True
+        self._index.remove_term(term_str)
+        self._remove_from_graph(term_str)
+        if self._render_cache is not None:
+            self._render_cache.remove(term_str)
+        self._record({"op": "remove", "term": term_str})
         return True
 
     def add_term(self, term: Term):
@@ -80,10 +168,28 @@ class TermsController(object):
         :return bool: If the term already exist, returns false if term is added
         successfully returns true.
         """
+        if self._add_term(term):
+            self._record({"op": "add", "term": term.term,
+                          "description": term.description})
+            self._record_attachments(term)
+            if term.related_terms:
+                self._record({"op": "link", "term": term.term,
+                              "terms": term.related_terms})
+            return True
+        return False
+
+    def _add_term(self, term: Term):
         if term.term not in self._terms_list and term.term is not "":
             self._terms[term.term] = term
             self._changed_terms[term.term] = term
             self._terms_list.append(term.term)
+            self._terms_list_changed = True
+            self._index_term(term)
+            self._graph.add_term(term.term)
+            for related in term.related_terms:
+                if related in self._terms_list:
+                    self._graph.link(term.term, related)
+            self._sync_links(term)
             return True
         else:
             # Term already exists
@@ -105,9 +211,14 @@ class TermsController(object):
             previous_term_str = term.previous_term.term
 
             if term.term not in self._terms_list:
+                self._record({"op": "rename", "term": previous_term_str,
+                              "to": term.term})
+                # The links from and to the term are renamed in the graph in
+                # one pass:
+                self._graph.rename_term(previous_term_str, term.term)
                 # We add the term that has changed it's term string as a new
                 # Term objet.
-                self.add_term(term)
+                self._add_term(term)
 
                 # And remove the old name from term.term list
                 if previous_term_str in self._terms_list:
@@ -117,58 +228,352 @@ class TermsController(object):
                         "Changing a name of a term that doesn't exist!")
                 # The original unchanged Term object is removed from
                 # self._terms dictionary
-                old_term = self._terms.pop(term.previous_term.term)
+                old_term = self._lazy_load_term(previous_term_str)
+                self._terms.pop(previous_term_str)
 
                 # We link the new term to the original old, not the cloned one
                 # that is given for UI.
                 old_term.next_term = term
 
-                # We ad old term into the deleted dictionary:
-                self._deleted_terms[previous_term_str] = old_term
+                # We ad old term into the deleted dictionary. On save its
+                # folder is moved to the new name:
+                self._changed_terms.pop(previous_term_str, None)
+                self._deleted_terms.setdefault(previous_term_str, old_term)
+                self._index.remove_term(previous_term_str)
+                if self._render_cache is not None:
+                    self._render_cache.remove(previous_term_str)
 
-                # We remove links to old term
-                self._unlink_terms(
-                    term.previous_term, term.previous_term.related_terms)
-                # We add links to new term
-                self._link_terms(term, term.related_terms)
+                # The loaded neighbours get the new name from the graph:
+                term.set_related_terms(self._graph.related(term.term))
+                neighbours = set(self._graph.related(term.term))
+                neighbours.update(self._graph.backlinks(term.term))
+                for related in neighbours:
+                    loaded = self._terms.get(related)
+                    if loaded is not None:
+                        self._sync_links(loaded)
+                self._record_changes(term, old_term)
                 return True
 
+        self._record_changes(term, self._terms.get(term.term))
+        if term.related_terms != self._graph.related(term.term):
+            self._update_graph(term)
         # term is added to changed terms, to be saved later.
         self._changed_terms[term.term] = term
         self._terms[term.term] = term
+        if term.description_is_dirty or term.term not in self._index:
+            self._index_term(term)
         return False
 
+    def _index_term(self, term: Term):
+        self._index.index_term(term.term, term.plain_text)
+        self._unindexed.discard(term.term)
+
+    def search(self, query: str, limit: int=None):
+        """
+        Searches the descriptions of the terms for the words in the query.
+
+        The search index is persisted with the project and kept up to date as
+        terms are added, updated and removed. Only terms missing from the
+        index (eg. in a project saved without one) are loaded to index them,
+        on the first search.
+
+        :param query: words to search for
+        :param limit: maximum number of results
+        :return: list of term strings, best match first
+        """
+        for term_str in list(self._unindexed):
+            self._index_term(self._lazy_load_term(term_str))
+        return self._index.search(query, limit)
+
+    def link_many(self, term: Term, str_related_terms: list):
+        """
+        Links the term and each of the given terms to each other.
+
+        The links are added to the link graph in one pass and only the given
+        term is updated. The related terms are not updated one by one, since
+        they read their links from the graph, so saving the links writes only
+        the graph and the links of the given term.
+
+        :param term: Term object with the unmodified version of the term as
+            its previous_term, as for update_term
+        :param str_related_terms: list of term strings to link to
+        :return: list of the term strings, that were not linked before
+        """
+        linked = self._apply_links(term.term, str_related_terms, True)
+        if linked:
+            self._record({"op": "link", "term": term.term, "terms": linked})
+        term.set_related_terms(self._graph.related(term.term))
+        self.update_term(term)
+        return linked
+
+    def unlink_many(self, term: Term, str_related_terms: list):
+        """
+        Removes the links between the term and each of the given terms in one
+        pass over the link graph, see link_many.
+
+        :return: list of the term strings, that were linked before
+        """
+        unlinked = self._apply_links(term.term, str_related_terms, False)
+        if unlinked:
+            self._record({"op": "unlink", "term": term.term,
+                          "terms": unlinked})
+        term.set_related_terms(self._graph.related(term.term))
+        self.update_term(term)
+        return unlinked
+
     def link_terms(self, target1: Term, str_related_terms: list):
-        self._link_terms(target1, str_related_terms)
-        self.update_term(target1)
-
-    def _link_terms(self, target1: Term, str_related_terms: list):
-        for str_related_term in str_related_terms:
-            target2 = self.get_term(str_related_term)
-            target1.link_term(target2)
-            target2.link_term(target1)
-            self.update_term(target2, True)
-            logging.debug("-------[" + str(target1) + " <==> " + str(target2) +
-                          "]-------")
+        self.link_many(target1, str_related_terms)
 
     def unlink_terms(self, target1: Term, str_related_terms: list):
-        self._unlink_terms(target1, str_related_terms)
-        self.update_term(target1)
-
-    def _unlink_terms(self, target1: Term, str_related_terms: list):
-        for str_related_term in str_related_terms:
-            target2 = self.get_term(str_related_term)
-            target1.unlink_term(target2)
-            target2.unlink_term(target1)
-            self.update_term(target2, True)
-            logging.debug("-------[" + str(target1) + " |   | " + str(target2)
-                          + "]-------")
+        self.unlink_many(target1, str_related_terms)
+
+    def _apply_links(self, term_str: str, str_related_terms: list,
+                     link: bool):
+        """
+        Adds or removes the links both ways between the term and the given
+        terms in the link graph. The loaded related terms get their links
+        from the graph.
+
+        :param link: True to link, False to unlink
+        :return: list of the term strings, whose links changed
+        """
+        graph = self._graph
+        changed = list()
+        for related in str_related_terms:
+            if related == term_str:
+                continue
+            linked_from = graph.is_linked(term_str, related)
+            linked_to = graph.is_linked(related, term_str)
+            if link:
+                if (linked_from and linked_to) \
+                        or related not in self._terms_list:
+                    continue
+                graph.link(term_str, related)
+                graph.link(related, term_str)
+            else:
+                if not linked_from and not linked_to:
+                    continue
+                graph.unlink(term_str, related)
+                graph.unlink(related, term_str)
+            changed.append(related)
+
+        for related in changed:
+            loaded = self._terms.get(related)
+            if loaded is not None:
+                self._sync_links(loaded)
+        return changed
+
+    def _update_graph(self, term: Term):
+        """
+        Changes the links of the term in the link graph to match the related
+        terms of the term, eg. when the term has been linked directly or an
+        earlier version of it is restored.
+        """
+        related_terms = term.related_terms
+        unlinked = self._apply_links(
+            term.term, [related for related in self._graph.related(term.term)
+                        if related not in related_terms], False)
+        linked = self._apply_links(term.term, related_terms, True)
+        if unlinked:
+            self._record({"op": "unlink", "term": term.term,
+                          "terms": unlinked})
+        if linked:
+            self._record({"op": "link", "term": term.term, "terms": linked})
+        term.set_related_terms(self._graph.related(term.term))
+
+    def _remove_from_graph(self, term_str: str):
+        neighbours = set(self._graph.related(term_str))
+        neighbours.update(self._graph.backlinks(term_str))
+        self._graph.remove_term(term_str)
+        for related in neighbours:
+            loaded = self._terms.get(related)
+            if loaded is not None:
+                self._sync_links(loaded)
+
+    def _record(self, operation: dict):
+        """
+        Appends the operation to the journal of the project, if there is one.
+        The operations replayed from the journal are already in it.
+        """
+        if self._journal is not None and not self._replaying:
+            self._journal.append(operation)
+
+    @staticmethod
+    def _attachments(term: Term):
+        return ([str(path) for path in term.linked_files],
+                [str(path) for path in term.linked_images])
+
+    def _record_attachments(self, term: Term):
+        files, images = self._attachments(term)
+        if files or images:
+            self._record({"op": "attach", "term": term.term,
+                          "files": files, "images": images})
+
+    def _record_changes(self, term: Term, old: Term=None):
+        """
+        Records the changes of the description and the attached files of the
+        term compared to the old version of it. Everything is recorded, if
+        the old version is not known.
+        """
+        if self._journal is None or self._replaying:
+            return
+        if old is None or old is term or term.description != old.description:
+            self._record({"op": "description", "term": term.term,
+                          "description": term.description})
+        if old is None or old is term:
+            self._record_attachments(term)
+            return
+        files, images = self._attachments(term)
+        old_files, old_images = self._attachments(old)
+        names = [Path(path).name for path in files + images]
+        old_names = [Path(path).name for path in old_files + old_images]
+        if sorted(names) != sorted(old_names):
+            self._record({"op": "attach", "term": term.term,
+                          "files": files, "images": images})
+
+    def _replay(self, operations: list):
+        """
+        Applies the operations read from the journal as unsaved changes. An
+        operation, that can't be applied to the project, eg. because the term
+        has been removed, is skipped.
+        """
+        self._replaying = True
+        try:
+            for operation in operations:
+                try:
+                    self._replay_operation(operation)
+                except Exception as e:
+                    logging.warning("Skipping a journal operation "
+                                    + str(operation) + ": " + str(e))
+        finally:
+            self._replaying = False
+        if operations:
+            logging.info("Replayed " + str(len(operations))
+                         + " operations from the journal.")
+
+    def _next_version(self, term_str: str):
+        term = self.get_term(term_str)
+        term.initialize_next_term()
+        return term.next_term
+
+    def _replay_operation(self, operation: dict):
+        kind = operation["op"]
+        term_str = operation["term"]
+        if kind == "add":
+            if term_str in self._terms_list:
+                kind = "description"
+            else:
+                term = Term(term_str)
+                term.description = operation["description"]
+                self._add_term(term)
+                return
+
+        if kind == "restore":
+            self.restore_term(term_str)
+        elif kind == "remove":
+            self.remove_term(term_str)
+        elif kind == "rename":
+            if operation["to"] not in self._terms_list:
+                term = self._next_version(term_str)
+                term.term = operation["to"]
+                self.update_term(term)
+        elif kind == "description":
+            term = self._next_version(term_str)
+            term.description = operation["description"]
+            self.update_term(term)
+        elif kind == "attach":
+            term = self._next_version(term_str)
+            paths = [Path(path) for path in
+                     operation["files"] + operation["images"]]
+            names = set(path.name for path in paths)
+            for path in term.linked_files + term.linked_images:
+                if path.name not in names:
+                    term.unlink_file(path)
+            linked = set(path.name for path in
+                         term.linked_files + term.linked_images)
+            for path in paths:
+                if path.name not in linked:
+                    term.link_file(path)
+            self.update_term(term)
+        elif kind == "link":
+            self.link_many(self._next_version(term_str), operation["terms"])
+        elif kind == "unlink":
+            self.unlink_many(self._next_version(term_str), operation["terms"])
+        else:
+            raise ValueError("Unknown operation: " + kind)
 
     def _lazy_load_term(self, term_str):
-        if term_str not in self._terms.keys():
+        """
+        Returns the term from the cache. If the term is not in the cache, it
+        is loaded and the least recently used terms without unsaved changes
+        are dropped from the cache, if it is full.
+        """
+        term = self._terms.lookup(term_str)
+        if term is None:
+            term = self._load_term(term_str)
+            self._terms[term_str] = term
+            self._terms.evict(self._changed_terms)
+        return term
+
+    def _load_term(self, term_str):
+        """
+        Loads the term, unless it has been prefetched, and sets its related
+        terms from the link graph and its HTML from the render cache. The
+        term is not added to the cache.
+        """
+        term = self._take_prefetched(term_str)
+        if term is None:
             logging.debug("loading term " + term_str)
-            term_to_load = Term(term_str)
-            self._terms[term_str] = term_to_load.load(self._project_path)
+            term = Term(term_str).load(self._project_path, self._storage)
+        self._sync_links(term)
+        if self._render_cache is not None:
+            self._render_cache.restore(term)
+        return term
+
+    def prefetch(self, term_strs: list):
+        """
+        Starts loading the given terms in worker threads, so that get_term
+        can return them from memory. Terms already loaded are skipped and
+        prefetches of terms not in the list are cancelled, eg. the list is
+        what is expected to be asked for next.
+
+        :param term_strs: list of term strings
+        """
+        wanted = [term_str for term_str in term_strs
+                  if term_str not in self._terms
+                  and term_str in self._terms_list]
+        self.cancel_prefetch(wanted)
+        if self._prefetch_pool is None:
+            self._prefetch_pool = ThreadPoolExecutor(max_workers=2)
+
+        for term_str in wanted:
+            if term_str not in self._prefetching:
+                logging.debug("prefetching term " + term_str)
+                self._prefetching[term_str] = self._prefetch_pool.submit(
+                    Term(term_str).load, self._project_path, self._storage)
+
+    def cancel_prefetch(self, keep: list=()):
+        """
+        Cancels loading of prefetched terms, that are not in keep. Loads
+        already running are let to finish, but their results are dropped.
+        """
+        for term_str in list(self._prefetching.keys()):
+            if term_str not in keep:
+                self._prefetching.pop(term_str).cancel()
+
+    def _take_prefetched(self, term_str):
+        """
+        Returns the prefetched term or None, if the term was not prefetched or
+        loading it failed. Waits if the term is still being loaded.
+        """
+        future = self._prefetching.pop(term_str, None)
+        if future is None or future.cancelled():
+            return None
+        try:
+            return future.result()
+        except Exception as e:
+            logging.warning("Prefetching " + term_str + " failed: " + str(e))
+            return None
 
     def load_project(self, project_path):
         """
@@ -176,105 +581,388 @@ class TermsController(object):
         Throws FileNotFoundError if can't load the file. The individual terms
         are build lazily when get_term is called.
 
+        The storage (folders or a packed store) is chosen based on what is
+        found in the project path. A save, that was interrupted after it was
+        committed to the journal, is completed before loading.
+
         :param: project_path
         :return:
         """
-        terms_list = load_json(project_path / "terms.json", TermsDecoder())
-        if terms_list is not None:
-            self._project_path = project_path
-            self._terms = {}
-            self._terms_list = list(terms_list)
-            self._terms_list.sort()
-            return self._terms_list.copy()
-        else:
+        project_load = self.begin_load(project_path)
+        project_load.run()
+        return self.finish_load(project_load)
+
+    def begin_load(self, project_path: Path, journal: bool=True):
+        """
+        Returns a ProjectLoad, that reads the project, when its run method is
+        called, which can be done in another thread. This controller keeps
+        the current project until finish_load is called in this thread.
+
+        :param project_path: path of the project to load
+        :param journal: False if the changes to the project are not
+            journaled, eg. for a project, that is only viewed
+        """
+        return ProjectLoad(project_path, self._render_cache is not None,
+                           self._use_journal and journal)
+
+    def finish_load(self, project_load):
+        """
+        Takes the project read by the ProjectLoad into use.
+
+        :param project_load: ProjectLoad returned by begin_load
+        :return: list of the terms in the project or None
+        """
+        if project_load.terms_list is None:
             return None
+        self.cancel_prefetch()
+        self._storage.close()
+        self._storage = project_load.storage
+        self._project_path = project_load.path
+        self._terms.clear()
+        self._changed_terms = {}
+        self._deleted_terms = {}
+        self._terms_list_changed = False
+        self._terms_list = project_load.terms_list
+        self._index = project_load.index
+        self._unindexed = project_load.unindexed
+        self._graph = project_load.graph
+        self._restored = {}
+        if self._render_cache is not None:
+            self._render_cache = project_load.render_cache
+        if project_load.first_term is not None:
+            # Taken into use like a prefetched term on the first get_term:
+            loaded = Future()
+            loaded.set_result(project_load.first_term)
+            self._prefetching[project_load.first_term.term] = loaded
+        self._open_journal(project_load.journal)
+        if self._journal is not None:
+            self._replay(project_load.operations)
+        if self._storage.trash is not None:
+            self._storage.trash.purge_in_background(self.trash_max_age)
+        return sorted(self._terms_list)
 
-    def _copy_linked_files_to_new_location(self, deleted_term):
-        # If we have a new file, we have to move the files
-        # to the new location
-        new_term = deleted_term.next_term
-        while new_term.next_term:
-            new_term = new_term.next_term
+    def _open_journal(self, journal: OperationJournal=None):
+        """
+        Takes the given journal of the project into use, or none.
+        """
+        if self._journal is not None:
+            self._journal.close()
+        self._journal = journal
 
-        if new_term and new_term.term in self._changed_terms.keys():
-            to_copy = list()
-            for file in deleted_term.linked_images:
-                try:
-                    new_term.get_file_path(file.name)
-                    to_copy.append(file.name)
-                except FileNotFoundError:
-                    pass
+    @property
+    def trashed_terms(self):
+        """
+        The removed terms, that can be restored, as a sorted list.
+        """
+        if self._storage.trash is None:
+            return []
+        return [term_str for term_str in self._storage.trash.terms()
+                if term_str not in self._terms_list]
 
-            for file in deleted_term.linked_files:
-                try:
-                    new_term.get_file_path(file.name)
-                    to_copy.append(file.name)
-                except FileNotFoundError:
-                    pass
+    def restore_term(self, term_str: str):
+        """
+        Restores a removed term from the trash of the project. The term is
+        added as a changed term and its folder is moved back from the trash,
+        when the project is saved, so the folder stays in the trash, if the
+        changes are discarded.
+
+        :return: the restored Term or None, if the term can't be restored,
+            eg. a term with the same name is in the project or has been
+            removed after the project was saved.
+        """
+        if self._storage.trash is None or term_str in self._terms_list \
+                or term_str in self._deleted_terms:
+            return None
+        folder = self._storage.trash.find(term_str)
+        target = self._project_path / term_str
+        if folder is None or target.exists():
+            return None
+        term = Term(term_str).load(folder.parent, FOLDER_STORAGE)
+        if not self._add_term(term):
+            return None
+        self._record({"op": "restore", "term": term_str})
+        self._restored[term_str] = folder
+        return term
 
-            if len(to_copy) > 0:
-                make_dir(new_term.path / new_term.term)
+    def scan_attachments(self):
+        """
+        Scans the term folders of the project for unreferenced and duplicate
+        attached files, see AttachmentScanner. The terms with unsaved
+        changes are not scanned.
 
-            for file in to_copy:
-                copy_file_to(deleted_term.path / deleted_term.term / file,
-                             new_term.path / new_term.term)
+        :return: ScanReport or None, if the project has not been saved
+        """
+        if self._project_path == Path(''):
+            return None
+        scanner = AttachmentScanner(self._project_path, self._storage)
+        return scanner.scan([term_str for term_str in self._terms_list
+                             if term_str not in self._changed_terms])
+
+    def reclaim_attachments(self, report):
+        """
+        Moves the unreferenced files found by scan_attachments to the trash
+        and stores the duplicates in the blob store. The scanned terms are
+        dropped from the cache, so they are loaded again with the changed
+        files.
+
+        :return: the number of bytes freed
+        """
+        scanner = AttachmentScanner(self._project_path, self._storage)
+        freed = scanner.reclaim(report)
+        folders = set(path.parent.name for path in report.orphans)
+        for paths in report.duplicates.values():
+            folders.update(path.parent.name for path in paths)
+        for term_str in folders:
+            if term_str not in self._changed_terms:
+                self._terms.pop(term_str, None)
+                self._take_prefetched(term_str)
+        return freed
+
+    def discard_changes(self):
+        """
+        Drops the operations of the unsaved changes from the journal, eg.
+        when the project is closed without saving. The changes in memory are
+        not undone.
+        """
+        if self._journal is not None:
+            self._journal.clear()
 
-    def save_project(self):
+    def save_project(self, progress=None):
         """
         Saves the project to self._project_path.
 
+        Only the changed parts of the changed terms are written and the list
+        of terms is written only if terms have been added, removed or renamed.
+        The number of files and bytes written is available from
+        save_statistics after the save.
+
         The path has to exists, will not create one.
+
+        :param progress: called as progress(done, total) after each term
+        """
+        project_save = self.begin_save()
+        if project_save is not None:
+            project_save.run(progress)
+            self.finish_save(project_save)
+
+    def begin_save(self):
+        """
+        Takes a snapshot of the unsaved changes of the project. The returned
+        ProjectSave writes them, when its run method is called, which can be
+        done in another thread, while the terms are viewed and changed. The
+        changes made after the snapshot are saved by the next save.
+
+        Call finish_save in this thread after the run.
+
+        :return: ProjectSave or None, if the project has no path.
         """
         path = self._project_path
-        if path.exists() and path is not Path(''):
-            for deleted_term in self._deleted_terms.values():
-                self._copy_linked_files_to_new_location(deleted_term)
-                deleted_term.delete()
+        if not path.exists() or path == Path(''):
+            return None
+        # Terms being loaded may be overwritten by the save:
+        self.cancel_prefetch()
+        project_save = ProjectSave(path, self._storage)
+        if self._journal is not None:
+            # The changes are on disk from here on, even if the save fails:
+            self._journal.flush()
+            project_save.journal = self._journal
+            project_save.journaled = self._journal.count
+        for term_str, changed_term in self._changed_terms.items():
+            if term_str in self._terms_list:
+                project_save.add_changed_term(changed_term)
+                if term_str in self._restored:
+                    project_save.restored_terms[term_str] = \
+                        self._restored[term_str]
+        for deleted_term in self._deleted_terms.values():
+            project_save.add_deleted_term(deleted_term)
 
-            for changed_term in self._changed_terms.keys():
-                self.get_term(changed_term).save(path)
+        if self._terms_list_changed:
+            project_save.terms_list = list(self._terms_list)
+            self._terms_list_changed = False
+        if self._index.is_dirty:
+            project_save.index = self._index.copy()
+            self._index.is_dirty = False
+        if self._graph.is_dirty:
+            project_save.graph = self._graph.copy()
+            self._graph.is_dirty = False
+        if self._render_cache is not None:
+            for term in self._terms.values():
+                self._render_cache.store(term)
+            if self._render_cache.is_dirty:
+                project_save.render_cache = self._render_cache.copy()
+                self._render_cache.is_dirty = False
+        return project_save
 
-            self._save_terms()
-            self._changed_terms = {}
-            self._deleted_terms = {}
-            self._terms = {}
+    def finish_save(self, project_save):
+        """
+        Marks the changes written by the save as saved. The terms changed
+        again during the save and everything not written, if the save was
+        cancelled, stay unsaved. Nothing is marked saved, if the save failed
+        and was rolled back.
+
+        :param project_save: ProjectSave returned by begin_save
+        """
+        if not project_save.is_committed:
+            project_save.saved_terms.clear()
+        for term_str, saved_term in project_save.saved_terms.items():
+            self._restored.pop(term_str, None)
+            if self._changed_terms.get(term_str) is \
+                    project_save.changed_terms[term_str]:
+                del self._changed_terms[term_str]
+                self._terms[term_str] = saved_term
+
+        if project_save.is_complete:
+            for term_str, deleted_term in project_save.deleted_terms.items():
+                if self._deleted_terms.get(term_str) is deleted_term:
+                    del self._deleted_terms[term_str]
+        else:
+            if project_save.terms_list is not None:
+                self._terms_list_changed = True
+            if project_save.index is not None:
+                self._index.is_dirty = True
+            if project_save.graph is not None:
+                self._graph.is_dirty = True
+            if project_save.render_cache is not None:
+                self._render_cache.is_dirty = True
+        # The saved terms can now be dropped from the cache:
+        self._terms.evict(self._changed_terms)
+
+    def begin_save_as(self, path: Path):
+        """
+        Returns a ProjectSaveAs, that runs save_project_as, eg. in another
+        thread. The controller must not be used until the run is done, since
+        it is switched to the new project during the save.
+        """
+        return ProjectSaveAs(self, path)
 
-    def save_project_as(self, path: Path=None):
+    def save_project_as(self, path: Path=None, progress=None):
         """
-        Saves the project to given path.
+        Saves the project to given path. The project is saved with the same
+        kind of storage it was loaded from.
+
+        The terms without unsaved changes are copied from the current project
+        without loading them: the documents with the bulk copy of the storage
+        and the term folders file by file, using reflinks where the file
+        system supports them. The attached files stored in the blob store are
+        linked to a copy of it. Only the changed terms are written from
+        memory. Terms, that can't be copied, are loaded one at a time and
+        saved, without adding them to the term cache.
 
         The path has to exists, will not create one.
+
+        :param progress: called as progress(done, total) after each term
         """
         if path.exists():
-            for term in self._terms_list:
-                self._lazy_load_term(term)
-            for term in self._terms.values():
-                term.save(path)
+            self.cancel_prefetch()
+            storage = self._storage.for_project(path)
+            storage.statistics = WriteStatistics()
+            storage.begin()
+            clone = storage.can_clone_from(self._storage)
+            if clone:
+                storage.clone_documents_from(self._storage, self._terms_list)
+                storage.clone_blobs_from(self._storage)
+
+            total = len(self._terms_list)
+            for done, term_str in enumerate(self._terms_list, 1):
+                if clone and term_str not in self._changed_terms and \
+                        storage.clone_term_from(self._storage, term_str):
+                    # The loaded term still refers to the old location:
+                    self._terms.pop(term_str, None)
+                else:
+                    term = self._terms.get(term_str)
+                    if term is None:
+                        term = self._load_term(term_str)
+                    if term_str in self._unindexed:
+                        self._index_term(term)
+                    term.save(path, storage)
+                if progress is not None:
+                    progress(done, total)
 
+            if clone:
+                storage.blobs.retain(set(self._terms_list))
+            self._storage.close()
+            self._storage = storage
             self._project_path = path
             self._changed_terms = {}
             self._deleted_terms = {}
+            self._restored = {}
             self._save_terms()
+            self._index.save(path, self._storage)
+            self._graph.save(path, self._storage)
+            self._save_render_cache()
+            self._storage.save_attachments()
+            self._storage.commit()
+            # The changes are saved in the new location, the old project is
+            # left as it was:
+            self.discard_changes()
+            if self._use_journal:
+                self._open_journal(OperationJournal(path))
+            self.discard_changes()
         else:
             logging.debug("Could not save to: " + str(path))
             raise Exception
 
+    def _save_render_cache(self):
+        """
+        Stores the HTML rendered from the loaded terms in the render cache and
+        saves the cache, if it has changed.
+        """
+        if self._render_cache is None:
+            return
+        for term in self._terms.values():
+            self._render_cache.store(term)
+        if self._render_cache.is_dirty:
+            self._render_cache.save(self._project_path, self._storage)
+
     def clear(self):
+        self.cancel_prefetch()
+        self.discard_changes()
         self._changed_terms = {}
         self._deleted_terms = {}
-        self._terms = {}
+        self._terms.clear()
         self._terms_list = []
+        self._index = SearchIndex()
+        self._graph = LinkGraph()
+        self._restored = {}
+        self._unindexed = set()
+        if self._render_cache is not None:
+            self._render_cache = RenderCache()
 
     def _save_terms(self):
         """
         Saves list of terms as json to the project root "terms.json".
         """
-        save_json(self._project_path / "terms.json", self, TermsEncoder())
+        self._storage.save_json(
+            self._project_path / "terms.json", self, TermsEncoder())
+        self._terms_list_changed = False
+
+    @property
+    def cache_statistics(self):
+        """
+        Number and estimated size of the loaded terms and the hits, misses
+        and evictions of the term cache as a dictionary.
+        """
+        return self._terms.statistics
+
+    @property
+    def save_statistics(self):
+        """
+        Files and bytes written by the latest save as a WriteStatistics
+        object.
+        """
+        return self._storage.statistics
 
     @property
     def unsaved_changes(self):
         return len(self._changed_terms)
 
+    @property
+    def unsaved_terms(self):
+        """
+        The terms with unsaved changes as a list.
+        """
+        return list(self._changed_terms.keys())
+
     @property
     def project_path(self):
         return copy.copy(self._project_path)
@@ -290,6 +978,350 @@ class TermsController(object):
 class NoSuchTermException(Exception):
     pass
 
+class ProjectLoad(object):
+    """
+    Reads a project for TermsController, see TermsController.begin_load.
+
+    The term list is read first and given out in chunks, then the first
+    term is loaded, so they can be shown while the search index, the link
+    graph and the render cache are read.
+
+    The operations in the journal of the project are read, if journal is
+    True and the project can be written to, and replayed by
+    TermsController.finish_load.
+
+    :param path: the project path
+    :param render_cache: True if the render cache is read
+    :param journal: True if the journal is read
+    """
+    def __init__(self, path: Path, render_cache: bool=False,
+                 journal: bool=False):
+        self.path = path
+        self.storage = None
+        self.terms_list = None
+        self.first_term = None
+        self.index = None
+        self.unindexed = None
+        self.graph = None
+        self.render_cache = RenderCache() if render_cache else None
+        self.journal = None
+        if journal and os.access(str(path), os.W_OK):
+            self.journal = OperationJournal(path)
+        self.operations = list()
+
+    def run(self, chunk=None, first_term=None, chunk_size: int=1000):
+        """
+        Reads the project.
+
+        :param chunk: called with each chunk of the sorted term list
+        :param first_term: called with the first term, when it is loaded
+        :param chunk_size: number of terms in a chunk
+        :raise FileNotFoundError: if the project has no term list.
+        """
+        storage = open_storage(self.path)
+        try:
+            storage.recover()
+            terms_list = storage.load_json(self.path / "terms.json",
+                                           TermsDecoder())
+        except FileNotFoundError as e:
+            storage.close()
+            raise e
+        self.storage = storage
+        if terms_list is None:
+            return
+        self.terms_list = sorted(terms_list)
+        if chunk is not None:
+            for i in range(0, len(self.terms_list), chunk_size):
+                chunk(self.terms_list[i:i + chunk_size])
+
+        if self.terms_list:
+            try:
+                self.first_term = Term(self.terms_list[0]).load(
+                    self.path, storage)
+                if first_term is not None:
+                    first_term(self.first_term)
+            except FileNotFoundError as e:
+                logging.info("Could not load the first term: " + str(e))
+
+        self._load_index()
+        self._load_graph()
+        if self.render_cache is not None:
+            self.render_cache.load(self.path, storage)
+        if self.journal is not None:
+            self.operations = self.journal.read()
+
+    def _load_index(self):
+        """
+        Loads the search index of the project. Terms, that are not in the
+        index, are indexed on the first search.
+        """
+        self.index = SearchIndex()
+        try:
+            self.index.load(self.path, self.storage)
+        except (FileNotFoundError, ValueError) as e:
+            logging.info("No search index for the project: " + str(e))
+
+        for term_str in self.index.terms.difference(self.terms_list):
+            self.index.remove_term(term_str)
+        self.unindexed = set(self.terms_list).difference(self.index.terms)
+
+    def _load_graph(self):
+        """
+        Loads the link graph of the project. For a project without one, eg.
+        if it has been lost, the graph is built from the linked terms in the
+        links.json files of the terms and it is saved with the project. A
+        links.json has the related terms of the term, when the term was last
+        saved, so the links changed after that are not rebuilt.
+        """
+        self.graph = LinkGraph()
+        terms = set(self.terms_list)
+        try:
+            self.graph.load(self.path, self.storage)
+        except (FileNotFoundError, ValueError) as e:
+            logging.info("Building the link graph of the project: " + str(e))
+            for term_str in self.terms_list:
+                try:
+                    links = self.storage.load_json(
+                        self.path / term_str / "links.json")
+                except (FileNotFoundError, ValueError):
+                    links = dict()
+                if "terms" not in links:
+                    logging.warning("The links of " + term_str + " could "
+                                    "not be read from its links.json.")
+                self.graph.add_term(term_str)
+                for related in links.get("terms") or []:
+                    if related in terms:
+                        self.graph.link(term_str, related)
+
+        for term_str in self.graph.terms.difference(terms):
+            self.graph.remove_term(term_str)
+        for term_str in self.terms_list:
+            self.graph.add_term(term_str)
+
+
+class ProjectSaveAs(object):
+    """
+    Saves a project to a new location with TermsController.save_project_as,
+    see TermsController.begin_save_as. Has the run and cancel methods of
+    ProjectSave, but the save can't be cancelled.
+
+    :param controller: the TermsController
+    :param path: the new project path
+    """
+    def __init__(self, controller: TermsController, path: Path):
+        self.path = path
+        self.is_complete = False
+        self._controller = controller
+
+    def run(self, progress=None):
+        self._controller.save_project_as(self.path, progress)
+        self.is_complete = True
+
+    def cancel(self):
+        pass
+
+
+class ProjectSave(object):
+    """
+    Writes a snapshot of the unsaved changes of a project, see
+    TermsController.begin_save.
+
+    The changed terms are saved as copy-on-write handles, so the terms in
+    the controller are not changed by the save. The save can be cancelled
+    between the changed terms; the terms written so far are then committed
+    and the removed terms, the list of terms, the index and the graph are
+    left for the next save.
+
+    The operations written by a complete save are dropped from the journal
+    of the project.
+
+    :param path: the project path
+    :param storage: storage of the project
+    """
+    def __init__(self, path: Path, storage):
+        self.path = path
+        self.storage = storage
+        # term_str -> Term in the controller:
+        self.changed_terms = dict()
+        # term_str -> saved copy-on-write handle:
+        self.saved_terms = dict()
+        self.deleted_terms = dict()
+        self.terms_list = None
+        self.index = None
+        self.graph = None
+        self.render_cache = None
+        # term_str -> folder in the trash:
+        self.restored_terms = dict()
+        self.is_complete = False
+        self.is_committed = False
+        self.journal = None
+        # Number of operations in the journal, when the snapshot was taken:
+        self.journaled = 0
+        self._handles = dict()
+        self._cancelled = threading.Event()
+
+    def add_changed_term(self, term: Term):
+        self.changed_terms[term.term] = term
+        self._handles[term.term] = copy.copy(term)
+
+    def add_deleted_term(self, term: Term):
+        self.deleted_terms[term.term] = term
+
+    @property
+    def total(self):
+        return len(self._handles)
+
+    def cancel(self):
+        """
+        Stops the save before the next term. Can be called from any thread.
+        """
+        self._cancelled.set()
+
+    @property
+    def is_cancelled(self):
+        return self._cancelled.is_set()
+
+    def run(self, progress=None):
+        """
+        Writes the changes and commits them. The terms, that have the same
+        name as a removed term, are written after the removed terms are
+        deleted. The folders of the renamed terms are moved to the new names
+        before the renamed terms are written.
+
+        :param progress: called as progress(done, total) after each term
+        :raise: the error of the storage, in which case nothing is committed
+            and no term is saved.
+        """
+        self.storage.statistics = WriteStatistics()
+        self.storage.begin()
+        try:
+            replacing = [term_str for term_str in self._handles
+                         if term_str in self.deleted_terms]
+            renamed = self._renamed_terms()
+            # Written after the folders of the renamed and restored terms are
+            # moved:
+            replacing.extend(renamed.values())
+            replacing.extend(self.restored_terms)
+            done = 0
+            for term_str, handle in self._handles.items():
+                if self.is_cancelled:
+                    break
+                if term_str not in replacing:
+                    self._save_term(term_str, handle)
+                    done += 1
+                    if progress is not None:
+                        progress(done, self.total)
+
+            if not self.is_cancelled:
+                moved = set(term_str for term_str, new_term_str
+                            in renamed.items()
+                            if self.storage.move_term_folder(term_str,
+                                                             new_term_str))
+                for term_str, deleted_term in self.deleted_terms.items():
+                    if term_str in moved:
+                        self.storage.remove_term_documents(term_str)
+                    elif self._is_kept(deleted_term) or \
+                            not deleted_term.is_saved_in(self.path):
+                        continue
+                    else:
+                        self._copy_linked_files_to_new_location(deleted_term)
+                        self.storage.trash_term(term_str)
+                for term_str, folder in self.restored_terms.items():
+                    self.storage.restore_term(folder, term_str)
+                for term_str in replacing:
+                    self._save_term(term_str, self._handles[term_str])
+                    done += 1
+                    if progress is not None:
+                        progress(done, self.total)
+                if self.terms_list is not None:
+                    self.storage.save_json(
+                        self.path / "terms.json", self.terms_list)
+                for document in [self.index, self.graph, self.render_cache]:
+                    if document is not None:
+                        document.save(self.path, self.storage)
+                self.is_complete = True
+            self.storage.save_attachments()
+        except:
+            self.storage.rollback()
+            self.is_complete = False
+            raise
+        self.storage.commit()
+        self.is_committed = True
+        if self.is_complete and self.journal is not None:
+            self.journal.compact(self.journaled)
+
+    def _save_term(self, term_str: str, handle: Term):
+        handle.save(self.path, self.storage)
+        self.saved_terms[term_str] = handle
+
+    @staticmethod
+    def _latest_version(deleted_term: Term):
+        """
+        Returns the latest version of a renamed term or None for a removed
+        term.
+        """
+        new_term = deleted_term.next_term
+        while new_term is not None and new_term.next_term is not None:
+            new_term = new_term.next_term
+        return new_term
+
+    def _is_kept(self, deleted_term: Term):
+        """
+        True if the term has been renamed back to its saved name, so its
+        folder is saved over.
+        """
+        new_term = self._latest_version(deleted_term)
+        return new_term is not None and new_term.term == deleted_term.term \
+            and new_term.term in self._handles
+
+    def _renamed_terms(self):
+        """
+        Returns the renamed terms, whose folders are moved to their new
+        names, so the attached files are not copied, as a dictionary from
+        the old term string to the new one.
+        """
+        renamed = dict()
+        for term_str, deleted_term in self.deleted_terms.items():
+            new_term = self._latest_version(deleted_term)
+            if new_term is not None and new_term.term != term_str \
+                    and new_term.term in self._handles \
+                    and new_term.term not in self.deleted_terms \
+                    and new_term.term not in renamed.values() \
+                    and deleted_term.is_saved_in(self.path):
+                renamed[term_str] = new_term.term
+        return renamed
+
+    def _copy_linked_files_to_new_location(self, deleted_term):
+        # If we have a new file, we have to move the files
+        # to the new location
+        new_term = self._latest_version(deleted_term)
+
+        if new_term and new_term.term in self.changed_terms.keys():
+            to_copy = list()
+            for file in deleted_term.linked_images:
+                try:
+                    new_term.get_file_path(file.name)
+                    to_copy.append(file.name)
+                except FileNotFoundError:
+                    pass
+
+            for file in deleted_term.linked_files:
+                try:
+                    new_term.get_file_path(file.name)
+                    to_copy.append(file.name)
+                except FileNotFoundError:
+                    pass
+
+            target = new_term.path / new_term.term
+            if len(to_copy) > 0 and not target.exists():
+                make_dir(target)
+
+            for file in to_copy:
+                self.storage.copy_file_to(
+                    deleted_term.path / deleted_term.term / file,
+                    target, deleted_term.blob_key(file))
+
+
 class TermsEncoder(json.JSONEncoder):
     """ Encodes a Terms object to JSON eg. saves Term self.__term str
     attributes as JSON array """
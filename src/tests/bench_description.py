@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+#
+# This file is a part of Definator (https://github.com/aparaatti/definator)
+# and it is licensed under the GPLv3 (http://www.gnu.org/licenses/gpl-3.0.txt).
+#
+"""
+Measures how long parsing and rendering a large description takes.
+
+To run, in the src folder:
+    python -m tests.bench_description [size in MB]
+"""
+__author__ = 'aparaatti'
+
+import os
+import sys
+import time
+
+import data.description
+
+CHUNKS = [
+    "##A title##",
+    "A paragraph about a cat. It likes to purr and to sit on the keyboard"
+    " while someone is trying to write a description." + os.linesep
+    + "The paragraph continues on a second line.",
+    os.linesep.join(["##LIST##", "run", "sit", "eat", "##END##"]),
+    os.linesep.join(["##ASCII##", "^--^", "|oo|", "( .)", "##END##"]),
+]
+
+
+def make_text(size: int):
+    chunks = list()
+    length = 0
+    while length < size:
+        for chunk in CHUNKS:
+            chunks.append(chunk)
+            length += len(chunk) + 2 * len(os.linesep)
+    return (os.linesep + os.linesep).join(chunks)
+
+
+def best_of(repeat: int, function):
+    times = list()
+    for i in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main(megabytes: float=1.0):
+    text = make_text(int(megabytes * 1024 * 1024))
+    description = data.description.Description()
+
+    def parse():
+        description.content_text = text
+
+    parse_time = best_of(5, parse)
+    print("parsed " + str(len(text)) + " characters, "
+          + str(len(description._content)) + " items in "
+          + "%.3f s" % parse_time)
+    print("content_text: %.3f s" % best_of(
+        5, lambda: description.content_text))
+    print("content_html: %.3f s" % best_of(
+        5, lambda: description.content_html))
+
+
+if __name__ == '__main__':
+    main(*[float(arg) for arg in sys.argv[1:2]])
@@ -5,7 +5,11 @@ __author__ = 'aparaatti'
 # This file is a part of Definator (https://github.com/aparaatti/definator)
 # and it is licensed under the GPLv3 (http://www.gnu.org/licenses/gpl-3.0.txt).
 #
+import json
+import shutil
+import tempfile
 import unittest
+from pathlib import Path
 import data.description
 import data.term
 
@@ -78,6 +82,64 @@ it could also be like this:</p>
 <p>Or is it a cow?</p>
 """)
 
+    def test_empty_line_ends_an_ascii_field(self):
+        text = "##ASCII##\n /\\\n\n \\/\n##END##\n\nAfter."
+        self.description.content_text = text
+        self.assertEqual(self.description.content_html,
+                         "<p>##ASCII##\n /\\</p>\n<p> \\/\n##END##</p>\n"
+                         "<p>After.</p>\n")
+        self.assertEqual(self.description.content_text, text)
+
+    def test_extra_line_separators_make_empty_paragraphs(self):
+        self.description.content_text = "\n\nA\n\n\nB\n\n\n\nC"
+        self.assertEqual(self.description.content_html,
+                         "<p></p>\n<p>A</p>\n<p>B</p>\n<p></p>\n<p>C</p>\n")
+
+    def test_save_and_load_structured_format(self):
+        folder = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, str(folder))
+        (folder / "cat.png").touch()
+        self.description.content_text = \
+            'A picture #img("' + str(folder / "cat.png") + '","Cat").' \
+            + "\n\n" + self.description.content_text
+        self.description.save(folder)
+
+        with (folder / "description.json").open() as file:
+            self.assertEqual(json.load(file)["version"], 2)
+        (folder / "cat.png").unlink()
+        loaded = data.description.Description()
+        loaded.load(folder)
+        self.assertEqual(loaded.content_text, self.description.content_text
+                         .replace(str(folder / "cat.png"), "cat.png"))
+        self.assertEqual(loaded.added_image_paths, [folder / "cat.png"])
+        self.assertFalse(loaded.is_dirty)
+
+    def test_load_prefixed_format(self):
+        folder = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, str(folder))
+        (folder / "cat.png").touch()
+        with (folder / "description.json").open("w") as file:
+            json.dump(['Paragraph:A picture #img("cat.png","Cat").',
+                       "Title:Title", "ASCII:^--^"], file)
+        loaded = data.description.Description()
+        loaded.load(folder)
+        self.assertEqual(loaded.content_text,
+                         'A picture #img("cat.png","Cat").\n\n##Title##'
+                         "\n\n##ASCII##\n^--^\n##END##")
+        self.assertEqual(loaded.added_image_paths, [folder / "cat.png"])
+
+    def test_missing_images_are_listed(self):
+        folder = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, str(folder))
+        (folder / "cat.png").touch()
+        self.description.path = folder
+        self.description.content_text = \
+            '#img("cat.png") #img("cow.png") #img("cat.png","Again")'
+        self.assertEqual(self.description.added_image_paths,
+                         [folder / "cat.png", folder / "cow.png"])
+        self.assertEqual(self.description.missing_images,
+                         [folder / "cow.png"])
+
     @classmethod
     def tearDownClass(cls):
         pass
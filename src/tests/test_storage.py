@@ -0,0 +1,409 @@
+# -*- coding: utf-8 -*-
+#
+# This file is a part of Definator (https://github.com/aparaatti/definator)
+# and it is licensed under the GPLv3 (http://www.gnu.org/licenses/gpl-3.0.txt).
+#
+from pathlib import Path
+import os
+import unittest
+import shutil
+import filecmp
+import src.terms_controller
+import src.data.storage
+import src.data.blob_store
+import src.data.fs_helpers
+import src.data.term
+
+TMP = '/tmp/test-generated-packed-project'
+HELP = Path(os.path.join(os.path.dirname(__file__), "../../help-project/"))
+
+
+class PackedStorageTestCases(unittest.TestCase):
+
+    def setUp(self):
+        if Path(TMP).exists():
+            shutil.rmtree(TMP)
+        shutil.copytree(str(HELP), TMP)
+        src.data.storage.convert_to_packed(Path(TMP)).close()
+
+    def test_converted_project_loads_the_same(self):
+        folders = src.terms_controller.TermsController()
+        packed = src.terms_controller.TermsController()
+        terms = folders.load_project(HELP)
+        self.assertEqual(packed.load_project(Path(TMP)), terms)
+        self.assertIsInstance(packed._storage,
+                              src.data.storage.PackedStorage)
+
+        for term_str in terms:
+            term = folders.get_term(term_str)
+            packed_term = packed.get_term(term_str)
+            self.assertEqual(packed_term.description, term.description)
+            self.assertEqual(packed_term.related_terms, term.related_terms)
+            self.assertEqual(
+                sorted(path.name for path in packed_term.linked_images),
+                sorted(path.name for path in term.linked_images))
+
+    def test_save_does_not_write_term_documents(self):
+        tc = src.terms_controller.TermsController()
+        tc.load_project(Path(TMP))
+        term = tc.get_term("4. Project files")
+        shutil.rmtree(str(Path(TMP) / "4. Project files"))
+        term.initialize_next_term()
+        new_term = term.next_term
+        new_term.description = "Packed."
+        tc.update_term(new_term)
+        tc.save_project()
+
+        self.assertFalse((Path(TMP) / "4. Project files").exists())
+        tc.load_project(Path(TMP))
+        self.assertEqual(tc.get_term("4. Project files").description,
+                         "Packed.")
+
+    def test_save_as_copies_store_without_loading_terms(self):
+        copy_path = Path(TMP) / "copy"
+        copy_path.mkdir()
+        tc = src.terms_controller.TermsController()
+        terms = tc.load_project(Path(TMP))
+        term = tc.get_term("4. Project files")
+        term.initialize_next_term()
+        term.next_term.description = "Copied."
+        tc.update_term(term.next_term)
+        misses = tc.cache_statistics["misses"]
+        tc.save_project_as(copy_path)
+
+        self.assertEqual(tc.cache_statistics["misses"], misses)
+        self.assertTrue((copy_path / ".definator" / "store.sqlite").exists())
+        originals = src.terms_controller.TermsController()
+        originals.load_project(Path(TMP))
+        tc.load_project(copy_path)
+        self.assertEqual(tc.get_term("4. Project files").description,
+                         "Copied.")
+        for term_str in terms:
+            if term_str != "4. Project files":
+                self.assertEqual(tc.get_term(term_str).description,
+                                 originals.get_term(term_str).description)
+            self.assertEqual(
+                sorted(path.name for path in tc.get_term(term_str).linked_images),
+                sorted(path.name for path in
+                       originals.get_term(term_str).linked_images))
+
+    def tearDown(self):
+        shutil.rmtree(TMP)
+
+
+class FolderTransactionTestCases(unittest.TestCase):
+
+    def setUp(self):
+        if Path(TMP).exists():
+            shutil.rmtree(TMP)
+        Path(TMP).mkdir()
+        src.data.storage.FolderStorage(Path(TMP)).save_json(
+            Path(TMP) / "terms.json", ["old"])
+
+    def test_recover_completes_interrupted_save(self):
+        def crash(renames, removals):
+            raise RuntimeError("Crashed while renaming")
+
+        storage = src.data.storage.FolderStorage(Path(TMP))
+        storage.begin()
+        storage.save_json(Path(TMP) / "terms.json", ["new"])
+        storage._apply = crash
+        self.assertRaises(RuntimeError, storage.commit)
+        self.assertEqual(storage.load_json(Path(TMP) / "terms.json"), ["old"])
+
+        storage = src.data.storage.FolderStorage(Path(TMP))
+        self.assertTrue(storage.recover())
+        self.assertFalse(storage.recover())
+        self.assertEqual(storage.load_json(Path(TMP) / "terms.json"), ["new"])
+
+    def test_recover_moves_back_uncommitted_folder_move(self):
+        (Path(TMP) / "old").mkdir()
+        storage = src.data.storage.FolderStorage(Path(TMP))
+        storage.begin()
+        self.assertTrue(storage.move_term_folder("old", "new"))
+        storage.save_json(Path(TMP) / "terms.json", ["new"])
+        self.assertTrue((Path(TMP) / "new").is_dir())
+
+        # Crashed before the commit:
+        storage = src.data.storage.FolderStorage(Path(TMP))
+        self.assertFalse(storage.recover())
+        self.assertTrue((Path(TMP) / "old").is_dir())
+        self.assertFalse((Path(TMP) / "new").exists())
+
+    def test_recover_moves_back_uncommitted_trash(self):
+        folder = Path(TMP) / "old"
+        folder.mkdir()
+        src.data.storage.FolderStorage(folder).save_json(
+            folder / "description.json", {})
+        storage = src.data.storage.FolderStorage(Path(TMP))
+        storage.begin()
+        storage.trash_term("old")
+        storage.save_json(Path(TMP) / "terms.json", [])
+        self.assertFalse(folder.exists())
+
+        # Crashed before the commit:
+        storage = src.data.storage.FolderStorage(Path(TMP))
+        storage.recover()
+        self.assertTrue((folder / "description.json").exists())
+
+        storage.begin()
+        storage.trash_term("old")
+        storage.save_json(Path(TMP) / "terms.json", [])
+        storage.commit()
+        storage.recover()
+        self.assertFalse(folder.exists())
+        self.assertEqual(storage.trash.terms(), ["old"])
+
+    def test_uncommitted_save_is_not_visible(self):
+        storage = src.data.storage.FolderStorage(Path(TMP))
+        storage.begin()
+        storage.save_json(Path(TMP) / "terms.json", ["new"])
+        self.assertEqual(storage.load_json(Path(TMP) / "terms.json"), ["old"])
+        self.assertFalse(storage.recover())
+        storage.commit()
+        self.assertEqual(storage.load_json(Path(TMP) / "terms.json"), ["new"])
+
+    def tearDown(self):
+        shutil.rmtree(TMP)
+
+
+class BlobStoreTestCases(unittest.TestCase):
+
+    def setUp(self):
+        if Path(TMP).exists():
+            shutil.rmtree(TMP)
+        Path(TMP).mkdir()
+        # The store is used as if the file system supported reflinks, the
+        # files are still copied on one, that doesn't:
+        src.data.blob_store.BlobStore.reflinks = True
+        self.attachment = Path(TMP) / "diagram.pdf"
+        with self.attachment.open("wb") as file:
+            file.write(b"%PDF" + bytes(1000))
+        self.tc = src.terms_controller.TermsController()
+        for term_str in ["A", "B"]:
+            term = src.data.term.Term(term_str)
+            term.link_file(self.attachment)
+            self.tc.add_term(term)
+        self.tc.save_project_as(Path(TMP))
+
+    def _unlink_attachment(self, term_str):
+        term = self.tc.get_term(term_str)
+        term.initialize_next_term()
+        term.next_term.unlink_file(Path("diagram.pdf"))
+        self.tc.update_term(term.next_term)
+        self.tc.save_project()
+
+    def test_rename_moves_the_term_folder(self):
+        (Path(TMP) / "A" / ".not-linked").touch()
+        term = self.tc.get_term("A")
+        term.initialize_next_term()
+        term.next_term.term = "C"
+        self.tc.update_term(term.next_term)
+        self.tc.save_project()
+
+        self.assertFalse((Path(TMP) / "A").exists())
+        self.assertTrue((Path(TMP) / "C" / ".not-linked").exists())
+        key = src.data.blob_store.BlobStore.file_key(self.attachment)
+        self.assertEqual(self.tc._storage.blobs.refs[key],
+                         {"B/diagram.pdf", "C/diagram.pdf"})
+        tc = src.terms_controller.TermsController()
+        tc.load_project(Path(TMP))
+        self.assertEqual([path.name for path in tc.get_term("C").linked_files],
+                         ["diagram.pdf"])
+
+    def _attachment_copies(self, path: Path):
+        """
+        Returns the paths of the files in the project, that have the content
+        of the attachment.
+        """
+        return sorted(file for file in path.glob("**/*") if file.is_file()
+                      and file != self.attachment
+                      and filecmp.cmp(str(file), str(self.attachment),
+                                      shallow=False))
+
+    def test_same_file_is_stored_once_in_the_blob_store(self):
+        key = src.data.blob_store.BlobStore.file_key(self.attachment)
+        blobs = self.tc._storage.blobs
+        blob = blobs.path_of(key)
+        self.assertEqual(blobs.keys(), [key])
+        self.assertEqual(blobs.refs[key], {"A/diagram.pdf", "B/diagram.pdf"})
+        # The copies in the term folders are reflinks to the stored file:
+        self.assertEqual(self._attachment_copies(Path(TMP)),
+                         [blob, Path(TMP) / "A" / "diagram.pdf",
+                          Path(TMP) / "B" / "diagram.pdf"])
+        for term_str in ["A", "B"]:
+            copy = Path(TMP) / term_str / "diagram.pdf"
+            self.assertTrue(blobs.is_copy(key, copy))
+
+        self._unlink_attachment("A")
+        self.assertFalse((Path(TMP) / "A" / "diagram.pdf").exists())
+        self.assertTrue(blob.exists())
+        self._unlink_attachment("B")
+        self.assertFalse(blob.exists())
+
+    def test_removed_term_is_moved_to_trash_and_restored(self):
+        key = src.data.blob_store.BlobStore.file_key(self.attachment)
+        self.tc.remove_term("A")
+        self.tc.save_project()
+        self.assertFalse((Path(TMP) / "A").exists())
+        self.assertEqual(self.tc.trashed_terms, ["A"])
+        self.assertEqual(self.tc._storage.blobs.refs[key], {"B/diagram.pdf"})
+
+        # Not saved, the term stays in the trash:
+        self.assertIsNotNone(self.tc.restore_term("A"))
+        self.assertFalse((Path(TMP) / "A").exists())
+        self.tc.discard_changes()
+        self.tc = src.terms_controller.TermsController()
+        self.tc.load_project(Path(TMP))
+        self.assertEqual(self.tc.trashed_terms, ["A"])
+
+        term = self.tc.restore_term("A")
+        self.assertEqual(term.linked_files, [Path("diagram.pdf")])
+        self.tc.save_project()
+        self.assertTrue((Path(TMP) / "A" / "diagram.pdf").exists())
+        tc = src.terms_controller.TermsController()
+        self.assertIn("A", tc.load_project(Path(TMP)))
+        self.assertEqual(tc.trashed_terms, [])
+        self.assertEqual(tc._storage.blobs.refs[key],
+                         {"A/diagram.pdf", "B/diagram.pdf"})
+
+    def test_attachment_edited_in_place_is_not_shared(self):
+        blobs = self.tc._storage.blobs
+        key = src.data.blob_store.BlobStore.file_key(self.attachment)
+        edited = Path(TMP) / "A" / "diagram.pdf"
+        with edited.open("ab") as file:
+            file.write(b"edited")
+        for path in [Path(TMP) / "B" / "diagram.pdf", blobs.path_of(key)]:
+            self.assertTrue(filecmp.cmp(str(self.attachment), str(path),
+                                        shallow=False))
+        self.assertFalse(blobs.is_copy(key, edited))
+
+        new_key = self.tc._storage.reference_file(edited, key)
+        self.assertEqual(new_key,
+                         src.data.blob_store.BlobStore.file_key(edited))
+        self.assertEqual(blobs.refs[key], {"B/diagram.pdf"})
+        self.assertEqual(blobs.refs[new_key], {"A/diagram.pdf"})
+
+    def test_without_reflinks_files_are_only_copied_to_the_terms(self):
+        src.data.blob_store.BlobStore.reflinks = False
+        path = Path(TMP) / "copy"
+        path.mkdir()
+        tc = src.terms_controller.TermsController()
+        for term_str in ["A", "B"]:
+            term = src.data.term.Term(term_str)
+            term.link_file(self.attachment)
+            tc.add_term(term)
+        tc.save_project_as(path)
+
+        self.assertEqual(tc._storage.blobs.keys(), [])
+        self.assertEqual(self._attachment_copies(path),
+                         [path / "A" / "diagram.pdf",
+                          path / "B" / "diagram.pdf"])
+        tc.load_project(path)
+        self.assertIsNone(tc.get_term("A").blob_key("diagram.pdf"))
+
+    def test_unlinked_attachment_is_moved_to_trash(self):
+        self._unlink_attachment("A")
+        trash = self.tc._storage.trash
+        self.assertTrue(
+            (trash.slots()[-1] / "A" / "diagram.pdf").exists())
+        self.assertEqual(trash.purge(60), 0)
+        self.assertEqual(trash.purge(), 1)
+        self.assertEqual(trash.slots(), [])
+
+    def test_scan_reclaims_unreferenced_and_duplicate_files(self):
+        stray = Path(TMP) / "A" / "stray.txt"
+        with stray.open("wb") as file:
+            file.write(bytes(10))
+        # A copy of the attachment, that is not tracked by the blob store:
+        copy = Path(TMP) / "B" / "diagram.pdf"
+        storage = self.tc._storage
+        links = storage.load_json(Path(TMP) / "B" / "links.json")
+        del links["blobs"]
+        storage.save_json(Path(TMP) / "B" / "links.json", links)
+        os.remove(str(copy))
+        with copy.open("wb") as file:
+            file.write(b"%PDF" + bytes(1000))
+
+        report = self.tc.scan_attachments()
+        self.assertEqual(report.terms, 2)
+        self.assertEqual(report.orphans, [stray])
+        self.assertEqual(report.orphan_bytes, 10)
+        key = src.data.blob_store.BlobStore.file_key(self.attachment)
+        self.assertEqual(report.duplicates, {key: [copy]})
+        self.assertEqual(report.duplicate_bytes, 1004)
+
+        reflink = src.data.fs_helpers.clone_file(
+            self.attachment, Path(TMP) / "reflink.pdf") == 0
+        self.assertEqual(self.tc.reclaim_attachments(report),
+                         1014 if reflink else 10)
+        self.assertFalse(stray.exists())
+        trash_slot = storage.trash.slots()[-1]
+        self.assertTrue((trash_slot / "A" / "stray.txt").exists())
+        self.assertFalse(os.path.samefile(
+            str(copy), str(storage.blobs.path_of(key))))
+        self.assertEqual(
+            storage.load_json(Path(TMP) / "B" / "links.json")["blobs"],
+            {"diagram.pdf": key})
+        report = self.tc.scan_attachments()
+        self.assertEqual((report.orphans, report.duplicates), ([], {}))
+        self.assertEqual(self.tc.get_term("A").linked_files,
+                         [Path("diagram.pdf")])
+
+    def test_duplicates_are_not_reported_without_reflinks(self):
+        copy = Path(TMP) / "B" / "diagram.pdf"
+        links = self.tc._storage.load_json(Path(TMP) / "B" / "links.json")
+        del links["blobs"]
+        self.tc._storage.save_json(Path(TMP) / "B" / "links.json", links)
+        src.data.blob_store.BlobStore.reflinks = False
+        tc = src.terms_controller.TermsController()
+        tc.load_project(Path(TMP))
+
+        report = tc.scan_attachments()
+        self.assertEqual((report.duplicates, report.reclaimable_bytes),
+                         ({}, 0))
+        self.assertEqual(tc.reclaim_attachments(report), 0)
+        self.assertFalse(os.path.samefile(
+            str(copy), str(Path(TMP) / "A" / "diagram.pdf")))
+
+    def test_rollback_moves_attachment_back_from_trash(self):
+        storage = self.tc._storage
+        key = src.data.blob_store.BlobStore.file_key(self.attachment)
+        attachment = Path(TMP) / "A" / "diagram.pdf"
+        storage.begin()
+        storage.remove_attachment(attachment, key)
+        self.assertFalse(attachment.exists())
+        storage.rollback()
+        self.assertTrue(attachment.exists())
+        self.assertEqual(storage.blobs.refs[key],
+                         {"A/diagram.pdf", "B/diagram.pdf"})
+
+    def test_save_as_clones_unchanged_terms(self):
+        copy_path = Path(TMP) / "copy"
+        copy_path.mkdir()
+        tc = src.terms_controller.TermsController()
+        terms = tc.load_project(Path(TMP))
+        calls = []
+        tc.save_project_as(copy_path, lambda done, total: calls.append(done))
+
+        self.assertEqual(calls, [1, 2])
+        self.assertEqual(tc.cache_statistics["misses"], 0)
+        attachment = copy_path / "A" / "diagram.pdf"
+        self.assertTrue(attachment.exists())
+        self.assertFalse(os.path.samefile(
+            str(attachment), str(Path(TMP) / "A" / "diagram.pdf")))
+        self.assertTrue(filecmp.cmp(str(attachment), str(self.attachment),
+                                    shallow=False))
+        tc.load_project(copy_path)
+        self.assertEqual(tc.get_term("A").linked_files,
+                         [Path("diagram.pdf")])
+
+    def test_clone_file_copies_content(self):
+        copy = Path(TMP) / "copy.pdf"
+        src.data.fs_helpers.clone_file(self.attachment, copy)
+        with copy.open("rb") as file:
+            self.assertEqual(file.read(), b"%PDF" + bytes(1000))
+
+    def tearDown(self):
+        src.data.blob_store.BlobStore.reflinks = None
+        shutil.rmtree(TMP)
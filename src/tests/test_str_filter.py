@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+#
+# This file is a part of Definator (https://github.com/aparaatti/definator)
+# and it is licensed under the GPLv3 (http://www.gnu.org/licenses/gpl-3.0.txt).
+#
+import unittest
+import src.data.str_filter
+
+TERMS = ["Cat", "Catalog", "Dog", "HOT DOG", "Straße", "concatenate"]
+
+
+class StrFilterTestCases(unittest.TestCase):
+
+    def setUp(self):
+        self.str_filter = src.data.str_filter.StrFilter(TERMS)
+
+    def test_substring_ignores_case(self):
+        self.assertIsNone(self.str_filter.filter(""))
+        self.assertEqual(self.str_filter.filter("CAT"), [0, 1, 5])
+        self.assertEqual(self.str_filter.filter("t d"), [3])
+        self.assertEqual(self.str_filter.filter("STRASSE"), [4])
+
+    def test_longer_query_narrows_previous_result(self):
+        cat = self.str_filter.filter("cat")
+        # A string not in the result of "cat" is not searched for "cata":
+        self.str_filter._folded[2] = "catastrophe"
+        self.assertEqual(self.str_filter.filter("cata"), [1])
+        self.assertIs(self.str_filter.filter("cat"), cat)
+
+    def test_changed_strings_clear_results(self):
+        self.str_filter.filter("dog")
+        self.str_filter.insert(0, "Bulldog")
+        self.assertEqual(self.str_filter.filter("dog"), [0, 3, 4])
+        self.str_filter.remove(0)
+        self.str_filter.extend(["Underdog"])
+        self.assertEqual(self.str_filter.filter("dog"), [2, 3, 6])
+
+    def test_fuzzy_matches_characters_in_order(self):
+        self.str_filter.fuzzy = True
+        self.assertEqual(self.str_filter.filter("cg"), [1])
+        self.assertEqual(self.str_filter.filter("hdg"), [3])
+        self.assertEqual(self.str_filter.filter("gd"), [])
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+#
+# This file is a part of Definator (https://github.com/aparaatti/definator)
+# and it is licensed under the GPLv3 (http://www.gnu.org/licenses/gpl-3.0.txt).
+#
+import unittest
+import src.data.term
+
+
+class TermUndoTestCases(unittest.TestCase):
+
+    def _edit(self, term, version):
+        term.initialize_next_term()
+        term = term.next_term
+        term.term = "Term " + str(version)
+        lines = ["Line " + str(line) + "\n" for line in range(50)]
+        lines[version % 50] = "Version " + str(version) + "\n"
+        term.description = "".join(lines)
+        return term
+
+    def test_undo_rebuilds_versions_from_deltas(self):
+        first = src.data.term.Term("Term 0")
+        first.description = "First version."
+        term = first
+        for version in range(1, 20):
+            term = self._edit(term, version)
+
+        # Only the latest previous version is kept as a whole term:
+        self.assertIsInstance(term._previous_term, src.data.term.Term)
+        self.assertIsInstance(term._previous_term._previous_term,
+                              src.data.term.TermDelta)
+
+        for version in range(18, 0, -1):
+            self.assertTrue(term.can_undo)
+            term = term.previous_term
+            self.assertEqual(term.term, "Term " + str(version))
+            self.assertIn("Version " + str(version) + "\n", term.description)
+        term = term.previous_term
+        self.assertEqual(term.description, "First version.")
+        self.assertFalse(term.can_undo)
+        self.assertEqual(term.next_term.term, "Term 1")
+
+    def test_history_is_limited_to_undo_depth(self):
+        depth = src.data.term.Term.undo_depth
+        src.data.term.Term.undo_depth = 5
+        try:
+            term = src.data.term.Term("Term 0")
+            for version in range(1, 20):
+                term = self._edit(term, version)
+        finally:
+            src.data.term.Term.undo_depth = depth
+
+        undos = 0
+        while term.can_undo:
+            term = term.previous_term
+            undos += 1
+        self.assertEqual(undos, 5)
+        self.assertEqual(term.term, "Term 14")
@@ -8,6 +8,7 @@ import os
 import unittest
 import shutil
 import tempfile
+import threading
 import src.terms_controller
 import src.data.term
 
@@ -45,6 +46,48 @@ class TermsControllerBackendTestCases(unittest.TestCase):
         self.tc = src.terms_controller.TermsController()
         self.tc.load_project(Path(TMP))
 
+    def test_cache_evicts_only_saved_terms(self):
+        tc = src.terms_controller.TermsController(max_cached_terms=1)
+        terms = tc.load_project(Path(TMP))
+        term = tc.get_term(terms[0])
+        term.initialize_next_term()
+        tc.update_term(term.next_term)
+        tc.get_term(terms[1])
+        tc.get_term(terms[2])
+        tc.get_term(terms[2])
+
+        statistics = tc.cache_statistics
+        self.assertEqual(statistics["terms"], 2)
+        self.assertEqual(statistics["hits"], 1)
+        self.assertEqual(statistics["evictions"], 1)
+        self.assertIn(terms[0], tc._terms)
+
+    def test_prefetched_term_is_taken_into_use(self):
+        self.tc.prefetch(["3. Link and unlink", "4. Project files"])
+        self.tc.prefetch(["4. Project files", "No such term"])
+        self.assertEqual(list(self.tc._prefetching.keys()),
+                         ["4. Project files"])
+        term = self.tc.get_term("4. Project files")
+        self.assertEqual(term.related_terms, ["3. Link and unlink"])
+        self.assertEqual(self.tc._prefetching, {})
+
+    def test_project_is_loaded_in_chunks(self):
+        tc = src.terms_controller.TermsController()
+        project_load = tc.begin_load(Path(TMP))
+        chunks = []
+        first_terms = []
+        thread = threading.Thread(target=project_load.run, args=(
+            chunks.append, first_terms.append, 2))
+        thread.start()
+        thread.join()
+
+        terms = tc.finish_load(project_load)
+        self.assertEqual([len(chunk) for chunk in chunks],
+                         [2] * (len(terms) // 2) + [1] * (len(terms) % 2))
+        self.assertEqual(sum(chunks, []), terms)
+        self.assertEqual(first_terms[0].term, terms[0])
+        self.assertIs(tc._lazy_load_term(terms[0]), first_terms[0])
+
     def test_rename_and_save(self):
         term = self.tc.get_term("1. Startup")
         self.assertEqual(term.term, "1. Startup")
@@ -58,6 +101,341 @@ class TermsControllerBackendTestCases(unittest.TestCase):
         self.assertEqual(term.term, "1. Not at all the same")
 
 
+    def test_rendered_html_is_cached_and_saved(self):
+        tc = src.terms_controller.TermsController(render_cache=True)
+        terms = tc.load_project(Path(TMP))
+        term = tc.get_term(terms[-1])
+        html = term.term_as_html
+        self.assertIs(term.term_as_html, html)
+        tc.save_project()
+        self.assertTrue((Path(TMP) / ".definator" / "render.json").exists())
+
+        tc = src.terms_controller.TermsController(render_cache=True)
+        tc.load_project(Path(TMP))
+        term = tc.get_term(terms[-1])
+        self.assertEqual(term.rendered_html.get("term"), html)
+        term.description = "Changed description."
+        self.assertNotEqual(term.term_as_html, html)
+
+    def test_get_term_returns_independent_handles(self):
+        term = self.tc.get_term("1. Startup")
+        other = self.tc.get_term("1. Startup")
+        related_terms = other.related_terms
+        self.assertIs(term._links, other._links)
+
+        term.link_term(src.data.term.Term("4. Project files"))
+        self.assertIsNot(term._links, other._links)
+        self.assertIn("4. Project files", term.related_terms)
+        self.assertEqual(other.related_terms, related_terms)
+        self.assertEqual(
+            self.tc.get_term("1. Startup").related_terms, related_terms)
+
+    def test_save_writes_only_changed_parts(self):
+        self.tc.add_term(src.data.term.Term("Linked term"))
+        # Writes also the related terms linked by the other tests:
+        self._change_description("3. Link and unlink", "Saved once.")
+        self.tc.save_project()
+
+        term = self.tc.get_term("3. Link and unlink")
+        term.initialize_next_term()
+        new_term = term.next_term
+        new_term.description = "Only the description changes."
+        self.tc.update_term(new_term)
+        self.tc.save_project()
+        # The description and the search index:
+        self.assertEqual(self.tc.save_statistics.files, 2)
+
+        term = self.tc.get_term("3. Link and unlink")
+        description = Path(TMP) / term.term / "description.json"
+        os.utime(str(description), (0, 0))
+        term.initialize_next_term()
+        new_term = term.next_term
+        self.tc.link_terms(new_term, ["Linked term"])
+        self.tc.save_project()
+        # The link graph and the links of the changed term:
+        self.assertEqual(self.tc.save_statistics.files, 2)
+        self.assertEqual(description.stat().st_mtime, 0)
+
+    def test_lost_link_graph_is_rebuilt_from_the_terms(self):
+        path = Path(tempfile.mkdtemp(prefix="def-test-graph"))
+        tc = src.terms_controller.TermsController()
+        for term_str in ["A", "B", "C"]:
+            tc.add_term(src.data.term.Term(term_str))
+        tc.save_project_as(path)
+        term = tc.get_term("A")
+        term.initialize_next_term()
+        tc.link_terms(term.next_term, ["B", "C"])
+        tc.save_project()
+        term = tc.get_term("B")
+        term.initialize_next_term()
+        term.next_term.description = "Saved with its links."
+        tc.update_term(term.next_term)
+        tc.save_project()
+
+        os.remove(str(path / ".definator" / "graph.json"))
+        tc = src.terms_controller.TermsController()
+        tc.load_project(path)
+        self.assertEqual(tc.related_terms("A"), ["B", "C"])
+        self.assertEqual(tc.related_terms("B"), ["A"])
+        # C has not been saved since it was linked:
+        self.assertEqual(tc.related_terms("C"), [])
+        shutil.rmtree(str(path))
+
+    def _change_description(self, term_str, description):
+        term = self.tc.get_term(term_str)
+        term.initialize_next_term()
+        term.next_term.description = description
+        self.tc.update_term(term.next_term)
+
+    def test_term_changed_during_save_stays_unsaved(self):
+        path = Path(tempfile.mkdtemp(prefix="def-test-save"))
+        self.tc.save_project_as(path)
+        for term_str in ["3. Link and unlink", "4. Project files"]:
+            self._change_description(term_str, "Saved in the background.")
+
+        project_save = self.tc.begin_save()
+        self._change_description("3. Link and unlink",
+                                 "Changed during the save.")
+        thread = threading.Thread(target=project_save.run)
+        thread.start()
+        thread.join()
+        self.tc.finish_save(project_save)
+
+        self.assertTrue(project_save.is_complete)
+        self.assertEqual(list(self.tc._changed_terms.keys()),
+                         ["3. Link and unlink"])
+        tc = src.terms_controller.TermsController()
+        tc.load_project(path)
+        for term_str in ["3. Link and unlink", "4. Project files"]:
+            self.assertEqual(tc.get_term(term_str).description,
+                             "Saved in the background.")
+        shutil.rmtree(str(path))
+
+    def test_cancelled_save_leaves_changes_unsaved(self):
+        path = Path(tempfile.mkdtemp(prefix="def-test-save"))
+        self.tc.save_project_as(path)
+        self._change_description("4. Project files", "Not saved.")
+        self.tc.add_term(src.data.term.Term("Not saved"))
+
+        project_save = self.tc.begin_save()
+        project_save.cancel()
+        project_save.run()
+        self.tc.finish_save(project_save)
+
+        self.assertFalse(project_save.is_complete)
+        self.assertEqual(self.tc.unsaved_changes, 2)
+        self.tc.save_project()
+        tc = src.terms_controller.TermsController()
+        self.assertIn("Not saved", tc.load_project(path))
+        self.assertEqual(tc.get_term("4. Project files").description,
+                         "Not saved.")
+        shutil.rmtree(str(path))
+
+    def test_terms_renamed_back_or_never_saved_are_not_deleted(self):
+        path = Path(tempfile.mkdtemp(prefix="def-test-save"))
+        self.tc.save_project_as(path)
+        attachment = path / "4. Project files" / "notes.txt"
+        attachment.touch()
+        tc = src.terms_controller.TermsController()
+        tc.load_project(path)
+        for term_str, new_term_str in [("4. Project files", "Renamed"),
+                                       ("Renamed", "4. Project files")]:
+            term = tc.get_term(term_str)
+            term.initialize_next_term()
+            term.next_term.term = new_term_str
+            tc.update_term(term.next_term)
+        tc.add_term(src.data.term.Term("Never saved"))
+        tc.remove_term("Never saved")
+        tc.save_project()
+
+        self.assertTrue(attachment.exists())
+        self.assertFalse((path / "Renamed").exists())
+        self.assertFalse((path / "Never saved").exists())
+        tc = src.terms_controller.TermsController()
+        self.assertIn("4. Project files", tc.load_project(path))
+        shutil.rmtree(str(path))
+
+    def test_failed_save_leaves_changes_unsaved(self):
+        path = Path(tempfile.mkdtemp(prefix="def-test-save"))
+        self.tc.save_project_as(path)
+        changed = ["3. Link and unlink", "4. Project files"]
+        for term_str in changed:
+            self._change_description(term_str, "Saved after a failure.")
+
+        project_save = self.tc.begin_save()
+        save_term = project_save._save_term
+        saved = []
+
+        def fail_on_second_term(term_str, handle):
+            saved.append(term_str)
+            if len(saved) == 2:
+                raise OSError("No space left on device")
+            save_term(term_str, handle)
+        project_save._save_term = fail_on_second_term
+        self.assertRaises(OSError, project_save.run)
+        self.tc.finish_save(project_save)
+
+        self.assertFalse(project_save.is_complete)
+        self.assertEqual(sorted(self.tc.unsaved_terms), changed)
+        tc = src.terms_controller.TermsController()
+        tc.load_project(path)
+        self.assertNotEqual(tc.get_term(changed[0]).description,
+                            "Saved after a failure.")
+        self.tc.save_project()
+        self.assertEqual(self.tc.unsaved_changes, 0)
+        tc.load_project(path)
+        for term_str in changed:
+            self.assertEqual(tc.get_term(term_str).description,
+                             "Saved after a failure.")
+        shutil.rmtree(str(path))
+
+    def test_unsaved_changes_are_replayed_from_the_journal(self):
+        path = Path(tempfile.mkdtemp(prefix="def-test-journal"))
+        self.tc.save_project_as(path)
+        tc = src.terms_controller.TermsController(journal=True)
+        terms = tc.load_project(path)
+        removed = [term_str for term_str in terms if term_str not in
+                   ["3. Link and unlink", "4. Project files"]][0]
+        self.tc = tc
+        self._change_description("4. Project files", "Journaled.")
+        tc.add_term(src.data.term.Term("Journaled"))
+        term = tc.get_term("3. Link and unlink")
+        term.initialize_next_term()
+        term.next_term.term = "Renamed"
+        tc.update_term(term.next_term)
+        term = tc.get_term("Journaled")
+        term.initialize_next_term()
+        tc.link_many(term.next_term, ["Renamed"])
+        tc.remove_term(removed)
+
+        # As if the application died without saving:
+        recovered = src.terms_controller.TermsController(journal=True)
+        terms = recovered.load_project(path)
+        self.assertIn("Renamed", terms)
+        self.assertIn("Journaled", terms)
+        self.assertNotIn("3. Link and unlink", terms)
+        self.assertNotIn(removed, terms)
+        self.assertTrue(recovered.is_linked("Journaled", "Renamed"))
+        self.assertEqual(recovered.get_term("4. Project files").description,
+                         "Journaled.")
+        self.assertIn("Renamed", recovered.unsaved_terms)
+
+        recovered.save_project()
+        self.assertFalse(
+            (path / ".definator" / "operations.jsonl").exists())
+        tc = src.terms_controller.TermsController(journal=True)
+        terms = tc.load_project(path)
+        self.assertEqual(tc.unsaved_changes, 0)
+        self.assertIn("Renamed", terms)
+        self.assertNotIn(removed, terms)
+        self.assertFalse((path / removed).exists())
+        self.assertEqual(tc.get_term("4. Project files").related_terms,
+                         ["Renamed"])
+        self.assertTrue(tc.is_linked("Journaled", "Renamed"))
+        shutil.rmtree(str(path))
+
+    def test_journal_is_made_on_the_first_change(self):
+        path = Path(tempfile.mkdtemp(prefix="def-test-journal"))
+        self.tc.save_project_as(path)
+        journal = path / ".definator" / "operations.jsonl"
+        tc = src.terms_controller.TermsController(journal=True)
+        terms = tc.load_project(path)
+        tc.get_term(terms[0])
+        self.assertFalse(journal.exists())
+        self.tc = tc
+        self._change_description(terms[0], "Journaled.")
+        self.assertTrue(journal.exists())
+
+        tc = src.terms_controller.TermsController(journal=True)
+        project_load = tc.begin_load(path, journal=False)
+        project_load.run()
+        tc.finish_load(project_load)
+        self.tc = tc
+        self._change_description(terms[0], "Not journaled.")
+        tc.discard_changes()
+        self.assertTrue(journal.exists())
+        shutil.rmtree(str(path))
+
+    def test_link_many_updates_only_the_term(self):
+        targets = ["1. Startup", "4. Project files", "No such term"]
+        term = self.tc.get_term("3. Link and unlink")
+        term.initialize_next_term()
+        new_term = term.next_term
+        linked = self.tc.link_many(new_term, targets + ["1. Startup"])
+        self.assertEqual(linked, ["1. Startup"])
+        self.assertEqual(list(self.tc._changed_terms.keys()),
+                         ["3. Link and unlink"])
+        self.assertIn("3. Link and unlink",
+                      self.tc.get_term("1. Startup").related_terms)
+
+        new_term.initialize_next_term()
+        unlinked = self.tc.unlink_many(new_term.next_term, targets[:1])
+        self.assertEqual(unlinked, ["1. Startup"])
+        self.assertNotIn("3. Link and unlink",
+                         self.tc.get_term("1. Startup").related_terms)
+
+    def test_link_many_saves_only_the_term_and_the_graph(self):
+        path = Path(tempfile.mkdtemp(prefix="def-test-link-many"))
+        tc = src.terms_controller.TermsController()
+        targets = ["Target " + str(i) for i in range(200)]
+        for term_str in ["Hub"] + targets:
+            tc.add_term(src.data.term.Term(term_str))
+        tc.save_project_as(path)
+
+        hub = tc.get_term("Hub")
+        hub.initialize_next_term()
+        self.assertEqual(tc.link_many(hub.next_term, targets), targets)
+        tc.save_project()
+        # The link graph and the links of the hub:
+        self.assertEqual(tc.save_statistics.files, 2)
+        self.assertEqual(tc.unsaved_changes, 0)
+        shutil.rmtree(str(path))
+
+    def test_links_made_on_a_term_are_added_to_the_graph(self):
+        term = self.tc.get_term("2. View term")
+        term.initialize_next_term()
+        new_term = term.next_term
+        new_term.link_term(self.tc.get_term("1. Startup"))
+        self.tc.update_term(new_term)
+        self.assertTrue(self.tc.is_linked("1. Startup", "2. View term"))
+
+    def test_links_are_kept_in_the_link_graph(self):
+        self.assertTrue((Path(TMP) / ".definator" / "graph.json").exists())
+        self.tc.add_term(src.data.term.Term("Hub"))
+        hub = self.tc.get_term("Hub")
+        hub.initialize_next_term()
+        self.tc.link_terms(hub.next_term, ["4. Project files"])
+        self.assertTrue(self.tc.is_linked("4. Project files", "Hub"))
+        self.assertIn("Hub", self.tc.backlinks("4. Project files"))
+        self.tc.save_project()
+
+        tc = src.terms_controller.TermsController()
+        tc.load_project(Path(TMP))
+        self.assertEqual(tc.get_term("Hub").related_terms,
+                         ["4. Project files"])
+        self.assertIn("Hub", tc.get_term("4. Project files").related_terms)
+        hub = tc.get_term("Hub")
+        hub.initialize_next_term()
+        tc.unlink_terms(hub.next_term, ["4. Project files"])
+        self.assertNotIn("Hub", tc.backlinks("4. Project files"))
+        tc.save_project()
+
+    def test_search_index_is_updated_and_saved(self):
+        self.assertEqual(self.tc.search("project file structure"),
+                         ["4. Project files"])
+        term = self.tc.get_term("4. Project files")
+        term.initialize_next_term()
+        new_term = term.next_term
+        new_term.description = "Zebras are striped."
+        self.tc.update_term(new_term)
+        self.assertEqual(self.tc.search("zebras"), ["4. Project files"])
+        self.tc.save_project()
+
+        tc = src.terms_controller.TermsController()
+        tc.load_project(Path(TMP))
+        self.assertEqual(tc._unindexed, set())
+        self.assertEqual(tc.search("striped zebras"), ["4. Project files"])
+
     """
     B3: 0cd22ed885bf209e99e68acf11004900addc3573
     file in term folder:
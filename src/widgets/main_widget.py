@@ -105,22 +105,71 @@ class MainWidget(QWidget):
         self._current_term = Term()
         self.create_new_term()
 
-    @pyqtSlot(tuple, Term)
-    def initialize_a_project(self, terms: tuple, term: Term):
+    @pyqtSlot()
+    def start_loading_a_project(self):
+        """
+        This slot empties the term browser for the terms of a project being
+        opened. The widget is disabled until initialize_a_project is called.
+        """
+        logging.debug("LOADING A PROJECT")
+        self.term_str_browser.set_list([])
+        self.setEnabled(False)
+
+    @pyqtSlot(list)
+    def add_loaded_terms(self, terms: list):
+        """
+        This slot adds a chunk of the terms of the project being opened.
+
+        :param terms: terms to show, a list containing strings
+        """
+        self.term_str_browser.add_strs(terms)
+
+    @pyqtSlot(Term)
+    def show_loaded_term(self, term: Term):
+        """
+        This slot shows a term of the project being opened, before the
+        project is initialized.
+
+        :param term: term to show, a Term object
+        """
+        self._set_current_term(term)
+        self.show_term_display()
+
+    @pyqtSlot(list, list)
+    def show_recovered_changes(self, terms: list, unsaved_terms: list):
+        """
+        This slot shows the terms of the project being opened, after the
+        unsaved changes of an earlier session have been recovered, and marks
+        the recovered terms.
+
+        :param terms: terms to show, a list containing strings
+        :param unsaved_terms: terms to mark, a list containing strings
+        """
+        self.term_str_browser.set_list(terms)
+        for term_str in unsaved_terms:
+            self.term_str_browser.mark_str(term_str)
+
+    @pyqtSlot(Term)
+    def initialize_a_project(self, term: Term):
         """
-        This slot initializes a project.
+        This slot initializes a project, after its terms have been added.
 
-        :param terms: terms to show, a tuple containing strings
         :param term: term to show, a Term object
         """
         logging.debug("INITIALIZING A PROJECT")
-        self.term_str_browser.set_list(list(terms))
+        self.setEnabled(True)
         self._set_current_term(term)
         self.show_term_display()
 
     @pyqtSlot()
-    def unmark(self):
+    @pyqtSlot(list)
+    def unmark(self, unsaved_terms: list=()):
+        """
+        Unmarks the saved terms. The terms in unsaved_terms stay marked.
+        """
         self.term_str_browser.unmark_all()
+        for term_str in unsaved_terms:
+            self.term_str_browser.mark_str(term_str)
 
     @pyqtSlot(Term)
     def change_term(self, term: Term):
@@ -37,9 +37,10 @@ class Ui_QStrBrowser(object):
         self.lineEdit.setText("")
         self.lineEdit.setObjectName("lineEdit")
         self.verticalLayout_3.addWidget(self.lineEdit)
-        self.listWidget = QtWidgets.QListWidget(self.str_box)
-        self.listWidget.setObjectName("listWidget")
-        self.verticalLayout_3.addWidget(self.listWidget)
+        self.listView = QtWidgets.QListView(self.str_box)
+        self.listView.setUniformItemSizes(True)
+        self.listView.setObjectName("listView")
+        self.verticalLayout_3.addWidget(self.listView)
         self.verticalLayout.addWidget(self.str_box)
 
         self.retranslateUi(QStrBrowser)
@@ -3,12 +3,13 @@
 # This file is a part of Definator (https://github.com/aparaatti/definator)
 # and it is licensed under the GPLv3 (http://www.gnu.org/licenses/gpl-3.0.txt).
 #
-from PyQt5.QtCore import pyqtSignal, pyqtSlot
-from PyQt5.QtWidgets import QWidget, QListWidgetItem
-from PyQt5.QtGui import QColor, QBrush, QKeySequence
+from PyQt5.QtCore import pyqtSignal, pyqtSlot, QTimer
+from PyQt5.QtWidgets import QWidget
+from PyQt5.QtGui import QColor, QKeySequence
 
 from .qtdesigner.ui_QStrBrowser import Ui_QStrBrowser
 from .key_press_eater import KeyPressEater
+from .str_list_model import StrListModel
 
 
 class StrBrowser(QWidget):
@@ -28,9 +29,17 @@ class StrBrowser(QWidget):
 
     Signal **list_is_empty()** is sent, when the list is empty.
 
+    The strings are kept in a StrListModel, so only the rows visible in the
+    list view are asked from the model. The list is filtered to the strings
+    containing the entered string, ignoring the case, after the typing has
+    paused for filter_delay milliseconds. With fuzzy_filter the characters
+    of the entered string have to be found in the same order.
+
     :param: title, str the title of the widget, shown on surrounding group box.
     :param: parent, parent QObject of this QObject.
     """
+    filter_delay = 150
+
     str_selected = pyqtSignal(str)
     list_is_empty = pyqtSignal()
 
@@ -42,41 +51,50 @@ class StrBrowser(QWidget):
         super(StrBrowser, self).__init__(parent)
         self._selected_str = ""
         self._mark_color = ["White", "Black"]
-        self._default_colors = ["Black", "White"]
-        self._marked_items = list()
-        self._str_2_item = {}
+        self._model = StrListModel(self._mark_color, self)
+        self._filter_timer = QTimer(self)
+        self._filter_timer.setSingleShot(True)
+        self._filter_timer.setInterval(self.filter_delay)
+        self._filter_timer.timeout.connect(self._apply_filter)
         self.ui = Ui_QStrBrowser()
 
         # Setup widgets from Ui_QStrBrowser (qtdesigner made ui):
         self.ui.setupUi(self)
         self.ui.str_box.setTitle(title)
+        self.ui.listView.setModel(self._model)
 
         # Signals and slots:
-        self.ui.listWidget.itemActivated.connect(self._str_selected)
-        self.ui.listWidget.setSortingEnabled(True)
+        self.ui.listView.activated.connect(self._str_selected)
         self.ui.lineEdit.textChanged.connect(self._filter)
 
         # Hook into undo/redo of term_editor
         self.eventFilter = KeyPressEater(QKeySequence.Undo, self)
         self.eventFilter2 = KeyPressEater(QKeySequence.Redo, self)
-        self.ui.listWidget.installEventFilter(self.eventFilter)
-        self.ui.listWidget.installEventFilter(self.eventFilter2)
+        self.ui.listView.installEventFilter(self.eventFilter)
+        self.ui.listView.installEventFilter(self.eventFilter2)
         self.ui.lineEdit.installEventFilter(self.eventFilter)
         self.ui.lineEdit.installEventFilter(self.eventFilter2)
 
     @pyqtSlot(str)
     def _filter(self, string):
-        filtered_list = list()
-        if string == "":
-            self.set_list(list(self._str_2_item.keys()))
-        else:
-            for filtered_string in self._str_2_item.keys():
-                if filtered_string.lower().startswith(string.lower()):
-                    filtered_list.append(filtered_string)
+        # Restarts the delay on every key press:
+        self._filter_timer.start()
 
-            self.ui.listWidget.clear()
-            for string in filtered_list:
-                self._add_a_str(string)
+    @pyqtSlot()
+    def _apply_filter(self):
+        self._model.set_query(self.ui.lineEdit.text())
+        if self._selected_str:
+            row = self._model.row_of(self._selected_str)
+            if row >= 0:
+                self.ui.listView.setCurrentIndex(self._model.index(row))
+
+    @property
+    def fuzzy_filter(self):
+        return self._model.fuzzy
+
+    @fuzzy_filter.setter
+    def fuzzy_filter(self, fuzzy: bool):
+        self._model.fuzzy = fuzzy
 
     def set_list(self, str_list: list):
         """
@@ -84,10 +102,16 @@ class StrBrowser(QWidget):
 
         :param str_list: a list that contains str objects
         """
-        self.ui.listWidget.clear()
-        self._str_2_item.clear()
-        for string in str_list:
-            self._add_a_str(string)
+        self._model.set_strs(str_list)
+
+    def add_strs(self, str_list: list):
+        """
+        This method adds many strings to the shown list, eg. a chunk of the
+        terms of a project being opened.
+
+        :param str_list: a list that contains str objects
+        """
+        self._model.add_strs(str_list)
 
     def get_list(self):
         """
@@ -95,15 +119,19 @@ class StrBrowser(QWidget):
 
         :return: a list containing str objects
         """
-        return list(self._str_2_item.keys())
+        return self._model.strs
 
-    def _add_a_str(self, string: str):
-        self._str_2_item[string] = QListWidgetItem(string, self.ui.listWidget)
-        self.ui.listWidget.sortItems()
+    def _shown_index(self, string: str):
+        """
+        Returns the index of the string in the list view, which is invalid
+        if the string is not shown.
+        """
+        return self._model.index(self._model.row_of(string))
 
     def _str_selected(self):
-        if self.ui.listWidget.currentItem() is not None:
-            self._selected_str = self.ui.listWidget.currentItem().text()
+        index = self.ui.listView.currentIndex()
+        if index.isValid():
+            self._selected_str = index.data()
             self.str_selected.emit(self._selected_str)
         else:
             self.list_is_empty.emit()
@@ -116,9 +144,31 @@ class StrBrowser(QWidget):
         """
         if self._selected_str == string:
             return
-        if string and string in self._str_2_item.keys():
-            self.ui.listWidget.setCurrentItem(self._str_2_item[string])
-            self._selected_str = string
+        if string:
+            index = self._shown_index(string)
+            if index.isValid():
+                self.ui.listView.setCurrentIndex(index)
+                self._selected_str = string
+
+    def neighbours(self, string: str, count: int=2):
+        """
+        This method returns the strings shown next to the given string in the
+        list, count strings before and count strings after it.
+
+        :param string: str in the list
+        :param count: number of strings to take from each side
+        :return: a list containing str objects
+        """
+        index = self._shown_index(string)
+        if not index.isValid():
+            return []
+        row = index.row()
+        neighbours = list()
+        for i in range(max(0, row - count),
+                       min(self._model.rowCount(), row + count + 1)):
+            if i != row:
+                neighbours.append(self._model.str_at(i))
+        return neighbours
 
     def mark_str(self, string: str):
         """
@@ -126,19 +176,13 @@ class StrBrowser(QWidget):
 
         :param string: str to highlight
         """
-        item = self._str_2_item[string]
-        item.setForeground(QBrush(QColor(self._mark_color[0])))
-        item.setBackground(QBrush(QColor(self._mark_color[1])))
-        self._marked_items.append(item)
+        self._model.set_marked(string)
 
     def unmark_all(self):
         """
         This method unmarks all the marked strings.
         """
-        for item in self._marked_items:
-            item.setForeground(QBrush(QColor(self._default_colors[0])))
-            item.setBackground(QBrush(QColor(self._default_colors[1])))
-        self._marked_items.clear()
+        self._model.clear_marks()
 
     def add_a_str(self, string: str):
         """
@@ -146,7 +190,7 @@ class StrBrowser(QWidget):
 
         :param string: string to remove
         """
-        self._add_a_str(string)
+        self._model.add_str(string)
 
     def rem_a_str(self, string: str):
         """
@@ -155,11 +199,9 @@ class StrBrowser(QWidget):
 
         :param string: string to remove
         """
-        self.ui.listWidget.takeItem(
-            self.ui.listWidget.indexFromItem(
-                self._str_2_item.pop(string)).row())
-        if self.ui.listWidget.count() > 0:
-            self.ui.listWidget.setCurrentRow(0)
+        self._model.remove_str(string)
+        if self._model.rowCount() > 0:
+            self.ui.listView.setCurrentIndex(self._model.index(0))
         self._str_selected()
 
     @property
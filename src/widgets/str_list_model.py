@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+#
+# This file is a part of Definator (https://github.com/aparaatti/definator)
+# and it is licensed under the GPLv3 (http://www.gnu.org/licenses/gpl-3.0.txt).
+#
+from bisect import bisect_left
+
+from PyQt5.QtCore import Qt, QAbstractListModel, QModelIndex
+from PyQt5.QtGui import QBrush, QColor
+
+from ..data.str_filter import StrFilter
+
+
+class StrListModel(QAbstractListModel):
+    """
+    List model over a sorted list of strings. The view asks only the rows it
+    shows, so no item objects are made for the strings.
+
+    The shown strings can be filtered with a query, see StrFilter. The rows
+    of the model are then the matching strings.
+
+    Marked strings are shown with the mark colors, a list with the
+    foreground color in [0] and the background color in [1].
+
+    :param: mark_color, list of the mark colors
+    :param: parent, parent QObject of this QObject.
+    """
+    def __init__(self, mark_color: list, parent=None):
+        super(StrListModel, self).__init__(parent)
+        self._strs = list()
+        self._marked = set()
+        self._filter = StrFilter()
+        self._query = ""
+        # Indexes of the shown strings in _strs, None when not filtered:
+        self._rows = None
+        self.mark_color = mark_color
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        if self._rows is not None:
+            return len(self._rows)
+        return len(self._strs)
+
+    def data(self, index: QModelIndex, role: int=Qt.DisplayRole):
+        if not index.isValid() or index.row() >= self.rowCount():
+            return None
+        string = self.str_at(index.row())
+        if role == Qt.DisplayRole:
+            return string
+        if string in self._marked:
+            if role == Qt.ForegroundRole:
+                return QBrush(QColor(self.mark_color[0]))
+            if role == Qt.BackgroundRole:
+                return QBrush(QColor(self.mark_color[1]))
+        return None
+
+    @property
+    def strs(self):
+        """
+        All the strings in sorted order as a list, also the ones filtered
+        out.
+        """
+        return list(self._strs)
+
+    @property
+    def fuzzy(self):
+        return self._filter.fuzzy
+
+    @fuzzy.setter
+    def fuzzy(self, fuzzy: bool):
+        self._filter.fuzzy = fuzzy
+        self.set_query(self._query)
+
+    def _index_of(self, string: str):
+        index = bisect_left(self._strs, string)
+        if index < len(self._strs) and self._strs[index] == string:
+            return index
+        return -1
+
+    def row_of(self, string: str):
+        """
+        Returns the row of the string or -1, if it is not shown.
+        """
+        index = self._index_of(string)
+        if index < 0 or self._rows is None:
+            return index
+        row = bisect_left(self._rows, index)
+        if row < len(self._rows) and self._rows[row] == index:
+            return row
+        return -1
+
+    def str_at(self, row: int):
+        if self._rows is not None:
+            return self._strs[self._rows[row]]
+        return self._strs[row]
+
+    def set_query(self, query: str):
+        """
+        Shows only the strings matching the query.
+        """
+        self.beginResetModel()
+        self._query = query
+        self._rows = self._filter.filter(query)
+        self.endResetModel()
+
+    def set_strs(self, str_list: list):
+        """
+        Replaces the strings of the model. The marks are cleared.
+        """
+        self.beginResetModel()
+        self._strs = sorted(set(str_list))
+        self._filter.set_strs(self._strs)
+        self._rows = self._filter.filter(self._query)
+        self._marked.clear()
+        self.endResetModel()
+
+    def add_strs(self, str_list: list):
+        """
+        Adds many strings. A sorted chunk following the current strings, eg.
+        the next chunk of the terms of a project, is appended as it is,
+        otherwise the strings are merged into the sorted list.
+        """
+        new = sorted(set(str_list))
+        if not new:
+            return
+        if self._strs and new[0] <= self._strs[-1]:
+            self.set_strs(set(self._strs).union(new))
+        elif self._rows is not None:
+            self.beginResetModel()
+            self._strs.extend(new)
+            self._filter.extend(new)
+            self._rows = self._filter.filter(self._query)
+            self.endResetModel()
+        else:
+            first = len(self._strs)
+            self.beginInsertRows(QModelIndex(), first, first + len(new) - 1)
+            self._strs.extend(new)
+            self._filter.extend(new)
+            self.endInsertRows()
+
+    def add_str(self, string: str):
+        index = bisect_left(self._strs, string)
+        if index < len(self._strs) and self._strs[index] == string:
+            return
+        if self._rows is not None:
+            self.beginResetModel()
+            self._strs.insert(index, string)
+            self._filter.insert(index, string)
+            self._rows = self._filter.filter(self._query)
+            self.endResetModel()
+        else:
+            self.beginInsertRows(QModelIndex(), index, index)
+            self._strs.insert(index, string)
+            self._filter.insert(index, string)
+            self.endInsertRows()
+
+    def remove_str(self, string: str):
+        index = self._index_of(string)
+        if index < 0:
+            return
+        if self._rows is not None:
+            self.beginResetModel()
+            del self._strs[index]
+            self._filter.remove(index)
+            self._rows = self._filter.filter(self._query)
+            self.endResetModel()
+        else:
+            self.beginRemoveRows(QModelIndex(), index, index)
+            del self._strs[index]
+            self._filter.remove(index)
+            self.endRemoveRows()
+        self._marked.discard(string)
+
+    def set_marked(self, string: str, marked: bool=True):
+        if marked:
+            self._marked.add(string)
+        else:
+            self._marked.discard(string)
+        row = self.row_of(string)
+        if row >= 0:
+            index = self.index(row)
+            self.dataChanged.emit(
+                index, index, [Qt.ForegroundRole, Qt.BackgroundRole])
+
+    def clear_marks(self):
+        for string in list(self._marked):
+            self.set_marked(string, False)
@@ -36,7 +36,7 @@ class TermDisplay(QWidget):
         This slot sets the term to display.
         """
         self._html = term.term_as_html
-        self.ui.contentWebView.setHtml(term.term_as_html, QUrl("file://"))
+        self.ui.contentWebView.setHtml(self._html, QUrl("file://"))
 
     @pyqtSlot(QUrl)
     def _map_to_signal(self, url: QUrl):